@@ -0,0 +1,72 @@
+"""
+Benchmarks of the clustering of enrollments into households and episodes.
+
+The co-occurrence kernels are timed on growing numbers of enrollments, for
+scaling curves of time against rows. `time_co_occurrence` compares every
+pair of rows in a dense matrix, so it is timed on fewer rows.
+"""
+import puget.cluster as cluster
+
+from .common import enrollment_rows
+
+# Numbers of enrollments of the scaling curves:
+GROUP_ROWS = [1000, 3000, 10000, 30000, 100000]
+TIME_ROWS = [250, 500, 1000, 2000, 4000]
+
+
+class GroupsCoOccurrence(object):
+    """Scaling of groups_co_occurrence, with a sparse matrix."""
+    params = GROUP_ROWS
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.df = enrollment_rows(n_rows)
+
+    def time_groups_co_occurrence(self, n_rows):
+        cluster.groups_co_occurrence(self.df, 'PersonalID', 'HouseholdID',
+                                     sparse=True)
+
+    def peakmem_groups_co_occurrence(self, n_rows):
+        cluster.groups_co_occurrence(self.df, 'PersonalID', 'HouseholdID',
+                                     sparse=True)
+
+
+class TimeCoOccurrence(object):
+    """Scaling of time_co_occurrence."""
+    params = TIME_ROWS
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.df = enrollment_rows(n_rows)
+
+    def time_time_co_occurrence(self, n_rows):
+        cluster.time_co_occurrence(self.df, 'PersonalID',
+                                   ['EntryDate', 'ExitDate'],
+                                   time_unit='D', time_delta=1)
+
+    def peakmem_time_co_occurrence(self, n_rows):
+        cluster.time_co_occurrence(self.df, 'PersonalID',
+                                   ['EntryDate', 'ExitDate'],
+                                   time_unit='D', time_delta=1)
+
+
+class Cluster(object):
+    """Time and peak memory of clustering by household and entry date."""
+    params = TIME_ROWS
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.df = enrollment_rows(n_rows)
+
+    def time_cluster(self, n_rows):
+        cluster.cluster(self.df.copy(), 'PersonalID',
+                        group_var='HouseholdID', time_var=['EntryDate'],
+                        time_unit='D')
+
+    def peakmem_cluster(self, n_rows):
+        cluster.cluster(self.df.copy(), 'PersonalID',
+                        group_var='HouseholdID', time_var=['EntryDate'],
+                        time_unit='D')
@@ -0,0 +1,87 @@
+"""
+Benchmarks of record linkage of the client records of synthetic extracts.
+
+Besides the time and peak memory of `link_records`, the throughput in
+compared pairs per second and the pairwise precision and recall of the links
+against the extract's ground truth are tracked, so that speed-ups that
+change the links show up. The extracts are made with the error rates of
+`common.LINKAGE_RATES`, so that not every link is found.
+"""
+import time
+
+from puget.metrics import RunReport
+from puget.recordlinkage import link_records, pairwise_precision_recall
+
+from .common import SIZES, prelink_records
+
+LINK_LIST = [{'block_variable': 'lname',
+              'match_variables': {'fname': 'string',
+                                  'ssn_as_str': 'string',
+                                  'dob': 'date'}},
+             {'block_variable': 'dob',
+              'match_variables': {'fname': 'string',
+                                  'lname': 'string',
+                                  'ssn_as_str': 'string'}},
+             {'block_variable': 'ssn_as_str',
+              'match_variables': {'fname': 'string',
+                                  'lname': 'string',
+                                  'dob': 'date'},
+              'near_match_variable': 'ssn_as_str'}]
+
+
+def _link(records):
+    """Link the records, returning the linked PIDs and the pairs/second."""
+    report = RunReport()
+    start = time.perf_counter()
+    linked = link_records(records.copy(), LINK_LIST,
+                          string_method='batch_jarowinkler', report=report)
+    elapsed = time.perf_counter() - start
+    n_pairs = sum(stage.counts.get('n_pairs', 0) for stage in report.stages)
+    return linked['linkage_PID'].values, n_pairs / elapsed
+
+
+class LinkRecords(object):
+    """Time and peak memory of link_records."""
+    params = SIZES
+    param_names = ['n_people']
+    timeout = 1800
+
+    def setup(self, n_people):
+        self.records, self.truth = prelink_records(n_people)
+
+    def time_link_records(self, n_people):
+        _link(self.records)
+
+    def peakmem_link_records(self, n_people):
+        _link(self.records)
+
+
+class LinkAccuracy(object):
+    """
+    Throughput and accuracy of link_records, from one linkage of each size.
+    """
+    params = SIZES
+    param_names = ['n_people']
+    timeout = 3600
+
+    def setup_cache(self):
+        results = {}
+        for n_people in SIZES:
+            records, truth = prelink_records(n_people)
+            pids, pairs_per_second = _link(records)
+            precision, recall = pairwise_precision_recall(pids, truth)
+            results[n_people] = {'pairs_per_second': pairs_per_second,
+                                 'precision': precision, 'recall': recall}
+        return results
+
+    def track_pairs_per_second(self, results, n_people):
+        return results[n_people]['pairs_per_second']
+    track_pairs_per_second.unit = 'pairs/s'
+
+    def track_precision(self, results, n_people):
+        return results[n_people]['precision']
+    track_precision.unit = 'fraction'
+
+    def track_recall(self, results, n_people):
+        return results[n_people]['recall']
+    track_recall.unit = 'fraction'
@@ -0,0 +1,87 @@
+"""
+Benchmark comparing Bloom-filter encoded names against plaintext ones.
+
+Usage::
+
+    python -m benchmarks.bench_pprl [n_pairs]
+
+By default 1 million pairs of name-like strings are encoded with
+`puget.pprl.encode_records` and compared by the Dice similarity of their
+filters, as the "bloom" comparison of `link_records` does, and the same
+pairs are compared in plaintext with the batched Jaro-Winkler kernel. The
+throughput of each is reported in pairs per second.
+
+`BloomCompare` runs the same comparisons in the benchmark suite.
+"""
+import sys
+import time
+import pandas as pd
+
+import puget.pprl as pprl
+import puget.string_similarity as pss
+
+from .bench_string_similarity import make_pairs
+
+N_PAIRS = 1000000
+
+
+def encode_pairs(s1, s2):
+    """The filters of each side of the pairs, as uint64 arrays."""
+    encoded = pprl.encode_records(pd.DataFrame({'s1': s1, 's2': s2}),
+                                  ['s1', 's2'], 'secret')
+    return (encoded[pprl.filter_columns('s1', encoded.columns)].values,
+            encoded[pprl.filter_columns('s2', encoded.columns)].values)
+
+
+def main(n_pairs=N_PAIRS):
+    s1, s2 = make_pairs(n_pairs)
+    t0 = time.time()
+    f1, f2 = encode_pairs(s1, s2)
+    t_encode = time.time() - t0
+
+    t0 = time.time()
+    pprl.dice_similarity(f1, f2)
+    t_bloom = time.time() - t0
+
+    t0 = time.time()
+    pss.jarowinkler_similarity(s1, s2)
+    t_plain = time.time() - t0
+
+    print('%d pairs: encoding %0.1f s; bloom %0.0f pairs/s; '
+          'plaintext jarowinkler %0.0f pairs/s' %
+          (n_pairs, t_encode, n_pairs / t_bloom, n_pairs / t_plain))
+
+
+class BloomCompare(object):
+    """Throughput of the Bloom-filter and plaintext comparisons."""
+    params = [100000, 1000000]
+    param_names = ['n_pairs']
+
+    def setup(self, n_pairs):
+        self.s1, self.s2 = make_pairs(n_pairs)
+        self.f1, self.f2 = encode_pairs(self.s1, self.s2)
+
+    def time_bloom(self, n_pairs):
+        pprl.dice_similarity(self.f1, self.f2)
+
+    def time_plaintext(self, n_pairs):
+        pss.jarowinkler_similarity(self.s1, self.s2)
+
+    def track_bloom_pairs_per_second(self, n_pairs):
+        start = time.perf_counter()
+        pprl.dice_similarity(self.f1, self.f2)
+        return n_pairs / (time.perf_counter() - start)
+    track_bloom_pairs_per_second.unit = 'pairs/s'
+
+    def track_plaintext_pairs_per_second(self, n_pairs):
+        start = time.perf_counter()
+        pss.jarowinkler_similarity(self.s1, self.s2)
+        return n_pairs / (time.perf_counter() - start)
+    track_plaintext_pairs_per_second.unit = 'pairs/s'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,46 @@
+"""
+Benchmarks of the table loaders and of merge_tables on synthetic extracts.
+"""
+import puget.preprocess as pp
+
+from .common import COUNTY, SIZES, extract_dir
+
+
+class Loaders(object):
+    """Time and peak memory of reading an extract's client table."""
+    params = SIZES
+    param_names = ['n_people']
+    timeout = 600
+
+    def setup(self, n_people):
+        self.data_dir = extract_dir(n_people)
+
+    def time_read_table(self, n_people):
+        pp.read_table(pp.TABLE_FILES['client'], data_dir=self.data_dir,
+                      paths=pp.COUNTY_FOLDERS[COUNTY], dedup=False)
+
+    def peakmem_read_table(self, n_people):
+        pp.read_table(pp.TABLE_FILES['client'], data_dir=self.data_dir,
+                      paths=pp.COUNTY_FOLDERS[COUNTY], dedup=False)
+
+    def time_get_client(self, n_people):
+        pp.get_client(county=COUNTY, data_dir=self.data_dir)
+
+    def peakmem_get_client(self, n_people):
+        pp.get_client(county=COUNTY, data_dir=self.data_dir)
+
+
+class MergeTables(object):
+    """Time and peak memory of merging an extract's tables."""
+    params = SIZES
+    param_names = ['n_people']
+    timeout = 1800
+
+    def setup(self, n_people):
+        self.data_dir = extract_dir(n_people)
+
+    def time_merge_tables(self, n_people):
+        pp.merge_tables(county=COUNTY, data_dir=self.data_dir)
+
+    def peakmem_merge_tables(self, n_people):
+        pp.merge_tables(county=COUNTY, data_dir=self.data_dir)
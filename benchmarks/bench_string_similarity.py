@@ -0,0 +1,99 @@
+"""
+Benchmark the batched string similarity kernels against recordlinkage.
+
+Usage::
+
+    python benchmarks/bench_string_similarity.py [n_pairs]
+
+By default 10 million pairs of name-like strings are compared with the
+batched kernels in `puget.string_similarity`. The per-pair recordlinkage
+comparison is timed on a subset of the pairs, and its throughput is
+reported in pairs per second for comparison.
+
+`StringSimilarity` runs the same comparisons in the benchmark suite.
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from recordlinkage.algorithms.string import (jarowinkler_similarity as
+                                             rl_jarowinkler,
+                                             levenshtein_similarity as
+                                             rl_levenshtein)
+
+import puget.string_similarity as pss
+
+N_PAIRS = 10000000
+
+# Number of pairs to time the per-pair recordlinkage comparison on:
+N_PAIRS_RL = 500000
+
+# Batched and per-pair kernel of each method:
+METHODS = {'jarowinkler': (pss.jarowinkler_similarity, rl_jarowinkler),
+           'levenshtein': (pss.levenshtein_similarity, rl_levenshtein)}
+
+
+def make_pairs(n_pairs, seed=0):
+    """Make pairs of name-like strings, about half of them with a typo."""
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    names = np.array([''.join(rng.choice(letters, rng.randint(3, 12)))
+                      for _ in range(10000)], dtype=object)
+    s1 = names[rng.randint(0, len(names), n_pairs)]
+    s2 = s1.copy()
+    typo = rng.rand(n_pairs) < 0.5
+    s2[typo] = pd.Series(s2[typo]).str.slice_replace(
+        1, 2, 'X').values
+    other = rng.rand(n_pairs) < 0.25
+    s2[other] = names[rng.randint(0, len(names), other.sum())]
+    return s1, s2
+
+
+def main(n_pairs=N_PAIRS):
+    s1, s2 = make_pairs(n_pairs)
+    n_rl = min(n_pairs, N_PAIRS_RL)
+    for name, (batched, per_pair) in METHODS.items():
+        t0 = time.time()
+        batched(s1, s2)
+        t_batched = time.time() - t0
+
+        t0 = time.time()
+        per_pair(pd.Series(s1[:n_rl]), pd.Series(s2[:n_rl]))
+        t_rl = time.time() - t0
+
+        print('%s: batched %d pairs in %0.1f s (%0.0f pairs/s); '
+              'recordlinkage %0.0f pairs/s' %
+              (name, n_pairs, t_batched, n_pairs / t_batched, n_rl / t_rl))
+
+
+class StringSimilarity(object):
+    """Throughput of the batched kernels and of recordlinkage's."""
+    params = (list(METHODS), [100000, 1000000])
+    param_names = ['method', 'n_pairs']
+
+    def setup(self, method, n_pairs):
+        self.s1, self.s2 = make_pairs(n_pairs)
+
+    def time_batched(self, method, n_pairs):
+        METHODS[method][0](self.s1, self.s2)
+
+    def track_batched_pairs_per_second(self, method, n_pairs):
+        start = time.perf_counter()
+        METHODS[method][0](self.s1, self.s2)
+        return n_pairs / (time.perf_counter() - start)
+    track_batched_pairs_per_second.unit = 'pairs/s'
+
+    def track_recordlinkage_pairs_per_second(self, method, n_pairs):
+        n_rl = min(n_pairs, N_PAIRS_RL)
+        start = time.perf_counter()
+        METHODS[method][1](pd.Series(self.s1[:n_rl]),
+                           pd.Series(self.s2[:n_rl]))
+        return n_rl / (time.perf_counter() - start)
+    track_recordlinkage_pairs_per_second.unit = 'pairs/s'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
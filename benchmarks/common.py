@@ -0,0 +1,83 @@
+"""
+Synthetic data shared by the benchmarks.
+
+Extracts are made with `puget.synth.generate` the first time they are
+needed, and kept in the directory in the PUGET_BENCHMARK_DATA environment
+variable (default: puget_benchmarks in the temporary directory), so the
+benchmarks of each size, and later runs, reuse them.
+"""
+import os
+import os.path as op
+import tempfile
+import pandas as pd
+
+import puget.preprocess as pp
+from puget.synth import TRUTH_FILE, generate
+
+# Number of people in the extracts of the benchmarks of each entry point:
+SIZES = [1000, 10000, 100000]
+
+# County whose folders the extracts are written to:
+COUNTY = 'king'
+
+# Error rates of the extracts the linkage is benchmarked on, higher than the
+# defaults of `generate` so that the links aren't all recovered:
+LINKAGE_RATES = {'duplicate_rate': 0.3, 'split_rate': 0.5, 'typo_rate': 1.0,
+                 'nickname_rate': 0.9}
+
+DATA_DIR = os.environ.get('PUGET_BENCHMARK_DATA',
+                          op.join(tempfile.gettempdir(), 'puget_benchmarks'))
+
+
+def extract_dir(n_people, linkage=False):
+    """
+    The directory of the synthetic extract of n_people, made if needed,
+    with the LINKAGE_RATES if `linkage`.
+    """
+    name = 'linkage_extract_%d' if linkage else 'extract_%d'
+    data_dir = op.join(DATA_DIR, name % n_people)
+    # The ground truth is written last, so its presence means the extract
+    # is complete
+    if not op.exists(op.join(data_dir, TRUTH_FILE)):
+        generate(data_dir, county=COUNTY, n_people=n_people, seed=0,
+                 **(LINKAGE_RATES if linkage else {}))
+    return data_dir
+
+
+def read_truth(n_people, linkage=False):
+    """The ground truth person of each PersonalID in an extract."""
+    return pd.read_csv(op.join(extract_dir(n_people, linkage=linkage),
+                               TRUTH_FILE))
+
+
+def enrollment_rows(n_rows):
+    """
+    The first n_rows enrollments of the extract of the largest size, with
+    their exit dates, for the scaling curves of the clustering kernels.
+    """
+    data_dir = extract_dir(SIZES[-1])
+    enrollment = pp.get_enrollment(county=COUNTY, groups=False,
+                                   data_dir=data_dir)
+    exits = pp.get_exit(county=COUNTY, data_dir=data_dir)
+    df = enrollment.merge(exits, on='ProjectEntryID', how='left')
+    return df.head(n_rows).reset_index(drop=True)
+
+
+def prelink_records(n_people, linkage=True):
+    """
+    The client records of an extract (by default the one with the
+    LINKAGE_RATES), one per PersonalID, with the columns of the link lists,
+    and the true person of each.
+    """
+    client = pp.read_table(pp.TABLE_FILES['client'],
+                           data_dir=extract_dir(n_people, linkage=linkage),
+                           paths=pp.COUNTY_FOLDERS[COUNTY], dedup=False)
+    client = client.drop_duplicates('PersonalID').reset_index(drop=True)
+    ssn = client['SSN'].astype(str).str.zfill(9)
+    records = pd.DataFrame({'pid0': client['PersonalID'],
+                            'fname': client['FirstName'],
+                            'lname': client['LastName'],
+                            'ssn_as_str': ssn,
+                            'dob': pd.to_datetime(client['DOB'])})
+    truth = read_truth(n_people, linkage=linkage).set_index('PersonalID')['PersonID']
+    return records, truth.loc[records['pid0']].values
@@ -0,0 +1,161 @@
+"""
+Checkpoints of the stages of a pipeline, so that a rerun can resume.
+
+A `StageCheckpoints` object is given the stages of a pipeline, in order,
+with a fingerprint of the inputs of each stage. The output of each stage is
+written to a file in a run directory, and a manifest there records the
+fingerprint each checkpoint was made from. When the pipeline is run again
+with the same run directory, the stages whose fingerprints are unchanged are
+loaded instead of recomputed, and the stages before the last checkpoint that
+can be resumed from are skipped entirely.
+
+The fingerprint of a stage should include the fingerprint of the stage
+before it (see `chain_fingerprints`), so a change of input invalidates every
+later stage.
+
+Checkpoints are pickled DataFrames, which keep the column dtypes exactly.
+"""
+import hashlib
+import json
+import os
+import os.path as op
+import pandas as pd
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_fingerprint(fname):
+    """
+    Fingerprint of a file: its absolute path, size and modification time.
+
+    This is much cheaper than hashing the contents of large csv files, and
+    changes whenever a file is rewritten.
+    """
+    stat = os.stat(fname)
+    return [op.abspath(fname), stat.st_size, stat.st_mtime_ns]
+
+
+def chain_fingerprints(stages, inputs):
+    """
+    Fingerprints of a chain of stages.
+
+    Parameters
+    ----------
+    stages : list
+        Names of the stages, in order.
+
+    inputs : dict
+        JSON serializable description of the inputs of each stage, besides
+        the output of the stage before it, keyed by stage name. Stages that
+        are missing have no other inputs.
+
+    Returns
+    -------
+    dict of the fingerprint (a hex digest) of each stage, which depends on
+    its inputs and on the fingerprint of the stage before it.
+    """
+    fingerprints = {}
+    previous = ''
+    for stage in stages:
+        description = json.dumps([stage, previous, inputs.get(stage, None)],
+                                 sort_keys=True, default=str)
+        previous = hashlib.sha1(description.encode('utf-8')).hexdigest()
+        fingerprints[stage] = previous
+    return fingerprints
+
+
+class StageCheckpoints(object):
+    """
+    Checkpoints of the stages of a pipeline in a run directory.
+
+    Parameters
+    ----------
+    run_dir : string
+        Directory for the checkpoints and the manifest; created if it
+        doesn't exist. If None, nothing is checkpointed and every stage is
+        computed.
+
+    fingerprints : dict
+        Fingerprint of each stage, keyed by stage name, in the order the
+        stages are run (see `chain_fingerprints`).
+
+    resume_stages : list
+        The stages that can be resumed from: stages whose outputs hold
+        everything the rest of the pipeline needs. Defaults to all stages.
+    """
+    def __init__(self, run_dir, fingerprints, resume_stages=None):
+        self.run_dir = run_dir
+        self.fingerprints = fingerprints
+        self.stages = list(fingerprints)
+        self.manifest = {}
+        self.resume_from = None
+        if run_dir is None:
+            return
+
+        os.makedirs(run_dir, exist_ok=True)
+        manifest_file = op.join(run_dir, MANIFEST_FILE)
+        if op.exists(manifest_file):
+            with open(manifest_file) as f:
+                self.manifest = json.load(f)
+        if resume_stages is None:
+            resume_stages = self.stages
+        valid = [stage for stage in resume_stages if self.is_valid(stage)]
+        if len(valid) > 0:
+            self.resume_from = max(valid, key=self.stages.index)
+
+    def is_valid(self, stage):
+        """Whether the stage has a checkpoint with its current fingerprint."""
+        if self.run_dir is None or stage not in self.manifest:
+            return False
+        entry = self.manifest[stage]
+        return (entry['fingerprint'] == self.fingerprints[stage] and
+                op.exists(op.join(self.run_dir, entry['file'])))
+
+    def is_skipped(self, stage):
+        """Whether the stage is before the checkpoint being resumed from."""
+        return (self.resume_from is not None and
+                self.stages.index(stage) < self.stages.index(self.resume_from))
+
+    def stage(self, name, compute):
+        """
+        Run a stage, or load its checkpoint.
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage.
+
+        compute : function
+            Function with no arguments that computes the stage's output, a
+            DataFrame.
+
+        Returns
+        -------
+        The stage's output, or None if the stage is skipped because a later
+        checkpoint is resumed from.
+        """
+        if self.is_skipped(name):
+            return None
+        if self.is_valid(name):
+            return pd.read_pickle(op.join(self.run_dir,
+                                          self.manifest[name]['file']))
+        df = compute()
+        if self.run_dir is not None:
+            self._save(name, df)
+        return df
+
+    def _save(self, name, df):
+        """Write a stage's checkpoint and record it in the manifest."""
+        fname = '%s.pkl' % name
+        # Write to temporary files and rename, so that a run that dies while
+        # writing leaves the previous checkpoint and manifest intact.
+        temp_file = op.join(self.run_dir, fname + '.tmp')
+        df.to_pickle(temp_file)
+        os.replace(temp_file, op.join(self.run_dir, fname))
+
+        self.manifest[name] = {'fingerprint': self.fingerprints[name],
+                               'file': fname, 'n_rows': int(df.shape[0])}
+        manifest_file = op.join(self.run_dir, MANIFEST_FILE)
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(manifest_file + '.tmp', manifest_file)
@@ -3,10 +3,12 @@
 """
 import numpy as np
 import pandas as pd
-import itertools
 from scipy.sparse import csr_matrix
 import networkx as nx
 
+from puget.ids import encode_ids
+from puget.metrics import RunReport
+
 
 def make_mapping(unique_individuals):
     """
@@ -29,6 +31,37 @@ def make_mapping(unique_individuals):
     return mapping
 
 
+def _individual_codes(df, individual_var, mapping=None):
+    """
+    Indices of the individuals of each row into the co-occurrence matrix.
+
+    Individuals are encoded with `puget.ids.encode_ids`, in order of first
+    appearance (the same indices as `make_mapping(df[individual_var].
+    unique())`), unless a mapping dict is given, in which case a ValueError
+    is raised if some of the individuals aren't in it.
+
+    Returns
+    -------
+    codes : ndarray
+        The index of each row's individual.
+
+    n : int
+        The number of individuals (the size of the matrix), which with a
+        mapping is the mapping's range.
+    """
+    if mapping is None:
+        codes, uniques = encode_ids(df[individual_var])
+        return codes, len(uniques)
+    codes = df[individual_var].map(mapping)
+    if codes.isnull().any():
+        unmapped = df[individual_var][codes.isnull()].unique()
+        raise ValueError("individuals missing from the mapping: %s" %
+                         ', '.join(str(i) for i in unmapped))
+    codes = codes.values.astype(np.int64)
+    # The mapping may cover individuals that aren't in df
+    return codes, max(mapping.values()) + 1 if mapping else 0
+
+
 def groups_co_occurrence(df, individual_var, group_var, T=None,
                          mapping=None, sparse=None):
     """
@@ -53,8 +86,9 @@ def groups_co_occurrence(df, individual_var, group_var, T=None,
 
     mapping : dict, optional
         If provided, defines a mapping between individual identifiers and
-        indices in the T array. Default: None, which implies this dict
-        is generated on the fly.
+        indices in the T array, which must cover all the individuals of df.
+        Default: None, which implies the individuals are encoded on the fly
+        (see `puget.ids.encode_ids`).
 
     sparse : bool, optional
         Whether to use a sparse CSR matrix to represent the graph.
@@ -65,38 +99,26 @@ def groups_co_occurrence(df, individual_var, group_var, T=None,
     (mapped through mapping and inv_mapping) have appeared together in the
     same group.
     """
-    unique_individuals = df[individual_var].unique()
+    codes, n_individuals = _individual_codes(df, individual_var, mapping)
     if T is None:
         if not sparse:
-            T = np.zeros((unique_individuals.shape[0],
-                          unique_individuals.shape[0]))
-    if mapping is None:
-        mapping = make_mapping(unique_individuals)
-    else:
-        mapping = mapping
-    gb = df.groupby(group_var)
+            T = np.zeros((n_individuals, n_individuals))
+
+    # Each pair of distinct individuals in each group, both ways round:
+    members = pd.DataFrame({'group': encode_ids(df[group_var])[0],
+                            'individual': codes})
+    members = members[(members['group'] >= 0) &
+                      (members['individual'] >= 0)].drop_duplicates()
+    pairs = members.merge(members, on='group')
+    pairs = pairs[pairs['individual_x'] != pairs['individual_y']]
+    rows = pairs['individual_x'].values
+    cols = pairs['individual_y'].values
 
     if sparse:
-        rows = []
-        cols = []
-        for gid, group in gb:
-            ids = group[individual_var].unique()
-            pairs = itertools.permutations(ids, 2)
-            for pair in pairs:
-                rows.append(mapping[pair[0]])
-                cols.append(mapping[pair[1]])
-        T = csr_matrix((np.ones(len(cols)), (rows, cols)))
+        T = csr_matrix((np.ones(len(cols)), (rows, cols)),
+                       shape=(n_individuals, n_individuals))
     else:
-        for gid, group in gb:
-            ids = group[individual_var].unique()
-            pairs = itertools.permutations(ids, 2)
-            rows = []
-            cols = []
-            for pair in pairs:
-                rows.append(mapping[pair[0]])
-                cols.append(mapping[pair[1]])
-            T[rows, cols] = T[rows, cols] + 1
-
+        np.add.at(T, (rows, cols), 1)
 
     return T
 
@@ -118,14 +140,9 @@ def time_co_occurrence(df, individual_var, time_var, time_unit='ns',
         How many of the time-unit is still considered "co-occurrence"?
         (default: 0).
     """
-    unique_individuals = df[individual_var].unique()
+    codes, n_individuals = _individual_codes(df, individual_var, mapping)
     if T is None:
-        T = np.zeros((unique_individuals.shape[0],
-                      unique_individuals.shape[0]))
-    if mapping is None:
-        mapping = make_mapping(unique_individuals)
-    else:
-        mapping = mapping
+        T = np.zeros((n_individuals, n_individuals))
 
     # We'll identify differences as things smaller than this:
     dt0 = np.timedelta64(time_delta, time_unit)
@@ -136,8 +153,8 @@ def time_co_occurrence(df, individual_var, time_var, time_unit='ns',
         # Anything larger than the time_delta would do here:
         diff[pd.isnull(diff)] = np.timedelta64(time_delta + 1, 'ns')
         idx = np.where(np.abs(diff) <= dt0)
-        rows = [mapping[ii] for ii in df[individual_var][idx[0]]]
-        cols = [mapping[ii] for ii in df[individual_var][idx[1]]]
+        rows = codes[idx[0]]
+        cols = codes[idx[1]]
         # Increment the co-occurence matrix where relevant:
         T[rows, cols] = T[rows, cols] + 1
 
@@ -148,7 +165,7 @@ def time_co_occurrence(df, individual_var, time_var, time_unit='ns',
 
 
 def cluster(df, individual_var, group_var=None, time_var=None, time_unit='ns',
-            time_delta=0, sparse=False):
+            time_delta=0, sparse=False, report=None, profile=None):
     """
     Calculate clusters from a co-occurrence matrix
 
@@ -166,40 +183,52 @@ def cluster(df, individual_var, group_var=None, time_var=None, time_unit='ns',
     sparse : bool, optional
         Whether to use a sparse CSR matrix to represent the graph. This may
         slow things down, but might be necessary for really large datasets.
+    report : puget.metrics.RunReport, optional
+        Report in which to record the metrics of the co-occurrence and
+        clustering stages.
+    profile : string, optional
+        Directory in which to write a cProfile .pstats file of each stage,
+        whose top hotspots are also printed.
     """
-    unique_individuals = df[individual_var].unique()
-
-    if sparse:
-        T = None
-    else:
-        T = np.zeros((unique_individuals.shape[0],
-                      unique_individuals.shape[0]))
-
-    mapping = make_mapping(unique_individuals)
-
-    if group_var is not None:
-        T = groups_co_occurrence(df, individual_var, group_var, T=T,
-                                 mapping=mapping, sparse=sparse)
-
-    if time_var is not None:
-        if sparse:
-            raise NotImplementedError("""Can't use sparse matrices with
-                                         time variable""")
-        T = time_co_occurrence(df, individual_var, time_var,
-                               time_unit=time_unit,
-                               time_delta=time_delta,
-                               T=T, mapping=mapping)
-
-    clusters = {}
-    if not sparse:
-        T[np.tril_indices(T.shape[0])] = 0
-        G = nx.Graph(T)
-    else:
-        G = nx.from_scipy_sparse_matrix(T)
-
-    for i, c in enumerate(nx.connected_components(G)):
-        for j in c:
-            clusters[j] = i + 1
-
-    df['cluster'] = df[individual_var].apply(lambda x: clusters[mapping[x]])
+    if report is None:
+        report = RunReport()
+
+    with report.profiling(profile):
+        with report.stage('co_occurrence', n_rows_in=df.shape[0]) as metrics:
+            # Dense indices of the individuals, rather than a dict mapping:
+            codes, n_individuals = _individual_codes(df, individual_var)
+
+            if sparse:
+                T = None
+            else:
+                T = np.zeros((n_individuals, n_individuals))
+
+            if group_var is not None:
+                T = groups_co_occurrence(df, individual_var, group_var, T=T,
+                                         sparse=sparse)
+
+            if time_var is not None:
+                if sparse:
+                    raise NotImplementedError("""Can't use sparse matrices with
+                                                 time variable""")
+                T = time_co_occurrence(df, individual_var, time_var,
+                                       time_unit=time_unit,
+                                       time_delta=time_delta, T=T)
+            metrics.n_rows_out = n_individuals
+
+        with report.stage('clusters', n_rows_in=n_individuals) as metrics:
+            clusters = np.zeros(n_individuals, dtype=np.int64)
+            if not sparse:
+                T[np.tril_indices(T.shape[0])] = 0
+                G = nx.Graph(T)
+            else:
+                G = nx.from_scipy_sparse_matrix(T)
+
+            for i, c in enumerate(nx.connected_components(G)):
+                clusters[list(c)] = i + 1
+
+            df['cluster'] = clusters[codes]
+            metrics.n_rows_out = df.shape[0]
+            metrics.counts['n_clusters'] = (clusters.max() if n_individuals
+                                            else 0)
     return df
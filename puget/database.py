@@ -0,0 +1,232 @@
+"""
+A local SQLite store of the merged enrollments, for point lookups.
+
+Loading the whole `puget.preprocess.merge_tables` output into pandas to
+answer questions like "all enrollments of person X" or "who else was in
+household Y" is slow. `EnrollmentDatabase` stores the merged enrollments
+(and any other cleaned tables) in a SQLite file, with indexes on the person,
+enrollment and household IDs and the entry date, so these lookups read only
+the rows they need::
+
+    db = EnrollmentDatabase('king.sqlite')
+    db.load_merged(county='king', data_dir=data_dir)
+    db.enrollments(person_id=1234)
+    db.household_members(1234)
+
+Column dtypes are recorded when a table is loaded, so dates come back as
+datetimes.
+"""
+import sqlite3
+import pandas as pd
+
+from puget.preprocess import METADATA_FILES, get_metadata_dict, merge_tables
+
+# Table of the merged enrollments:
+ENROLLMENT_TABLE = 'enrollments'
+
+# Table recording the dtypes of the loaded tables' columns:
+DTYPE_TABLE = 'puget_dtypes'
+
+# Enrollment metadata entries naming the columns to index:
+INDEX_METADATA = ['person_ID', 'person_enrollment_ID', 'groupID_column',
+                  'entry_date']
+
+# Number of rows to insert at a time:
+CHUNK_SIZE = 100000
+
+
+def _sql_value(value):
+    """Convert numpy scalars to Python values that sqlite3 accepts."""
+    return value.item() if hasattr(value, 'item') else value
+
+
+class EnrollmentDatabase(object):
+    """
+    SQLite store of merged enrollments.
+
+    Parameters
+    ----------
+    fname : string
+        The database file, created if it doesn't exist.
+
+    metadata_file : string
+        Enrollment metadata file, which names the ID and entry date columns.
+    """
+    def __init__(self, fname, metadata_file=METADATA_FILES['enrollment']):
+        self.fname = fname
+        metadata = get_metadata_dict(metadata_file)
+        self.pid_column = metadata['person_ID']
+        self.enid_column = metadata['person_enrollment_ID']
+        self.household_column = metadata['groupID_column']
+        self.entry_date_column = metadata['entry_date']
+        self.index_columns = [metadata[key] for key in INDEX_METADATA]
+        self.connection = sqlite3.connect(fname)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS %s (table_name TEXT, column_name '
+            'TEXT, dtype TEXT)' % DTYPE_TABLE)
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
+
+    def load(self, df, table=ENROLLMENT_TABLE):
+        """
+        Store a table, replacing any table of the same name.
+
+        The columns in the index columns (person, enrollment and household
+        IDs and entry date) that the table has are indexed.
+
+        Parameters
+        ----------
+        df : dataframe
+            The table, e.g. from merge_tables or one of the get_* functions.
+
+        table : string
+            Name of the table in the database.
+        """
+        with self.connection:
+            df.to_sql(table, self.connection, if_exists='replace',
+                      index=False, chunksize=CHUNK_SIZE)
+            for column in self.index_columns:
+                if column in df.columns:
+                    self.connection.execute(
+                        'CREATE INDEX "ix_%s_%s" ON "%s" ("%s")' %
+                        (table, column, table, column))
+            self.connection.execute('DELETE FROM %s WHERE table_name = ?' %
+                                    DTYPE_TABLE, (table,))
+            self.connection.executemany(
+                'INSERT INTO %s VALUES (?, ?, ?)' % DTYPE_TABLE,
+                [(table, str(column), str(dtype))
+                 for column, dtype in df.dtypes.items()])
+
+    def load_merged(self, **kwargs):
+        """
+        Run merge_tables and store its output as the enrollments table.
+
+        Parameters
+        ----------
+        kwargs :
+            Passed to merge_tables.
+
+        Returns
+        ----------
+        the merged dataframe
+        """
+        df = merge_tables(**kwargs)
+        self.load(df)
+        return df
+
+    def _dtypes(self, table):
+        """The dtypes of a stored table's columns."""
+        rows = self.connection.execute(
+            'SELECT column_name, dtype FROM %s WHERE table_name = ?' %
+            DTYPE_TABLE, (table,)).fetchall()
+        return dict(rows)
+
+    def query(self, sql, params=(), table=ENROLLMENT_TABLE):
+        """
+        Run a SQL query.
+
+        Parameters
+        ----------
+        sql : string
+            The query, with ? placeholders for params.
+
+        params : sequence
+            Values of the placeholders.
+
+        table : string
+            Table whose recorded dtypes are used to convert the columns of
+            the result, e.g. to parse dates.
+
+        Returns
+        ----------
+        dataframe of the result
+        """
+        df = pd.read_sql_query(sql, self.connection, params=list(params))
+        for column, dtype in self._dtypes(table).items():
+            if column in df.columns and dtype.startswith('datetime64'):
+                df[column] = pd.to_datetime(df[column])
+        return df
+
+    def enrollments(self, person_id=None, enrollment_id=None,
+                    household_id=None, entry_dates=None, columns=None):
+        """
+        Look up enrollments by person, enrollment, household or entry date.
+
+        Parameters
+        ----------
+        person_id, enrollment_id, household_id :
+            ID (or list of IDs) to look up. Default is None (any).
+
+        entry_dates : tuple
+            (start, end) dates: enrollments with an entry date from start up
+            to (not including) end. Either can be None for an open-ended
+            range. Default is None (any).
+
+        columns : list
+            Columns to return. Default is None (all columns).
+
+        Returns
+        ----------
+        dataframe of the enrollments, in the order they were stored
+        """
+        conditions = []
+        params = []
+        for column, ids in [(self.pid_column, person_id),
+                            (self.enid_column, enrollment_id),
+                            (self.household_column, household_id)]:
+            if ids is None:
+                continue
+            if pd.api.types.is_list_like(ids):
+                ids = list(ids)
+            else:
+                ids = [ids]
+            conditions.append('"%s" IN (%s)' % (column,
+                                               ', '.join('?' * len(ids))))
+            params += [_sql_value(value) for value in ids]
+        if entry_dates is not None:
+            start, end = entry_dates
+            # Dates are stored as ISO strings, which sort as dates
+            if start is not None:
+                conditions.append('"%s" >= ?' % self.entry_date_column)
+                params.append(str(pd.to_datetime(start)))
+            if end is not None:
+                conditions.append('"%s" < ?' % self.entry_date_column)
+                params.append(str(pd.to_datetime(end)))
+
+        if columns is None:
+            select = '*'
+        else:
+            select = ', '.join('"%s"' % column for column in columns)
+        sql = 'SELECT %s FROM %s' % (select, ENROLLMENT_TABLE)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return self.query(sql + ' ORDER BY rowid', params)
+
+    def household_members(self, person_id, columns=None):
+        """
+        Enrollments of everyone who shared a household with a person.
+
+        Parameters
+        ----------
+        person_id :
+            ID of the person.
+
+        columns : list
+            Columns to return. Default is None (all columns).
+
+        Returns
+        ----------
+        dataframe of the enrollments in the person's households, including
+        the person's own
+        """
+        if columns is None:
+            select = '*'
+        else:
+            select = ', '.join('"%s"' % column for column in columns)
+        sql = ('SELECT %s FROM %s WHERE "%s" IN (SELECT "%s" FROM %s WHERE '
+               '"%s" = ?) ORDER BY rowid' %
+               (select, ENROLLMENT_TABLE, self.household_column,
+                self.household_column, ENROLLMENT_TABLE, self.pid_column))
+        return self.query(sql, [_sql_value(person_id)])
@@ -0,0 +1,196 @@
+"""
+Dense int32 encoding of IDs.
+
+The ID columns of the HMIS tables (PersonalID, ProjectEntryID, HouseholdID,
+ProjectID) are read as float64 or object columns, which are slow to join and
+group on, and mapping them to matrix indices with a dict is slow too.
+`IDDictionary` encodes each ID domain once into dense int32 codes
+(0, 1, 2, ...), in the order the IDs are first seen, and keeps the mapping
+tables to decode them. Using one dictionary for all the tables keeps the
+codes of each domain consistent across tables, so they can be joined on.
+"""
+import pickle
+import numpy as np
+import pandas as pd
+
+# Code of missing IDs:
+MISSING = -1
+
+# Domains of the enrollment metadata's ID columns:
+ID_DOMAINS = {'person_ID': 'person',
+              'person_enrollment_ID': 'enrollment',
+              'groupID_column': 'household',
+              'program_ID': 'project'}
+
+
+def _normalize(values):
+    """
+    Make IDs that were read as floats (because of missing values) equal to
+    the same IDs read as integers.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_float_dtype(values.dtype):
+        valid = values.dropna()
+        if (valid == np.floor(valid)).all():
+            return values.astype('Int64')
+    return values
+
+
+def encode_ids(values):
+    """
+    Factorize IDs into dense int32 codes.
+
+    Parameters
+    ----------
+    values : array-like
+        The IDs. Missing values are allowed.
+
+    Returns
+    -------
+    codes : ndarray
+        int32 code of each ID, in order of first appearance, with
+        `MISSING` for missing IDs.
+
+    uniques : Index
+        The distinct IDs, so that uniques[codes[i]] is the i-th ID.
+    """
+    codes, uniques = pd.factorize(_normalize(values))
+    if len(uniques) > np.iinfo(np.int32).max:
+        raise OverflowError("Too many distinct IDs for int32 codes")
+    return codes.astype(np.int32), pd.Index(uniques)
+
+
+class IDDictionary(object):
+    """
+    Shared dictionaries of the IDs of several domains (e.g. 'person',
+    'enrollment'), encoded as dense int32 codes.
+
+    IDs are added to a domain's dictionary as they are encoded, so the same
+    ID always gets the same code, whichever table it is in.
+    """
+    def __init__(self):
+        # {domain: Index of the IDs, position = code}
+        self.uniques = {}
+
+    def encode(self, domain, values):
+        """
+        Encode IDs, adding new IDs to the domain's dictionary.
+
+        Parameters
+        ----------
+        domain : string
+            The ID domain, e.g. 'person'.
+
+        values : array-like
+            The IDs. Missing values are allowed.
+
+        Returns
+        -------
+        ndarray of int32 codes, `MISSING` for missing IDs.
+        """
+        codes, uniques = encode_ids(values)
+        known = self.uniques.get(domain, pd.Index([]))
+        # Codes of the distinct IDs in the dictionary, adding the new ones
+        unique_codes = known.get_indexer(uniques)
+        new = unique_codes == MISSING
+        if new.any():
+            unique_codes[new] = len(known) + np.arange(new.sum())
+            known = known.append(uniques[new])
+            if len(known) > np.iinfo(np.int32).max:
+                raise OverflowError("Too many distinct IDs for int32 codes")
+            self.uniques[domain] = known
+        elif domain not in self.uniques:
+            self.uniques[domain] = known
+        # Missing IDs have code -1, which picks the MISSING at the end
+        lookup = np.append(unique_codes, MISSING).astype(np.int32)
+        return lookup[codes]
+
+    def decode(self, domain, codes):
+        """
+        Decode int32 codes to IDs.
+
+        Parameters
+        ----------
+        domain : string
+            The ID domain.
+
+        codes : array-like
+            Codes from `encode`.
+
+        Returns
+        -------
+        Series of the IDs, with missing values for `MISSING` codes.
+        """
+        codes = np.asarray(codes)
+        uniques = self.uniques.get(domain, pd.Index([]))
+        ids = pd.Series(uniques.take(np.maximum(codes, 0))
+                        if len(uniques) else [None] * len(codes))
+        return ids.where(codes != MISSING)
+
+    def mapping(self, domain):
+        """
+        The mapping table of a domain.
+
+        Returns
+        -------
+        DataFrame with columns 'code' and 'id'.
+        """
+        uniques = self.uniques.get(domain, pd.Index([]))
+        return pd.DataFrame({'code': np.arange(len(uniques), dtype=np.int32),
+                             'id': uniques})
+
+    def encode_columns(self, df, columns):
+        """
+        Encode the ID columns of a DataFrame in place.
+
+        Parameters
+        ----------
+        df : DataFrame
+            The table.
+
+        columns : dict
+            Domain of each column to encode, keyed by column. Columns that
+            df doesn't have are skipped.
+
+        Returns
+        -------
+        df, with the columns replaced by their codes.
+        """
+        for column, domain in columns.items():
+            if column in df.columns:
+                df[column] = self.encode(domain, df[column])
+        return df
+
+    def decode_columns(self, df, columns):
+        """
+        Decode the ID columns of a DataFrame.
+
+        Parameters
+        ----------
+        df : DataFrame
+            The table, with encoded ID columns.
+
+        columns : dict
+            Domain of each column to decode, keyed by column. Columns that
+            df doesn't have are skipped.
+
+        Returns
+        -------
+        A copy of df with the columns decoded.
+        """
+        df = df.copy()
+        for column, domain in columns.items():
+            if column in df.columns:
+                df[column] = self.decode(domain, df[column]).values
+        return df
+
+    def save(self, fname):
+        """Save the dictionaries to a file."""
+        with open(fname, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fname):
+        """Load dictionaries saved with `save`."""
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
@@ -0,0 +1,198 @@
+"""
+Look up single records against a linked population.
+
+`LinkageLookup` keeps a `puget.recordlinkage.LinkageState` in memory, with
+its blocking indexes already built, and answers which existing people an
+incoming record could be, with their scores. It is reloaded from its file
+when a new batch linkage saves a new state there.
+
+The lookup can be used in-process, or served over HTTP on localhost with
+`serve`::
+
+    python -m puget.lookup linkage_state.pkl 8765
+
+and queried by POSTing a JSON record to /lookup, e.g.::
+
+    {"fname": "QWERT", "lname": "ASDF", "dob": "1990-02-01",
+     "ssn_as_str": "123456789"}
+
+which returns a JSON list of {"linkage_PID", "score", "match"} candidates,
+best first. POSTing to /reload reloads the state. If a state can't be
+loaded, the error is logged and the previous state is kept.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+from puget.recordlinkage import LinkageState
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+logger = logging.getLogger(__name__)
+
+
+class LinkageLookup(object):
+    """
+    In-memory lookup of records against a saved linkage state.
+
+    Parameters
+    ----------
+    state_file : string
+        File written by `LinkageState.save`.
+
+    auto_reload : bool
+        Whether to check, before each lookup, if the file has changed and
+        reload it if so.
+    """
+    def __init__(self, state_file, auto_reload=True):
+        self.state_file = state_file
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """
+        Load the state from its file.
+
+        If the file can't be loaded, the current state is kept (and the load
+        is tried again at the next check) and the error is logged.
+
+        Returns
+        -------
+        bool : whether the state was loaded.
+        """
+        try:
+            mtime = os.stat(self.state_file).st_mtime_ns
+            state = LinkageState.load(self.state_file)
+        except Exception:
+            if not hasattr(self, 'state'):
+                # There is no state to keep
+                raise
+            logger.exception("Can't load the linkage state from %s, keeping "
+                             "the current state", self.state_file)
+            return False
+        with self._lock:
+            # Queries in progress keep using the state they started with:
+            self.state = state
+            self.mtime = mtime
+        return True
+
+    def reload_if_changed(self):
+        """
+        Reload the state if its file has changed since it was loaded.
+
+        Returns
+        -------
+        bool : whether the state was reloaded.
+        """
+        try:
+            changed = os.stat(self.state_file).st_mtime_ns != self.mtime
+        except OSError:
+            logger.exception("Can't read %s, keeping the current state",
+                             self.state_file)
+            return False
+        return changed and self.reload()
+
+    def _as_frame(self, record, population):
+        """Make a one-row frame of a record, with the population's dtypes."""
+        record = pd.DataFrame([record])
+        for column in population.columns:
+            if column not in record.columns:
+                record[column] = None
+            if pd.api.types.is_datetime64_any_dtype(population[column]):
+                record[column] = pd.to_datetime(record[column])
+        return record[[c for c in population.columns
+                       if c != "linkage_PID"]]
+
+    def lookup(self, record):
+        """
+        Find the candidate PIDs of one record.
+
+        Parameters
+        ----------
+        record : dict
+            The record's values, keyed by column. Missing columns are
+            treated as missing values, and dates can be given as strings.
+
+        Returns
+        -------
+        DataFrame with columns 'linkage_PID', 'score' and 'match', best
+        candidate first. Empty if the record doesn't block with anyone.
+        """
+        if self.auto_reload:
+            self.reload_if_changed()
+        state = self.state
+        candidates = state.candidates(self._as_frame(record,
+                                                     state.population))
+        return candidates.drop('record', axis=1)
+
+
+def _make_handler(lookup):
+    """Make a request handler class that serves `lookup`."""
+    class LookupHandler(BaseHTTPRequestHandler):
+        def _respond(self, code, body):
+            body = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path == '/reload':
+                self._respond(200, {'reloaded': lookup.reload()})
+                return
+            if self.path != '/lookup':
+                self._respond(404, {'error': 'unknown path %s' % self.path})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                record = json.loads(self.rfile.read(length).decode('utf-8'))
+                candidates = lookup.lookup(record)
+            except (ValueError, KeyError, TypeError) as e:
+                self._respond(400, {'error': str(e)})
+                return
+            candidates['linkage_PID'] = candidates['linkage_PID'].astype(int)
+            self._respond(200, candidates.to_dict(orient='records'))
+
+        def log_message(self, format, *args):
+            # Don't write a line to stderr for every query.
+            pass
+
+    return LookupHandler
+
+
+def make_server(lookup, host=HOST, port=PORT):
+    """
+    Make an HTTP server for a `LinkageLookup`.
+
+    The server isn't started; call its `serve_forever` method (e.g. in a
+    thread) to start it, and `shutdown` to stop it. Use port 0 to pick any
+    free port, which is then `server.server_address[1]`.
+    """
+    return ThreadingHTTPServer((host, port), _make_handler(lookup))
+
+
+def serve(state_file, host=HOST, port=PORT):
+    """
+    Serve lookups of a saved linkage state over HTTP until interrupted.
+    """
+    server = make_server(LinkageLookup(state_file), host=host, port=port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        serve(sys.argv[1], port=int(sys.argv[2]))
+    else:
+        serve(sys.argv[1])
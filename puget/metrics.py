@@ -0,0 +1,336 @@
+"""
+Metrics of the stages of a pipeline run, and a structured report of them.
+
+A `RunReport` is passed to `puget.preprocess.merge_tables`,
+`puget.cluster.cluster` or `puget.recordlinkage.link_records`, which record
+each of their stages in it: the wall and CPU time, the peak memory and the
+number of input and output rows. The report can be written as JSON::
+
+    report = RunReport('king', progress=console_progress)
+    df = merge_tables(county='king', report=report)
+    report.write('king_report.json')
+
+The progress callback is called with a dict for each event as it happens,
+so a caller can show live progress (see `console_progress`):
+
+- ``{'event': 'start', 'stage': name}`` when a stage starts,
+- ``{'event': 'end', 'stage': name, 'metrics': {...}}`` when it ends,
+- ``{'event': 'progress', 'stage': name, 'fraction': f}`` as a stage
+  progresses, with f from 0 to 1,
+- ``{'event': 'message', 'stage': name, 'message': text}`` for notes such
+  as the number of bad DOBs found.
+
+The peak memory is the peak resident set size of the process so far (which
+never decreases), and, if the report traces memory, the peak memory
+allocated by Python during the stage according to `tracemalloc`, which is
+exact per stage but slows the run down.
+
+If the report has a profile directory, each stage is also run under cProfile
+and its profile is written to <stage>.pstats in that directory (to be
+explored with pstats or snakeviz), and the stage's top hotspots are printed.
+The time spent in a nested stage is only in the nested stage's profile.
+"""
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import os
+import os.path as op
+import pstats
+import sys
+import time
+import tracemalloc
+
+from puget.version import __version__
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Name of the report written to a run directory:
+REPORT_FILE = 'report.json'
+
+# Number of functions in the hotspot summary of a stage's profile:
+PROFILE_TOP = 20
+
+
+def peak_rss():
+    """
+    The peak resident set size of the process so far, in bytes, or None
+    where it isn't available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return int(peak)
+
+
+class StageMetrics(object):
+    """
+    Metrics of one stage of a run. Made by `RunReport.stage`.
+
+    Attributes
+    ----------
+    name : string
+        Name of the stage.
+
+    n_rows_in, n_rows_out : int
+        Number of input and output rows, set by the stage (None if it
+        doesn't apply).
+
+    counts : dict
+        Other counts of the stage, e.g. the number of bad DOBs.
+
+    messages : list
+        Notes of the stage.
+
+    status : string
+        How the stage's output was made, e.g. 'computed' or 'checkpoint'.
+
+    depth : int
+        Number of stages the stage is run in (0 for top level stages).
+
+    profile : string
+        The stage's .pstats file, if it was profiled.
+    """
+    def __init__(self, name, n_rows_in=None, depth=0):
+        self.name = name
+        self.depth = depth
+        self.n_rows_in = n_rows_in
+        self.n_rows_out = None
+        self.counts = {}
+        self.messages = []
+        self.status = 'computed'
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss = None
+        self.peak_traced = None
+        self.profile = None
+
+    def to_dict(self):
+        """The metrics, as a JSON serializable dict."""
+        return {'name': self.name, 'depth': self.depth,
+                'status': self.status,
+                'wall_time': self.wall_time, 'cpu_time': self.cpu_time,
+                'peak_rss': self.peak_rss, 'peak_traced': self.peak_traced,
+                'n_rows_in': self.n_rows_in, 'n_rows_out': self.n_rows_out,
+                'counts': self.counts, 'messages': self.messages,
+                'profile': self.profile}
+
+
+class RunReport(object):
+    """
+    Metrics of the stages of a run.
+
+    Parameters
+    ----------
+    name : string
+        Name of the run, e.g. the county.
+
+    progress : function
+        Called with a dict for each event of the run (see the module
+        documentation). Default is None (no live progress).
+
+    trace_memory : bool
+        Whether to trace the memory allocated in each stage with
+        tracemalloc. Default is False.
+
+    profile_dir : string
+        Directory in which to write a cProfile .pstats file of each stage.
+        Default is None (no profiling, at no cost).
+
+    profile_top : int
+        Number of functions in the printed hotspot summary of each profiled
+        stage.
+    """
+    def __init__(self, name=None, progress=None, trace_memory=False,
+                 profile_dir=None, profile_top=PROFILE_TOP):
+        self.name = name
+        self.progress_callback = progress
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.profile_top = profile_top
+        self.started = datetime.datetime.now().isoformat()
+        self.stages = []
+        # The stages that are running, innermost last, with their traced
+        # memory peaks so far
+        self._open = []
+        # Whether tracemalloc was started by the report
+        self._tracing = False
+        # The profilers of the running stages; only the innermost is enabled
+        self._profilers = []
+
+    def _emit(self, event):
+        if self.progress_callback is not None:
+            self.progress_callback(event)
+
+    @contextlib.contextmanager
+    def stage(self, name, n_rows_in=None):
+        """
+        Record the metrics of a stage, run in a with block::
+
+            with report.stage('client') as metrics:
+                client = get_client(...)
+                metrics.n_rows_out = len(client)
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage.
+
+        n_rows_in : int
+            Number of input rows.
+
+        Yields
+        -------
+        the StageMetrics of the stage, for the stage to fill in its row
+        counts
+        """
+        metrics = StageMetrics(name, n_rows_in=n_rows_in,
+                               depth=len(self._open))
+        self._emit({'event': 'start', 'stage': name})
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            # Keep the peaks of the enclosing stages before resetting
+            for entry in self._open:
+                entry[1] = max(entry[1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        entry = [metrics, 0]
+        self._open.append(entry)
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+            if self._profilers:
+                self._profilers[-1].disable()
+            self._profilers.append(profiler)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield metrics
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            metrics.wall_time = time.perf_counter() - wall_start
+            metrics.cpu_time = time.process_time() - cpu_start
+            if profiler is not None:
+                self._profilers.pop()
+                metrics.profile = self._write_profile(name, profiler)
+                if self._profilers:
+                    self._profilers[-1].enable()
+            metrics.peak_rss = peak_rss()
+            self._open.remove(entry)
+            if self.trace_memory and tracemalloc.is_tracing():
+                metrics.peak_traced = max(entry[1],
+                                          tracemalloc.get_traced_memory()[1])
+                if self._tracing and not self._open:
+                    # Tracing slows everything down, so stop between runs
+                    tracemalloc.stop()
+                    self._tracing = False
+            self.stages.append(metrics)
+            self._emit({'event': 'end', 'stage': name,
+                        'metrics': metrics.to_dict()})
+
+    @contextlib.contextmanager
+    def profiling(self, profile_dir):
+        """
+        Profile the stages run in a with block into a directory, restoring
+        the report's own profile directory after the block::
+
+            with report.profiling('profiles'):
+                with report.stage('client'):
+                    ...
+
+        Parameters
+        ----------
+        profile_dir : string
+            Directory in which to write the .pstats files of the stages. If
+            None, the report's profile directory is used.
+        """
+        old_profile_dir = self.profile_dir
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+        try:
+            yield self
+        finally:
+            self.profile_dir = old_profile_dir
+
+    def _write_profile(self, name, profiler):
+        """Write a stage's profile and print its hotspots."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        fname = op.join(self.profile_dir, '%s.pstats' % name)
+        profiler.dump_stats(fname)
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(self.profile_top)
+        print('Profile of stage %s, written to %s:' % (name, fname))
+        print(summary.getvalue())
+        return fname
+
+    def _current(self):
+        """Name of the innermost running stage."""
+        return self._open[-1][0].name if self._open else None
+
+    def message(self, message):
+        """Record a note in the running stage."""
+        if self._open:
+            self._open[-1][0].messages.append(message)
+        self._emit({'event': 'message', 'stage': self._current(),
+                    'message': message})
+
+    def count(self, key, value):
+        """Record a count (e.g. of bad records) in the running stage."""
+        if self._open:
+            self._open[-1][0].counts[key] = int(value)
+
+    def progress(self, fraction):
+        """Report the progress of the running stage, from 0 to 1."""
+        self._emit({'event': 'progress', 'stage': self._current(),
+                    'fraction': fraction})
+
+    def to_dict(self):
+        """The report, as a JSON serializable dict."""
+        stages = [metrics.to_dict() for metrics in self.stages]
+        # The times of nested stages are included in their enclosing stages
+        top = [stage for stage in stages if stage['depth'] == 0]
+        return {'name': self.name, 'started': self.started,
+                'puget_version': __version__,
+                'python_version': sys.version.split()[0],
+                'stages': stages,
+                'wall_time': sum(stage['wall_time'] for stage in top),
+                'cpu_time': sum(stage['cpu_time'] for stage in top),
+                'peak_rss': peak_rss()}
+
+    def write(self, fname):
+        """Write the report to a JSON file."""
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+def console_progress(event):
+    """
+    Progress callback that prints the events of a run to the console: a
+    progress bar as stages progress, the stages' notes, and the row counts
+    and times of the stages as they end.
+    """
+    if event['event'] == 'progress':
+        progress = 100 * event['fraction']
+        print('\r%s [%-10s] %0.2f%%' % (event['stage'],
+                                        '#' * int(progress / 10), progress))
+    elif event['event'] == 'message':
+        print('%s: %s' % (event['stage'], event['message']))
+    elif event['event'] == 'end':
+        metrics = event['metrics']
+        print('%s: n_rows %s, %0.2f s (%s)' % (event['stage'],
+                                              metrics['n_rows_out'],
+                                              metrics['wall_time'],
+                                              metrics['status']))
@@ -0,0 +1,179 @@
+"""
+Normalization and phonetic keys of names, for record linkage.
+
+Names from `puget.preprocess.get_client` are raw: they differ in case and
+punctuation, hyphenated surnames are sometimes written with a space or only
+in part, and first names may be nicknames. `NameKeys` derives keys from the
+names that are robust to these differences, which can be used as blocking or
+match variables in `puget.recordlinkage.link_records`:
+
+    <column>_norm : upper case, letters only, parts of the name run together
+    <column>_part : the first part of a hyphenated or multi-part name
+    <column>_soundex : Soundex code of the normalized name
+    <column>_metaphone : Metaphone code of the normalized name
+
+Keys are computed once for each distinct name and cached, and the cache can
+be saved and reused between runs.
+"""
+import json
+import os.path as op
+import pickle
+import jellyfish
+import numpy as np
+import pandas as pd
+
+from puget.data import DATA_PATH
+
+NICKNAME_FILE = op.join(DATA_PATH, 'metadata', 'nicknames.json')
+
+KEY_NAMES = ['norm', 'part', 'soundex', 'metaphone']
+
+
+def load_nicknames(fname=NICKNAME_FILE):
+    """
+    Read a mapping of nicknames to full first names, both in upper case.
+
+    The default file maps common English nicknames, e.g. BILL to WILLIAM.
+    """
+    with open(fname) as f:
+        return json.load(f)
+
+
+def normalize(values, nicknames=None):
+    """
+    Normalize names.
+
+    Names are upper cased, hyphens are treated as spaces, and everything
+    but letters and single spaces between the parts of a name is removed.
+
+    Parameters
+    ----------
+    values : Series
+        The names. Missing values are allowed.
+
+    nicknames : dict, optional
+        Mapping of (normalized) nicknames to full names, see
+        `load_nicknames`.
+
+    Returns
+    -------
+    Series of normalized names, NaN for missing names or names with no
+    letters.
+    """
+    values = pd.Series(values)
+    names = values.astype(str).str.upper()
+    names = names.str.replace('-', ' ', regex=False)
+    names = names.str.replace('[^A-Z ]', '', regex=True)
+    names = names.str.split().str.join(' ')
+    names = names.where(values.notnull() & (names != ''), np.nan)
+    if nicknames is not None:
+        names = names.replace(nicknames)
+    return names
+
+
+def _phonetic(method, names):
+    """Apply a jellyfish phonetic encoding to names, skipping missing."""
+    return [method(name) if isinstance(name, str) else np.nan
+            for name in names]
+
+
+class NameKeys(object):
+    """
+    Cache of the keys derived from names.
+
+    Parameters
+    ----------
+    nicknames : dict, optional
+        Mapping of nicknames to full names, used for the columns given as
+        `nickname_columns`. Defaults to `load_nicknames()`.
+    """
+    def __init__(self, nicknames=None):
+        if nicknames is None:
+            nicknames = load_nicknames()
+        self.nicknames = nicknames
+        # {(name, whether nicknames are mapped): (norm, part, soundex,
+        # metaphone)}
+        self.cache = {}
+
+    def _compute(self, names, use_nicknames):
+        """Compute and cache the keys of names that are not cached yet."""
+        new = [name for name in names
+               if (name, use_nicknames) not in self.cache]
+        if len(new) == 0:
+            return
+        norm = normalize(pd.Series(new, dtype=object),
+                         self.nicknames if use_nicknames else None)
+        part = norm.str.split(' ').str[0]
+        norm = norm.str.replace(' ', '', regex=False)
+        soundex = _phonetic(jellyfish.soundex, norm)
+        metaphone = _phonetic(jellyfish.metaphone, norm)
+        self.cache.update(zip([(name, use_nicknames) for name in new],
+                              zip(norm, part, soundex, metaphone)))
+
+    def keys(self, values, use_nicknames=False):
+        """
+        The keys of names.
+
+        Parameters
+        ----------
+        values : Series
+            The names. Missing values are allowed.
+
+        use_nicknames : bool
+            Whether to map nicknames to full names (for first names).
+
+        Returns
+        -------
+        DataFrame with columns `KEY_NAMES` and the index of `values`.
+        """
+        values = pd.Series(values)
+        codes, uniques = pd.factorize(values)
+        self._compute(uniques, use_nicknames)
+        table = pd.DataFrame([self.cache[(name, use_nicknames)]
+                              for name in uniques],
+                             columns=KEY_NAMES, dtype=object)
+        keys = table.reindex(codes)
+        keys.index = values.index
+        return keys
+
+    def add_keys(self, df, columns, nickname_columns=None):
+        """
+        Add the keys of name columns to a DataFrame.
+
+        Parameters
+        ----------
+        df : DataFrame
+            The records, e.g. from `get_client`.
+
+        columns : list
+            Name columns, e.g. ['FirstName', 'LastName'].
+
+        nickname_columns : list, optional
+            Those of `columns` in which to map nicknames to full names,
+            e.g. ['FirstName'].
+
+        Returns
+        -------
+        A copy of `df` with columns <column>_<key> for each column and each
+        key in `KEY_NAMES`.
+        """
+        if nickname_columns is None:
+            nickname_columns = []
+        df = df.copy()
+        for column in columns:
+            keys = self.keys(df[column],
+                             use_nicknames=column in nickname_columns)
+            for key in KEY_NAMES:
+                df[column + '_' + key] = keys[key]
+        return df
+
+    def save(self, fname):
+        """Save the cache to a file."""
+        with open(fname, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fname):
+        """Load a cache saved with `save`."""
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
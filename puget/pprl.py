@@ -0,0 +1,250 @@
+"""
+Privacy-preserving record linkage with Bloom-filter encodings.
+
+Identifying fields (names, dates of birth, SSNs) are encoded as fixed-length
+Bloom filters: each q-gram of a value is hashed, with a keyed hash, to
+`num_hashes` bit positions which are set in the filter. Partners that share
+the key can encode their records and exchange the filters instead of the
+raw values. Filters of similar strings share most of their bits, so they can
+be compared with the Dice coefficient, which is what the "bloom" comparison
+of `puget.recordlinkage.link_records` does.
+
+The filters are packed into uint64 words. In a DataFrame each encoded field
+is held as one uint64 column per word (see `filter_columns`), so that the
+filters of a frame form a 2-D array that can be indexed by the record pairs
+and compared all at once. Missing values have no bits set.
+
+Exact blocking keys are encoded with `hmac_values`, so that the records can
+be blocked without exchanging any plaintext either, e.g.::
+
+    encoded = encode_records(df, ['fname', 'lname', 'dob'], key)
+    encoded['lname_key'] = hmac_values(df['lname'], key)
+    link_list = [{'block_variable': 'lname_key',
+                  'match_variables': {'fname': 'bloom', 'dob': 'bloom'}}]
+    linked = link_records(encoded, link_list)
+"""
+import hashlib
+import hmac
+import numpy as np
+import pandas as pd
+
+# Default filter length in bits (a multiple of 64) and number of bit
+# positions set per q-gram:
+NUM_BITS = 1024
+NUM_HASHES = 20
+
+# Name of each word column of an encoded field:
+WORD_COLUMN = '%s_bf%d'
+
+# Number of set bits in each 16-bit value:
+_POPCOUNT = np.array([bin(i).count('1') for i in range(1 << 16)],
+                     dtype=np.uint8)
+
+
+def _as_strings(values):
+    """Convert values to strings, formatting dates as YYYY-MM-DD."""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        strings = values.dt.strftime('%Y-%m-%d')
+    else:
+        strings = values.astype(str)
+    return strings.where(values.notnull(), None)
+
+
+def _qgrams(value, q):
+    """The q-grams of a value, padded with a space at each end."""
+    padded = ' %s ' % value
+    return set(padded[i:i + q] for i in range(len(padded) - q + 1))
+
+
+def _bit_positions(gram, key, num_bits, num_hashes):
+    """
+    Bit positions of a q-gram, by double hashing with two keyed hashes.
+    """
+    key = key.encode('utf-8')
+    gram = gram.encode('utf-8')
+    h1 = int(hmac.new(key, gram, hashlib.sha1).hexdigest(), 16)
+    h2 = int(hmac.new(key, gram, hashlib.md5).hexdigest(), 16)
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+def encode(values, key, num_bits=NUM_BITS, num_hashes=NUM_HASHES, q=2):
+    """
+    Encode values as Bloom filters.
+
+    Each distinct value, and each distinct q-gram, is only hashed once.
+
+    Parameters
+    ----------
+    values : array-like
+        Values to encode. Anything other than strings is converted to a
+        string first (dates as YYYY-MM-DD). Missing values are allowed.
+
+    key : string
+        Secret key of the hashes. Records encoded with different keys can't
+        be compared.
+
+    num_bits : int
+        Length of the filters, a multiple of 64.
+
+    num_hashes : int
+        Number of bits set for each q-gram.
+
+    q : int
+        Length of the q-grams.
+
+    Returns
+    -------
+    filters : ndarray
+        uint64 array of shape (n_values, num_bits // 64). Missing values
+        have no bits set.
+
+    missing : ndarray
+        Boolean array, True where the value was missing.
+    """
+    if num_bits % 64:
+        raise ValueError("num_bits must be a multiple of 64")
+    strings = _as_strings(values)
+    missing = strings.isnull().values
+    codes, uniques = pd.factorize(strings)
+
+    positions = {}
+    rows = []
+    bits = []
+    for i, value in enumerate(uniques):
+        for gram in _qgrams(value, q):
+            if gram not in positions:
+                positions[gram] = _bit_positions(gram, key, num_bits,
+                                                 num_hashes)
+            bits.extend(positions[gram])
+            rows.extend([i] * num_hashes)
+    rows = np.array(rows, dtype=np.int64)
+    bits = np.array(bits, dtype=np.uint64)
+
+    unique_filters = np.zeros((len(uniques), num_bits // 64), dtype=np.uint64)
+    np.bitwise_or.at(unique_filters, (rows, bits // np.uint64(64)),
+                     np.left_shift(np.uint64(1), bits % np.uint64(64)))
+
+    filters = np.zeros((len(codes), num_bits // 64), dtype=np.uint64)
+    filters[~missing] = unique_filters[codes[~missing]]
+    return filters, missing
+
+
+def filter_columns(column, columns):
+    """
+    The word columns of an encoded field, in order.
+
+    Parameters
+    ----------
+    column : string
+        The encoded field, e.g. 'fname'.
+
+    columns : sequence or int
+        The columns of the encoded frame, or the number of words of the
+        filters.
+    """
+    if isinstance(columns, int):
+        return [WORD_COLUMN % (column, i) for i in range(columns)]
+    n_words = 0
+    while WORD_COLUMN % (column, n_words) in columns:
+        n_words += 1
+    if n_words == 0:
+        raise ValueError("%s isn't an encoded field" % column)
+    return filter_columns(column, n_words)
+
+
+def encode_records(df, columns, key, num_bits=NUM_BITS,
+                   num_hashes=NUM_HASHES, q=2):
+    """
+    Replace identifying columns of a DataFrame with their Bloom filters.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The records to encode.
+
+    columns : list
+        The columns to encode, e.g. ['fname', 'lname', 'dob', 'ssn_as_str'].
+        Other columns are left as they are.
+
+    key, num_bits, num_hashes, q :
+        See `encode`.
+
+    Returns
+    -------
+    DataFrame with each of `columns` replaced by the uint64 words of its
+    filters (see `filter_columns`), all zero for missing values.
+    """
+    encoded = [df.drop(columns, axis=1)]
+    for column in columns:
+        filters, _ = encode(df[column], key, num_bits=num_bits,
+                            num_hashes=num_hashes, q=q)
+        encoded.append(pd.DataFrame(
+            filters, index=df.index,
+            columns=filter_columns(column, filters.shape[1])))
+    return pd.concat(encoded, axis=1)
+
+
+def hmac_values(values, key):
+    """
+    Encode values as keyed hashes, for exact blocking on encoded records.
+
+    Equal values have equal hashes, so the hashes can be used as a
+    `block_variable`, but unlike Bloom filters they carry no similarity.
+
+    Parameters
+    ----------
+    values : array-like
+        Values to encode, converted to strings as in `encode`.
+
+    key : string
+        Secret key of the hashes.
+
+    Returns
+    -------
+    Series of hex digests, None for missing values.
+    """
+    strings = _as_strings(values)
+    codes, uniques = pd.factorize(strings)
+    key = key.encode('utf-8')
+    digests = np.array([hmac.new(key, value.encode('utf-8'),
+                                 hashlib.sha256).hexdigest()
+                        for value in uniques] + [None], dtype=object)
+    return pd.Series(digests[codes], index=strings.index)
+
+
+def popcount(words):
+    """
+    Number of set bits in each row of a uint64 array.
+
+    The words are split into 16-bit pieces, which are counted by table
+    lookup, for all the rows at once.
+    """
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    counts = _POPCOUNT[words.view(np.uint16)]
+    return counts.sum(axis=1, dtype=np.int64)
+
+
+def dice_similarity(f1, f2):
+    """
+    Dice similarity of pairs of Bloom filters.
+
+    Parameters
+    ----------
+    f1, f2 : ndarray
+        The filters to compare, pairwise, as uint64 arrays of shape
+        (n_pairs, n_words), e.g. the word columns of encoded records
+        indexed by the record pairs.
+
+    Returns
+    -------
+    ndarray of similarities 2 |f1 & f2| / (|f1| + |f2|) between 0 and 1, NaN
+    where either filter is missing (has no bits set).
+    """
+    common = popcount(f1 & f2)
+    counts1 = popcount(f1)
+    counts2 = popcount(f2)
+    result = np.full(common.shape[0], np.nan)
+    valid = (counts1 > 0) & (counts2 > 0)
+    result[valid] = 2. * common[valid] / (counts1[valid] + counts2[valid])
+    return result
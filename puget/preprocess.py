@@ -26,14 +26,23 @@ The raw data is provided in the following format:
 """
 
 import pandas as pd
+import contextlib
 import datetime
+import os
 import os.path as op
 import numpy as np
 import json
+import tempfile
 import puget.utils as pu
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 from puget.data import DATA_PATH
+from puget.checkpoint import (StageCheckpoints, chain_fingerprints,
+                              file_fingerprint)
+from puget.ids import ID_DOMAINS, MISSING
+from puget.metrics import REPORT_FILE, RunReport
+from puget.version import __version__
 
 #  Paths of csvs
 COUNTY_FOLDERS = {'king': [str(s) for s in range(2012, 2017)],
@@ -62,6 +71,19 @@ METADATA_FILES = {'enrollment': 'enrollment.json',
 for k, v in METADATA_FILES.items():
     METADATA_FILES[k] = op.join(DATA_PATH, 'metadata', v)
 
+# dict of default raw data file names
+TABLE_FILES = {'enrollment': 'Enrollment.csv',
+               'exit': 'Exit.csv',
+               'client': 'Client.csv',
+               'disabilities': 'Disabilities.csv',
+               'employment_education': 'EmploymentEducation.csv',
+               'health_dv': 'HealthAndDV.csv',
+               'income': 'IncomeBenefits.csv',
+               'project': 'Project.csv'}
+
+# number of rows to read at a time when partitioning raw tables into shards
+SHARD_CHUNK_ROWS = 100000
+
 
 file_path_boilerplate = (
     """
@@ -92,6 +114,25 @@ metdata_boilerplate = (
     """)
 
 
+row_filter_boilerplate = (
+    """
+    row_filter : dict
+        keys are column names, values are collections of the values to keep,
+        or functions that take the column (as a Series) and return a boolean
+        array that is True for the rows to keep. Rows that fail the filter
+        in any of these columns are dropped as the csv files are read, a
+        chunk at a time. Default is None (keep all rows).
+    """)
+
+
+usecols_boilerplate = (
+    """
+    usecols : list
+        raw columns to read from the csv files. Other columns are not
+        parsed. Default is None (read all columns).
+    """)
+
+
 def std_path_setup(filename, data_dir, paths):
     """
     Setup filenames for read_table assuming standard data directory structure.
@@ -119,11 +160,149 @@ def std_path_setup(filename, data_dir, paths):
     return file_spec
 
 
+def _resolve_file_spec(file_spec, county=None, data_dir=None, paths=None):
+    """
+    Turn the file arguments of read_table into a dict of full file names,
+    keyed by path.
+    """
+    if not isinstance(file_spec, dict):
+        if data_dir is None:
+            if county is None:
+                raise ValueError('If file_spec is a string, data_dir or ' +
+                                 'county must be passed')
+            else:
+                if not isinstance(county, str):
+                    raise ValueError('county must be a string -- '
+                                     'one county at a time, please!')
+                data_dir = op.join(DATA_PATH, county)
+        if paths is None:
+            if county is None:
+                raise ValueError('If file_spec is a string, paths or county ' +
+                                 'must be passed')
+            else:
+                if not isinstance(county, str):
+                    raise ValueError('county must be a string -- '
+                                     'one county at a time, please!')
+                paths = COUNTY_FOLDERS[county]
+
+        file_spec = std_path_setup(file_spec, data_dir, paths)
+    else:
+        if data_dir is not None or paths is not None:
+            raise ValueError(
+                'If file_spec is a dict, data_dir and paths cannot be passed')
+
+    return file_spec
+
+
+def _read_order(file_spec):
+    """
+    The (path, file name) pairs of a file_spec dict in the order read_table
+    reads them: the last one first, then the rest in order.
+    """
+    items = list(file_spec.items())
+    return items[-1:] + items[:-1]
+
+
+# Number of rows to read at a time when filtering rows while reading:
+READ_CHUNK_SIZE = 100000
+
+
+def _column_selector(columns):
+    """
+    A usecols callable for read_csv that selects columns by name, allowing
+    for the zero width no-break space that some headers start with.
+    """
+    if columns is None:
+        return None
+    columns = set(columns)
+    return lambda col: col.lstrip('\ufeff') in columns
+
+
+def _row_filter_mask(df, row_filter):
+    """Boolean array of the rows of df that pass row_filter (see
+    read_table)."""
+    keep = np.ones(df.shape[0], dtype=bool)
+    for col, values in row_filter.items():
+        if callable(values):
+            keep &= np.asarray(values(df[col]), dtype=bool)
+        else:
+            keep &= df[col].isin(values).values
+    return keep
+
+
+def date_range_filter(start=None, end=None):
+    """
+    Make a row_filter function (see read_table) that keeps the rows with
+    dates from start up to (not including) end.
+
+    Parameters
+    ----------
+    start, end : string or datetime
+        Either can be None for an open-ended range.
+
+    Returns
+    ----------
+    function that takes a column of dates (or yyyy-mm-dd strings) and
+    returns a boolean array. Missing or unparseable dates are not kept.
+    """
+    start = None if start is None else pd.to_datetime(start)
+    end = None if end is None else pd.to_datetime(end)
+
+    def in_range(values):
+        dates = pd.to_datetime(values, errors='coerce')
+        keep = dates.notnull().values
+        if start is not None:
+            keep &= (dates >= start).values
+        if end is not None:
+            keep &= (dates < end).values
+        return keep
+    return in_range
+
+
+def _read_csv_filtered(fname, encoding=None, row_filter=None, usecols=None,
+                       chunk_size=READ_CHUNK_SIZE):
+    """
+    Read a csv file, keeping the rows that pass row_filter and the columns
+    in usecols (see read_table).
+
+    With a row_filter, the file is read once, chunk_size rows at a time, and
+    each chunk is filtered before the next is read, so only the kept rows
+    are held in memory.
+    """
+    if not row_filter:
+        return pd.read_csv(fname, low_memory=False, encoding=encoding,
+                           usecols=_column_selector(usecols))
+
+    # The filter columns are read too, even if they aren't used
+    if usecols is None:
+        read_columns = None
+    else:
+        read_columns = set(usecols) | set(row_filter)
+    reader = pd.read_csv(fname, low_memory=False, encoding=encoding,
+                         usecols=_column_selector(read_columns),
+                         chunksize=chunk_size)
+    chunks = []
+    for chunk in reader:
+        keys = chunk.rename(columns=lambda col: col.lstrip('\ufeff'))
+        chunks.append(chunk[_row_filter_mask(keys, row_filter)])
+    if len(chunks) == 0:
+        # A file with only a header has no chunks
+        df = pd.read_csv(fname, encoding=encoding, nrows=0,
+                         usecols=_column_selector(read_columns))
+    else:
+        df = pd.concat(chunks, ignore_index=True)
+    if usecols is not None:
+        df = df[[col for col in df.columns
+                 if col.lstrip('\ufeff') in set(usecols)]]
+    return df
+
+
 def read_table(file_spec, county=None, data_dir=None, paths=None,
                columns_to_drop=None, categorical_var=None,
                categorical_unknown=CATEGORICAL_UNKNOWN,
                time_var=None, duplicate_check_columns=None, dedup=True,
-               encoding=None, name_columns=None):
+               encoding=None, name_columns=None, row_filter=None,
+               usecols=None):
     """
     Read in any .csv table from multiple folders in the raw data.
 
@@ -154,6 +333,10 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
     dedup: boolean
         flag to turn on/off deduplication. Defaults to True
 
+    %s
+
+    %s
+
     Returns
     ----------
     dataframe of a csv tables from all included folders
@@ -165,41 +348,20 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
     if time_var is None:
         time_var = []
 
-    if not isinstance(file_spec, dict):
-        if data_dir is None:
-            if county is None:
-                raise ValueError('If file_spec is a string, data_dir or ' +
-                                 'county must be passed')
-            else:
-                if not isinstance(county, str):
-                    raise ValueError('county must be a string -- '
-                                     'one county at a time, please!')
-                data_dir = op.join(DATA_PATH, county)
-        if paths is None:
-            if county is None:
-                raise ValueError('If file_spec is a string, paths or county ' +
-                                 'must be passed')
-            else:
-                if not isinstance(county, str):
-                    raise ValueError('county must be a string -- '
-                                     'one county at a time, please!')
-                paths = COUNTY_FOLDERS[county]
-
-        file_spec = std_path_setup(file_spec, data_dir, paths)
-    else:
-        if data_dir is not None or paths is not None:
-            raise ValueError(
-                'If file_spec is a dict, data_dir and paths cannot be passed')
+    file_spec = _resolve_file_spec(file_spec, county=county,
+                                   data_dir=data_dir, paths=paths)
 
-    file_spec_use = file_spec.copy()
+    file_order = _read_order(file_spec)
 
     # Start by reading the first file into a DataFrame
-    path, fname = file_spec_use.popitem()
-    df = pd.read_csv(fname, low_memory=False, encoding=encoding)
+    path, fname = file_order[0]
+    df = _read_csv_filtered(fname, encoding=encoding, row_filter=row_filter,
+                            usecols=usecols)
 
     # Then, for the rest of the files, append to the DataFrame.
-    for path, fname in file_spec_use.items():
-        this_df = pd.read_csv(fname, low_memory=False, encoding=encoding)
+    for path, fname in file_order[1:]:
+        this_df = _read_csv_filtered(fname, encoding=encoding,
+                                     row_filter=row_filter, usecols=usecols)
         df = df.append(this_df)
 
     # Sometimes, column headers can have the unicode 'zero width no-break space
@@ -222,6 +384,12 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
             df = df.drop_duplicates(duplicate_check_columns, keep='last',
                                     inplace=False)
 
+    if usecols is not None:
+        # Only clean up the columns that were read
+        categorical_var = [col for col in categorical_var
+                           if col in df.columns]
+        time_var = [col for col in time_var if col in df.columns]
+
     # Turn values in categorical_unknown in any categorical_var into NaNs
     for col in categorical_var:
         df[col] = df[col].replace(categorical_unknown,
@@ -232,7 +400,9 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
         df[col] = pd.to_datetime(df[col], errors='coerce')
     return df
 
-read_table.__doc__ = read_table.__doc__ % file_path_boilerplate
+read_table.__doc__ = read_table.__doc__ % (file_path_boilerplate,
+                                           row_filter_boilerplate,
+                                           usecols_boilerplate)
 
 
 def split_rows_to_columns(df, category_column, category_suffix, merge_columns):
@@ -294,7 +464,8 @@ def split_rows_to_columns(df, category_column, category_suffix, merge_columns):
 
 
 def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
-                          paths=None, suffixes=ENTRY_EXIT_SUFFIX):
+                          paths=None, suffixes=ENTRY_EXIT_SUFFIX,
+                          row_filter=None, usecols=None):
     """
     Read in tables with entry & exit values, convert entry & exit rows to
     columns
@@ -312,6 +483,10 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
 
     %s
 
+    %s
+
+    %s
+
     Returns
     ----------
     dataframe with one row per person per enrollment -- rows containing
@@ -335,7 +510,7 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
             raise ValueError(k + ' entry must be present in metadata file')
 
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    row_filter=row_filter, usecols=usecols, **metadata)
 
     # Don't use the update stage data:
     df = df[(df[extra_metadata['collection_stage_column']] !=
@@ -343,6 +518,10 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
             (df[extra_metadata['collection_stage_column']] != extra_metadata['annual_assessment_stage_val']) &
             (df[extra_metadata['collection_stage_column']] != extra_metadata['post_exit_stage_val'])]
 
+    if df.shape[0] == 0:
+        # Nothing to reshape (e.g. a shard with no rows for this table)
+        return df[[extra_metadata['person_enrollment_ID']]]
+
     df_wide = split_rows_to_columns(df, extra_metadata['collection_stage_column'],
                                     dict(zip([extra_metadata['entry_stage_val'],
                                               extra_metadata['exit_stage_val']], suffixes)),
@@ -351,7 +530,7 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
     return df_wide
 
 read_entry_exit_table.__doc__ = read_entry_exit_table.__doc__ % (
-        file_path_boilerplate)
+        file_path_boilerplate, row_filter_boilerplate, usecols_boilerplate)
 
 
 def get_metadata_dict(metadata_file):
@@ -363,7 +542,8 @@ def get_metadata_dict(metadata_file):
 
 
 def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
-                   paths=None, metadata_file=METADATA_FILES['enrollment']):
+                   paths=None, metadata_file=METADATA_FILES['enrollment'],
+                   row_filter=None, usecols=None):
     """
     Read in the raw Enrollment tables.
 
@@ -376,6 +556,8 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
 
     %s
 
+    %s
+
     groups : boolean
         If true, only return rows for groups (>1 person)
 
@@ -385,7 +567,7 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
         enrollment, optionally with people who are not in groups removed
     """
     if file_spec is None:
-        file_spec = 'Enrollment.csv'
+        file_spec = TABLE_FILES['enrollment']
 
     metadata = get_metadata_dict(metadata_file)
     groupID_column = metadata.pop('groupID_column')
@@ -395,7 +577,7 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
     entry_date_column = metadata.pop('entry_date')
 
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    row_filter=row_filter, usecols=usecols, **metadata)
     # Now, group by HouseholdID, and only keep the groups where there are
     # more than one ProjectEntryID.
     # The new dataframe should represent families
@@ -412,11 +594,14 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
     return df
 
 get_enrollment.__doc__ = get_enrollment.__doc__ % (file_path_boilerplate,
-                                                   metdata_boilerplate)
+                                                   metdata_boilerplate,
+                                                   row_filter_boilerplate +
+                                                   usecols_boilerplate)
 
 
 def get_exit(county=None, file_spec=None, data_dir=None, paths=None,
-             metadata_file=METADATA_FILES['exit']):
+             metadata_file=METADATA_FILES['exit'],
+             row_filter=None, usecols=None):
     """
     Read in the raw Exit tables and map destinations.
 
@@ -426,18 +611,20 @@ def get_exit(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing exit record of a person per enrollment
     """
     if file_spec is None:
-        file_spec = 'Exit.csv'
+        file_spec = TABLE_FILES['exit']
 
     metadata = get_metadata_dict(metadata_file)
     df_destination_column = metadata.pop('destination_column')
     enid_column = metadata.pop('person_enrollment_ID')
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    row_filter=row_filter, usecols=usecols, **metadata)
 
     df_merge = pu.merge_destination(
         df, df_destination_column=df_destination_column)
@@ -445,12 +632,14 @@ def get_exit(county=None, file_spec=None, data_dir=None, paths=None,
     return df_merge
 
 get_exit.__doc__ = get_exit.__doc__ % (file_path_boilerplate,
-                                       metdata_boilerplate)
+                                       metdata_boilerplate,
+                                       row_filter_boilerplate +
+                                       usecols_boilerplate)
 
 
 def get_client(county=None, file_spec=None, data_dir=None, paths=None,
                metadata_file=METADATA_FILES['client'],
-               name_exclusion=False):
+               name_exclusion=False, row_filter=None, usecols=None):
     """
     Read in the raw Client tables.
 
@@ -460,12 +649,14 @@ def get_client(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing demographic information of a person
     """
     if file_spec is None:
-        file_spec = 'Client.csv'
+        file_spec = TABLE_FILES['client']
 
     metadata = get_metadata_dict(metadata_file)
     # Don't want to deduplicate before checking if DOB is sane because the last
@@ -497,7 +688,8 @@ def get_client(county=None, file_spec=None, data_dir=None, paths=None,
                               [pid_column]))
 
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    duplicate_check_columns=mid_dedup_cols, **metadata)
+                    duplicate_check_columns=mid_dedup_cols,
+                    row_filter=row_filter, usecols=usecols, **metadata)
     df = df.set_index(np.arange(df.shape[0]))
 
     # iterate through people with more than one entry and resolve differences.
@@ -577,13 +769,16 @@ def get_client(county=None, file_spec=None, data_dir=None, paths=None,
     return df
 
 get_client.__doc__ = get_client.__doc__ % (file_path_boilerplate,
-                                           metdata_boilerplate)
+                                           metdata_boilerplate,
+                                           row_filter_boilerplate +
+                                           usecols_boilerplate)
 
 
 def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
                      metadata_file=METADATA_FILES['disabilities'],
                      disability_type_file=op.join(DATA_PATH, 'metadata',
-                                                  'disability_type.json')):
+                                                  'disability_type.json'),
+                     row_filter=None, usecols=None):
     """
     Read in the raw Disabilities tables, convert sets of disablity type
     and response rows to columns to reduce to one row per
@@ -595,6 +790,8 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
 
     %s
 
+    %s
+
     disability_type_file : string
         name of json file with mapping between disability numeric codes and
         string description
@@ -605,7 +802,7 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
         exit of a person per enrollment
     """
     if file_spec is None:
-        file_spec = 'Disabilities.csv'
+        file_spec = TABLE_FILES['disabilities']
 
     metadata = get_metadata_dict(metadata_file)
     extra_metadata = {'type_column': None,
@@ -622,7 +819,10 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
     stage_suffixes = ENTRY_EXIT_SUFFIX
     df_stage = read_entry_exit_table(metadata, county=county,
                                      file_spec=file_spec, data_dir=data_dir,
-                                     paths=paths, suffixes=stage_suffixes)
+                                     paths=paths, suffixes=stage_suffixes,
+                                     row_filter=row_filter, usecols=usecols)
+    if df_stage.shape[0] == 0:
+        return df_stage
 
     mapping_dict = get_metadata_dict(disability_type_file)
     # convert to integer keys
@@ -663,11 +863,14 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
     return df_wide
 
 get_disabilities.__doc__ = get_disabilities.__doc__ % (file_path_boilerplate,
-                                                       metdata_boilerplate)
+                                                       metdata_boilerplate,
+                                                       row_filter_boilerplate +
+                                                       usecols_boilerplate)
 
 
 def get_employment_education(county=None, file_spec=None, data_dir=None, paths=None,
-                             metadata_file=METADATA_FILES['employment_education']):
+                             metadata_file=METADATA_FILES['employment_education'],
+                             row_filter=None, usecols=None):
     """
     Read in the raw EmploymentEducation tables.
 
@@ -677,26 +880,31 @@ def get_employment_education(county=None, file_spec=None, data_dir=None, paths=N
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing employment and education at entry & exit
               of a person per enrollment
     """
     if file_spec is None:
-        file_spec = 'EmploymentEducation.csv'
+        file_spec = TABLE_FILES['employment_education']
 
     df_wide = read_entry_exit_table(metadata_file, county=county,
                                     file_spec=file_spec, data_dir=data_dir,
-                                    paths=paths)
+                                    paths=paths, row_filter=row_filter,
+                                    usecols=usecols)
 
     return df_wide
 
 get_employment_education.__doc__ = get_employment_education.__doc__ % (
-    file_path_boilerplate, metdata_boilerplate)
+    file_path_boilerplate, metdata_boilerplate,
+    row_filter_boilerplate + usecols_boilerplate)
 
 
 def get_health_dv(county=None, file_spec=None, data_dir=None, paths=None,
-                  metadata_file=METADATA_FILES['health_dv']):
+                  metadata_file=METADATA_FILES['health_dv'],
+                  row_filter=None, usecols=None):
     """
     Read in the raw HealthAndDV tables.
 
@@ -706,26 +914,32 @@ def get_health_dv(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing employment and education at entry & exit
               of a person per enrollment
     """
     if file_spec is None:
-        file_spec = 'HealthAndDV.csv'
+        file_spec = TABLE_FILES['health_dv']
 
     df_wide = read_entry_exit_table(metadata_file, county=county,
                                     file_spec=file_spec, data_dir=data_dir,
-                                    paths=paths)
+                                    paths=paths, row_filter=row_filter,
+                                    usecols=usecols)
 
     return df_wide
 
 get_health_dv.__doc__ = get_health_dv.__doc__ % (file_path_boilerplate,
-                                                 metdata_boilerplate)
+                                                 metdata_boilerplate,
+                                                 row_filter_boilerplate +
+                                                 usecols_boilerplate)
 
 
 def get_income(county=None, file_spec=None, data_dir=None, paths=None,
-               metadata_file=METADATA_FILES['income']):
+               metadata_file=METADATA_FILES['income'],
+               row_filter=None, usecols=None):
     """
     Read in the raw IncomeBenefits tables.
 
@@ -735,13 +949,15 @@ def get_income(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing income at entry & exit of a person per
         enrollment
     """
     if file_spec is None:
-        file_spec = 'IncomeBenefits.csv'
+        file_spec = TABLE_FILES['income']
 
     metadata = get_metadata_dict(metadata_file)
     if 'columns_to_take_max' in metadata:
@@ -754,7 +970,8 @@ def get_income(county=None, file_spec=None, data_dir=None, paths=None,
     suffixes = ENTRY_EXIT_SUFFIX
     df_wide = read_entry_exit_table(metadata, county=county,
                                     file_spec=file_spec, data_dir=data_dir,
-                                    paths=paths, suffixes=suffixes)
+                                    paths=paths, suffixes=suffixes,
+                                    row_filter=row_filter, usecols=usecols)
 
     maximize_cols = []
     for sf in suffixes:
@@ -787,13 +1004,16 @@ def get_income(county=None, file_spec=None, data_dir=None, paths=None,
     return df_wide
 
 get_income.__doc__ = get_income.__doc__ % (file_path_boilerplate,
-                                           metdata_boilerplate)
+                                           metdata_boilerplate,
+                                           row_filter_boilerplate +
+                                           usecols_boilerplate)
 
 
 def get_project(county=None, file_spec=None, data_dir=None, paths=None,
                 metadata_file=METADATA_FILES['project'],
                 project_type_file=op.join(DATA_PATH, 'metadata',
-                                          'project_type.json')):
+                                          'project_type.json'),
+                row_filter=None, usecols=None):
     """
     Read in the raw Exit tables and map to project info.
 
@@ -803,18 +1023,20 @@ def get_project(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing exit record of a person per enrollment
     """
     if file_spec is None:
-        file_spec = 'Project.csv'
+        file_spec = TABLE_FILES['project']
 
     metadata = get_metadata_dict(metadata_file)
     project_type_column = metadata.pop('project_type_column')
     projectID = metadata.pop('program_ID')
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    row_filter=row_filter, usecols=usecols, **metadata)
 
     # get project_type dict
     mapping_dict = get_metadata_dict(project_type_file)
@@ -838,87 +1060,623 @@ def get_project(county=None, file_spec=None, data_dir=None, paths=None,
     return df_merge
 
 get_project.__doc__ = get_project.__doc__ % (file_path_boilerplate,
-                                             metdata_boilerplate)
+                                             metdata_boilerplate,
+                                             row_filter_boilerplate +
+                                             usecols_boilerplate)
 
 
+# Tables whose rows are pivoted into _entry/_exit columns
+ENTRY_EXIT_TABLES = ['disabilities', 'employment_education', 'health_dv',
+                     'income']
 
-def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
-                 paths=None, files=None, groups=True, name_exclusion=False):
-    """ Run all functions that clean up raw tables separately, and merge them
-        all into the enrollment table, where each row represents the project
-        enrollment of an individual.
+# Metadata entries that name columns a loader needs for its own work
+KEY_METADATA = ['person_enrollment_ID', 'person_ID', 'program_ID',
+                'groupID_column', 'entry_date', 'destination_column',
+                'collection_stage_column', 'type_column', 'response_column',
+                'project_type_column', 'dob_column']
 
-        Parameters
-        ----------
-        county: string
-            name of county
 
-        meta_files: dict
-            dictionary giving names of metadata files for each table type
-            If any table type is missing it is defaulted using METADATA_FILES
+def _table_header(file_spec):
+    """The union of the column names of a table's csv files."""
+    header = []
+    for path, fname in _read_order(file_spec):
+        for col in pd.read_csv(fname, nrows=0).columns:
+            col = col.lstrip('\ufeff')
+            if col not in header:
+                header.append(col)
+    return header
 
-        files: dict
-            dictionary giving short data file names for each table type.
-                (these must be combined with data_dir, county & paths to get
-                the full file names)
-            If any table type is missing the file name is defaulted in the
-            respective get_* functions
 
-        data_dir : string
-            full path to general data folder (usually puget/data)
+def merge_usecols(columns, county=None, meta_files=METADATA_FILES,
+                  data_dir=None, paths=None, files=None,
+                  name_exclusion=False):
+    """
+    Work out which raw columns each table must be read with for
+    merge_tables to produce the given output columns.
 
-        paths : list
-            list of directories inside data_dir to look for csv files in
+    Every table is read with the columns it needs for deduplication and
+    joins (the ID columns and the other columns named in its metadata), plus
+    the raw columns that the requested output columns come from: the same
+    column for plain tables, and the column before its _entry/_exit (and
+    disability type) suffixes for the tables that are pivoted.
 
-        Returns
-        ----------
-        dataframe with rows representing the record of a person per
-        project enrollment
+    Parameters
+    ----------
+    columns : list
+        output columns of merge_tables
+
+    county, meta_files, data_dir, paths, files, name_exclusion :
+        As in merge_tables.
+
+    Returns
+    ----------
+    dict with the list of raw columns to read for each table type
     """
     if not isinstance(files, dict):
         files = {}
+    mapping_columns = pd.read_csv(op.join(pu.METADATA,
+                                          'destination_mappings.csv'),
+                                  nrows=0).columns
+    derived = {'exit': [col for col in mapping_columns if col != 'Standard'],
+               'project': ['ProjectNumeric', 'ProjectType']}
+
+    found = set()
+    usecols = {}
+    for table in TABLE_FILES:
+        metadata = get_metadata_dict(meta_files.get(table,
+                                                    METADATA_FILES[table]))
+        header = _table_header(_resolve_file_spec(
+            files.get(table, TABLE_FILES[table]), county=county,
+            data_dir=data_dir, paths=paths))
+
+        needed = set(metadata.get('duplicate_check_columns', []))
+        needed.update(metadata[k] for k in KEY_METADATA if k in metadata)
+        if table == 'client':
+            # get_client reconciles these between a person's rows
+            needed.update(metadata.get('time_var', []))
+            needed.update(metadata.get('boolean', []))
+            needed.update(metadata.get('numeric_code', []))
+            if name_exclusion:
+                needed.update(metadata.get('name_columns', []))
+
+        dropped = set(metadata.get('columns_to_drop', []))
+        for out_col in columns:
+            if out_col in derived.get(table, []):
+                found.add(out_col)
+            for col in header:
+                if col in dropped:
+                    continue
+                if table in ENTRY_EXIT_TABLES:
+                    if any(out_col.startswith(col + sf)
+                           for sf in ENTRY_EXIT_SUFFIX):
+                        needed.add(col)
+                        found.add(out_col)
+                elif out_col == col:
+                    needed.add(col)
+                    found.add(out_col)
+        if table == 'disabilities':
+            # the responses become <disability type>_entry/_exit columns
+            mapping_dict = get_metadata_dict(op.join(DATA_PATH, 'metadata',
+                                                     'disability_type.json'))
+            for out_col in columns:
+                if any(out_col == t + sf for t in mapping_dict.values()
+                       for sf in ENTRY_EXIT_SUFFIX):
+                    found.add(out_col)
+
+        usecols[table] = [col for col in header if col in needed]
+
+    missing = [col for col in columns if col not in found]
+    if len(missing):
+        raise ValueError('merge_tables cannot produce columns: ' +
+                         ', '.join(missing))
+    return usecols
+
+
+def compact_columns(meta_files=METADATA_FILES):
+    """
+    Work out the compact dtype of the merge_tables output columns that the
+    metadata files describe.
 
-    # Get enrollment data
-    enroll = get_enrollment(county=county,
-                            file_spec=files.get('enrollment', None),
-                            metadata_file=meta_files.get('enrollment', None),
-                            groups=groups, data_dir=data_dir,
-                            paths=paths)
-    print('enroll n_rows:', len(enroll))
-    enrollment_metadata = get_metadata_dict(meta_files.get('enrollment',
-                                            METADATA_FILES['enrollment']))
-    enrollment_enid_column = enrollment_metadata['person_enrollment_ID']
-    enrollment_pid_column = enrollment_metadata['person_ID']
-    enrollment_prid_column = enrollment_metadata['program_ID']
-    # print(enroll)
+    The columns listed as 'boolean' become nullable booleans, the columns
+    listed as 'numeric_code' become nullable 8 bit integers, the other
+    'categorical_var' columns become categoricals and the amounts (the
+    income columns_to_take_max that aren't categorical) become float32. The
+    columns of the tables that are pivoted are matched with their
+    _entry/_exit suffixes, and the disability responses by their disability
+    type columns.
 
-    # Merge exit in
-    exit_table = get_exit(county=county, file_spec=files.get('exit', None),
-                          metadata_file=meta_files.get('exit', None),
-                          data_dir=data_dir, paths=paths)
-    print('exit n_rows:', len(exit_table))
-    exit_metadata = get_metadata_dict(meta_files.get('exit',
-                                      METADATA_FILES['exit']))
-    exit_ppid_column = exit_metadata['person_enrollment_ID']
+    Parameters
+    ----------
+    meta_files : dict
+        As in merge_tables.
 
-    enroll_merge = pd.merge(left=enroll, right=exit_table, how='left',
-                            left_on=enrollment_enid_column,
-                            right_on=exit_ppid_column)
+    Returns
+    ----------
+    dict of the compact dtype of each output column: 'boolean', 'Int8',
+    'category' or 'float32'
+    """
+    dtypes = {}
+    for table in TABLE_FILES:
+        metadata = get_metadata_dict(meta_files.get(table,
+                                                    METADATA_FILES[table]))
+        boolean = metadata.get('boolean', [])
+        numeric_code = metadata.get('numeric_code', [])
+        categorical = metadata.get('categorical_var', [])
+        table_dtypes = {}
+        for col in categorical:
+            table_dtypes[col] = 'category'
+        for col in metadata.get('columns_to_take_max', []):
+            if col not in categorical:
+                table_dtypes[col] = 'float32'
+        for col in numeric_code:
+            table_dtypes[col] = 'Int8'
+        for col in boolean:
+            table_dtypes[col] = 'boolean'
+
+        if table == 'disabilities':
+            # the responses become <disability type>_entry/_exit columns
+            response = table_dtypes.pop(metadata['response_column'], None)
+            if response is not None:
+                mapping_dict = get_metadata_dict(
+                    op.join(DATA_PATH, 'metadata', 'disability_type.json'))
+                for disability_type in mapping_dict.values():
+                    table_dtypes[disability_type] = response
+        if table in ENTRY_EXIT_TABLES:
+            table_dtypes = {col + sf: dtype
+                            for col, dtype in table_dtypes.items()
+                            for sf in ENTRY_EXIT_SUFFIX}
+        dtypes.update(table_dtypes)
+    return dtypes
+
+
+def _compact_column(values, dtype):
+    """
+    Convert a column to a compact dtype, or return None if its values don't
+    fit the dtype (e.g. codes that aren't 0/1 for a boolean).
+    """
+    if dtype == 'category':
+        return values.astype('category')
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        return None
+    if dtype == 'float32':
+        return values.astype(np.float32)
+    valid = values.dropna()
+    if dtype == 'boolean':
+        if valid.isin([0, 1]).all():
+            return values.astype('boolean')
+        dtype = 'Int8'
+    info = np.iinfo(np.int8)
+    if (len(valid) == 0 or
+            ((valid == np.floor(valid)).all() and
+             valid.min() >= info.min and valid.max() <= info.max)):
+        return values.astype('Int8')
+    return None
+
+
+def compact_dtypes(df, meta_files=METADATA_FILES):
+    """
+    Convert the columns of merged enrollments to compact dtypes, as given by
+    compact_columns.
 
-    if enrollment_enid_column != exit_ppid_column and \
-            exit_ppid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(exit_ppid_column, axis=1)
+    Columns that are already of their compact dtype, and columns whose
+    values don't fit it (e.g. numeric codes beyond 8 bits), are left as they
+    are.
 
-    # Merge client in
-    client = get_client(county=county, file_spec=files.get('client', None),
-                        metadata_file=meta_files.get('client', None),
-                        data_dir=data_dir, paths=paths,
-                        name_exclusion=name_exclusion)
+    Parameters
+    ----------
+    df : dataframe
+        Merged enrollments, from merge_tables.
 
-    print('client n_rows:', len(client))
-    client_metadata = get_metadata_dict(meta_files.get('client',
-                                        METADATA_FILES['client']))
+    meta_files : dict
+        As in merge_tables.
+
+    Returns
+    ----------
+    a copy of df with compact columns
+    """
+    df = df.copy()
+    for col, dtype in compact_columns(meta_files).items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        values = _compact_column(df[col], dtype)
+        if values is not None:
+            df[col] = values
+    return df
+
+
+def _compact_merged(df, meta_files, report):
+    """
+    Convert merged enrollments to compact dtypes, reporting the memory used
+    by the converted columns, and in total, before and after.
+    """
+    with report.stage('compact', n_rows_in=df.shape[0]) as metrics:
+        compact = compact_dtypes(df, meta_files=meta_files)
+        memory = pu.memory_report(df, compact)
+        converted = memory['dtype_before'] != memory['dtype_after']
+        converted['total'] = True
+        metrics.n_rows_out = compact.shape[0]
+        metrics.counts['bytes_before'] = int(memory.loc['total',
+                                                        'bytes_before'])
+        metrics.counts['bytes_after'] = int(memory.loc['total',
+                                                       'bytes_after'])
+        report.message('Memory before and after:\n' +
+                       memory[converted].to_string())
+    return compact
+
+
+def cohort_filter(entry_dates=None, project_types=None, county=None,
+                  meta_files=METADATA_FILES, data_dir=None, paths=None,
+                  files=None,
+                  project_type_file=op.join(DATA_PATH, 'metadata',
+                                            'project_type.json')):
+    """
+    Make the enrollment row_filter (see read_table) for a cohort of entry
+    dates and project types.
+
+    Parameters
+    ----------
+    entry_dates, project_types :
+        As in merge_tables.
+
+    county, meta_files, data_dir, paths, files :
+        As in merge_tables. The project table is read to find the projects
+        of the given types.
+
+    project_type_file : string
+        Metadata file of the names of the project type codes, to find the
+        codes of project types given by name.
+
+    Returns
+    ----------
+    dict keyed by enrollment columns, or None if neither predicate is given
+    """
+    if not isinstance(files, dict):
+        files = {}
+    enrollment_metadata = get_metadata_dict(
+        meta_files.get('enrollment', METADATA_FILES['enrollment']))
+    row_filter = {}
+    if entry_dates is not None:
+        start, end = entry_dates
+        row_filter[enrollment_metadata['entry_date']] = \
+            date_range_filter(start, end)
+    if project_types is not None:
+        project_metadata = get_metadata_dict(
+            meta_files.get('project', METADATA_FILES['project']))
+        project_id_column = project_metadata['program_ID']
+        project_type_column = project_metadata['project_type_column']
+        file_spec = files.get('project', None)
+        if file_spec is None:
+            file_spec = TABLE_FILES['project']
+        project = read_table(file_spec, county=county, data_dir=data_dir,
+                             paths=paths, dedup=False,
+                             usecols=[project_id_column,
+                                      project_type_column])
+        # Project types can be given by name or by number
+        names = get_metadata_dict(project_type_file)
+        type_numbers = [int(k) for k, v in names.items()
+                        if v in project_types]
+        type_numbers += [t for t in project_types if not isinstance(t, str)]
+        in_types = project[project_type_column].isin(type_numbers)
+        row_filter[enrollment_metadata['program_ID']] = \
+            project.loc[in_types, project_id_column].unique()
+    return row_filter or None
+
+
+# Tables that are joined on the person enrollment ID, and so are sharded by
+# the person of each enrollment:
+ENROLLMENT_KEYED_TABLES = ['exit', 'disabilities', 'employment_education',
+                           'health_dv', 'income']
+
+# Column added to the sharded client tables to restore the unsharded row
+# order after the shards are merged:
+SHARD_ORDER_COLUMN = '__shard_row'
+
+
+def _read_csv_columns(fname, columns, **kwargs):
+    """
+    Read the given columns of a csv file as strings, allowing for the
+    zero width no-break space that some headers start with.
+    """
+    def wanted(col):
+        return col.lstrip('\ufeff') in columns
+    df = pd.read_csv(fname, usecols=wanted, dtype=str, **kwargs)
+    if isinstance(df, pd.DataFrame):
+        df.columns = [col.lstrip('\ufeff') for col in df.columns]
+    return df
+
+
+def _shard_of(values, n_shards):
+    """Hash values (as read from csv files) to shard numbers."""
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+def _write_shards(fname, shard_fnames, get_shards, order_start=None,
+                  chunk_rows=SHARD_CHUNK_ROWS):
+    """
+    Split a csv file into one csv file per shard, a chunk of rows at a time.
+
+    get_shards is called with each chunk (with the columns read as strings)
+    and the position of its first row in the file, and returns the shard of
+    each row, or -1 to drop the row.
+
+    If order_start is given, a SHARD_ORDER_COLUMN numbering the rows from
+    order_start is added.
+
+    Returns
+    ----------
+    array with the number of rows written to each shard
+    """
+    # Strip the zero width no-break space that some headers start with (as
+    # read_table does)
+    header = [col.lstrip('\ufeff')
+              for col in pd.read_csv(fname, nrows=0).columns]
+    if order_start is not None:
+        header.append(SHARD_ORDER_COLUMN)
+    counts = np.zeros(len(shard_fnames), dtype=np.int64)
+    outfiles = [open(f, 'w', newline='') for f in shard_fnames]
+    try:
+        for f in outfiles:
+            pd.DataFrame(columns=header).to_csv(f, index=False)
+        start = 0
+        for chunk in pd.read_csv(fname, dtype=str, chunksize=chunk_rows):
+            if order_start is not None:
+                chunk[SHARD_ORDER_COLUMN] = np.arange(
+                    order_start + start, order_start + start + chunk.shape[0])
+            chunk.columns = header
+            shards = get_shards(chunk, start)
+            counts += np.bincount(shards[shards >= 0],
+                                  minlength=len(shard_fnames))
+            for shard, f in enumerate(outfiles):
+                chunk[shards == shard].to_csv(f, header=False, index=False)
+            start += chunk.shape[0]
+    finally:
+        for f in outfiles:
+            f.close()
+    return counts
+
+
+def partition_tables(n_shards, shard_dir, county=None,
+                     meta_files=METADATA_FILES, data_dir=None, paths=None,
+                     files=None, groups=True, enrollment_filter=None):
+    """
+    Hash-partition the raw tables used by merge_tables into shards by person.
+
+    Enrollment and client rows are assigned to a shard by a hash of their
+    person ID, and the rows of the tables joined on the person enrollment ID
+    go to the shard of their enrollment, so every join in merge_tables can
+    be done within a shard. Enrollment rows that get_enrollment would drop
+    (duplicates, and people not in groups if groups is True) and rows of the
+    other tables that don't belong to any remaining enrollment are left out.
+    The project table is small and joined on the project ID, so it is not
+    sharded.
+
+    Parameters
+    ----------
+    n_shards : int
+        Number of shards.
+
+    shard_dir : string
+        Directory to write the shards to, one sub-directory per shard.
+
+    county, meta_files, data_dir, paths, files, groups :
+        As in merge_tables.
+
+    enrollment_filter : dict
+        row_filter (see read_table) of the enrollment rows to keep, e.g.
+        from cohort_filter. Default is None (keep all rows).
+
+    Returns
+    ----------
+    list of dicts, one per shard, giving the file_spec dict of each table
+        (to be passed as the files argument of merge_tables), or None for
+        shards with no clients.
+    """
+    if not isinstance(files, dict):
+        files = {}
+
+    def table_files(table):
+        return _resolve_file_spec(files.get(table, TABLE_FILES[table]),
+                                  county=county, data_dir=data_dir,
+                                  paths=paths)
+
+    def shard_files(table, file_spec):
+        shard_specs = []
+        for shard in range(n_shards):
+            spec = {}
+            for i, path in enumerate(file_spec):
+                this_dir = op.join(shard_dir, 'shard_%d' % shard, str(i))
+                os.makedirs(this_dir, exist_ok=True)
+                spec[path] = op.join(this_dir, TABLE_FILES[table])
+            shard_specs.append(spec)
+        return shard_specs
+
+    enrollment_metadata = get_metadata_dict(
+        meta_files.get('enrollment', METADATA_FILES['enrollment']))
+    enid_column = enrollment_metadata['person_enrollment_ID']
+    pid_column = enrollment_metadata['person_ID']
+    group_column = enrollment_metadata['groupID_column']
+    duplicate_check_columns = enrollment_metadata.get(
+        'duplicate_check_columns', None)
+
+    # Find the enrollment rows that get_enrollment keeps, and the shard of
+    # each enrollment
+    enroll_spec = table_files('enrollment')
+    key_columns = set([enid_column, pid_column, group_column])
+    if duplicate_check_columns is not None:
+        key_columns.update(duplicate_check_columns)
+    keys = []
+    for i, (path, fname) in enumerate(_read_order(enroll_spec)):
+        this_keys = _read_csv_columns(fname, key_columns)
+        this_keys['file'] = i
+        this_keys['row'] = np.arange(this_keys.shape[0])
+        if enrollment_filter:
+            # The filter columns are parsed as read_table parses them
+            filter_columns = pd.read_csv(
+                fname, low_memory=False,
+                usecols=lambda col: col.lstrip('\ufeff') in enrollment_filter)
+            filter_columns.columns = [col.lstrip('\ufeff')
+                                      for col in filter_columns.columns]
+            this_keys = this_keys[_row_filter_mask(filter_columns,
+                                                   enrollment_filter)]
+        keys.append(this_keys)
+    keys = pd.concat(keys, ignore_index=True)
+    if groups:
+        if duplicate_check_columns is not None:
+            keys = keys.drop_duplicates(duplicate_check_columns, keep='last')
+        group_sizes = keys[group_column].value_counts()
+        keys = keys[keys[group_column].isin(
+            group_sizes.index[group_sizes > 1])]
+    keys['shard'] = _shard_of(keys[pid_column], n_shards)
+    enid_shard = keys.drop_duplicates(enid_column, keep='last').set_index(
+        enid_column)['shard']
+
+    file_order = [path for path, fname in _read_order(enroll_spec)]
+    shard_specs = shard_files('enrollment', enroll_spec)
+    for path, fname in enroll_spec.items():
+        this_keys = keys[keys['file'] == file_order.index(path)]
+        row_shard = np.full(this_keys['row'].max() + 1
+                            if this_keys.shape[0] else 0, -1, dtype=np.int64)
+        row_shard[this_keys['row'].values] = this_keys['shard'].values
+
+        def get_shards(chunk, start):
+            rows = np.arange(start, start + chunk.shape[0])
+            shards = np.full(chunk.shape[0], -1, dtype=np.int64)
+            in_range = rows < row_shard.shape[0]
+            shards[in_range] = row_shard[rows[in_range]]
+            return shards
+        _write_shards(fname, [spec[path] for spec in shard_specs], get_shards)
+    shard_files_by_table = {'enrollment': shard_specs}
+
+    # Client rows go to the shard of their person. Number them in the order
+    # read_table reads them so the unsharded row order can be restored.
+    client_metadata = get_metadata_dict(
+        meta_files.get('client', METADATA_FILES['client']))
     client_pid_column = client_metadata['person_ID']
+    client_spec = table_files('client')
+    shard_specs = shard_files('client', client_spec)
+    n_clients = np.zeros(n_shards, dtype=np.int64)
+    order_start = 0
+
+    def get_shards(chunk, start):
+        return _shard_of(chunk[client_pid_column], n_shards)
+    for path, fname in _read_order(client_spec):
+        counts = _write_shards(fname, [spec[path] for spec in shard_specs],
+                               get_shards, order_start=order_start)
+        n_clients += counts
+        order_start += counts.sum()
+    shard_files_by_table['client'] = shard_specs
+
+    # The other tables follow their enrollments
+    for table in ENROLLMENT_KEYED_TABLES:
+        table_metadata = get_metadata_dict(
+            meta_files.get(table, METADATA_FILES[table]))
+        table_enid_column = table_metadata['person_enrollment_ID']
+        file_spec = table_files(table)
+        shard_specs = shard_files(table, file_spec)
+
+        def get_shards(chunk, start):
+            shards = chunk[table_enid_column].map(enid_shard)
+            return shards.fillna(-1).values.astype(np.int64)
+        for path, fname in file_spec.items():
+            _write_shards(fname, [spec[path] for spec in shard_specs],
+                          get_shards)
+        shard_files_by_table[table] = shard_specs
+
+    project_spec = table_files('project')
+    shards = []
+    for shard in range(n_shards):
+        if n_clients[shard] == 0:
+            # merge_tables keeps every client and nothing else, so there's
+            # nothing to merge in a shard without clients
+            shards.append(None)
+            continue
+        this_shard = {table: specs[shard]
+                      for table, specs in shard_files_by_table.items()}
+        this_shard['project'] = project_spec
+        shards.append(this_shard)
+    return shards
+
+
+def _merge_shard(kwargs):
+    """Run merge_tables on one shard (a top level function to use in a
+    process pool)."""
+    return merge_tables(**kwargs)
+
+
+def _merge_tables_sharded(n_shards, n_jobs=None, shard_dir=None, county=None,
+                          meta_files=METADATA_FILES, data_dir=None,
+                          paths=None, files=None, groups=True,
+                          name_exclusion=False, columns=None,
+                          entry_dates=None, project_types=None, report=None):
+    """
+    Partition the raw tables, run merge_tables on each shard in parallel
+    and concatenate the results in the unsharded row order.
+    """
+    enrollment_filter = cohort_filter(entry_dates=entry_dates,
+                                      project_types=project_types,
+                                      county=county, meta_files=meta_files,
+                                      data_dir=data_dir, paths=paths,
+                                      files=files)
+    with tempfile.TemporaryDirectory(dir=shard_dir) as temp_dir:
+        with report.stage('partition') as metrics:
+            shards = partition_tables(n_shards, temp_dir, county=county,
+                                      meta_files=meta_files,
+                                      data_dir=data_dir, paths=paths,
+                                      files=files, groups=groups,
+                                      enrollment_filter=enrollment_filter)
+            metrics.counts['n_shards'] = sum(shard_files is not None
+                                             for shard_files in shards)
+        if columns is not None:
+            columns = list(columns) + [SHARD_ORDER_COLUMN]
+        # The groups have already been selected in partition_tables, on the
+        # cohort's enrollments. The shards still need the cohort predicates
+        # to restrict the clients to the cohort's people.
+        kwargs = [{'meta_files': meta_files, 'files': shard_files,
+                   'groups': False, 'name_exclusion': name_exclusion,
+                   'columns': columns, 'entry_dates': entry_dates,
+                   'project_types': project_types}
+                  for shard_files in shards if shard_files is not None]
+        with report.stage('merge_shards') as metrics:
+            merged = []
+            with contextlib.ExitStack() as stack:
+                if n_jobs == 1:
+                    results = map(_merge_shard, kwargs)
+                else:
+                    executor = stack.enter_context(
+                        ProcessPoolExecutor(max_workers=n_jobs))
+                    results = executor.map(_merge_shard, kwargs)
+                for df in results:
+                    merged.append(df)
+                    report.progress(len(merged) / len(kwargs))
+            metrics.n_rows_out = sum(df.shape[0] for df in merged)
+
+    with report.stage('concat', n_rows_in=metrics.n_rows_out) as metrics:
+        merged = pd.concat([df for df in merged if df.shape[0] > 0],
+                           ignore_index=True, sort=False)
+        merged = merged.sort_values(SHARD_ORDER_COLUMN, kind='mergesort')
+        merged = merged.drop(SHARD_ORDER_COLUMN,
+                             axis=1).reset_index(drop=True)
+        # Columns that were entirely missing in some shards can come back
+        # as objects
+        merged = merged.infer_objects()
+        metrics.n_rows_out = merged.shape[0]
+    return merged
+
+
+def _clean_client_dob(client, enroll_merge, client_metadata,
+                      enrollment_metadata, report):
+    """
+    Clean up the DOBs of the client table and drop duplicate clients.
+
+    DOBs that are after a person's earliest enrollment in enroll_merge, or
+    before 1900, are set to NaT. If a person's (valid) DOBs differ by less
+    than a year they are set to the midpoint, otherwise to NaT. The number
+    of bad DOBs is recorded in the report's running stage.
+    """
+    client_pid_column = client_metadata['person_ID']
+    enrollment_pid_column = enrollment_metadata['person_ID']
+    entry_date_column = enrollment_metadata['entry_date']
     dob_column = client_metadata['dob_column']
     n_bad_dob = 0
     # set any DOBs to NaNs if they are in the future relative to the earliest
@@ -926,7 +1684,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
     gb = client.groupby(client_pid_column)
     for pid, group in gb:
         enroll_dates = enroll_merge[enroll_merge[enrollment_pid_column] ==
-                                    pid][enrollment_metadata['entry_date']]
+                                    pid][entry_date_column]
         earliest_enrollment = enroll_dates.min()
 
         bad_dob = np.logical_or(group[dob_column] > earliest_enrollment,
@@ -975,101 +1733,444 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
     client = client.drop_duplicates(client_metadata['duplicate_check_columns'],
                                     keep='last', inplace=False)
 
-    print('Found %d entries with bad DOBs' % n_bad_dob)
-
-    enroll_merge = pd.merge(left=enroll_merge, right=client, how='right',
-                            left_on=enrollment_pid_column,
-                            right_on=client_pid_column)
-
-    if enrollment_pid_column != client_pid_column and \
-            client_pid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(client_pid_column, axis=1)
-
-    # Merge disabilities in
-    disabilities = get_disabilities(county=county,
-                                    file_spec=files.get('disabilities', None),
-                                    metadata_file=meta_files.get('disabilities', None),
-                                    data_dir=data_dir,
-                                    paths=paths)
-    print('disabilities n_rows:', len(disabilities))
-    disabilities_metadata = get_metadata_dict(meta_files.get('disabilities',
-                                              METADATA_FILES['disabilities']))
-    disabilities_ppid_column = disabilities_metadata['person_enrollment_ID']
-    enroll_merge = enroll_merge.merge(disabilities, how='left',
-                                      left_on=enrollment_enid_column,
-                                      right_on=disabilities_ppid_column)
-
-    if enrollment_enid_column != disabilities_ppid_column and \
-            disabilities_ppid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(disabilities_ppid_column, axis=1)
-
-    # Merge employment_education in
-    emp_edu = get_employment_education(county=county,
-                                       file_spec=files.get('employment_education', None),
-                                       metadata_file=meta_files.get('employment_education', None),
-                                       data_dir=data_dir, paths=paths)
-    print('emp_edu n_rows:', len(emp_edu))
-    emp_edu_metadata = get_metadata_dict(meta_files.get('employment_education',
-                                         METADATA_FILES['employment_education']))
-    emp_edu_ppid_column = emp_edu_metadata['person_enrollment_ID']
-    enroll_merge = enroll_merge.merge(emp_edu, how='left',
-                                      left_on=enrollment_enid_column,
-                                      right_on=emp_edu_ppid_column)
-
-    if enrollment_enid_column != emp_edu_ppid_column and \
-            emp_edu_ppid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(emp_edu_ppid_column, axis=1)
-
-    # Merge health in
-    health_dv = get_health_dv(county=county,
-                              file_spec=files.get('health_dv', None),
-                              metadata_file=meta_files.get('health_dv', None),
-                              data_dir=data_dir, paths=paths)
-    print('health_dv n_rows:', len(health_dv))
-    health_dv_metadata = get_metadata_dict(meta_files.get('health_dv',
-                                           METADATA_FILES['health_dv']))
-    health_dv_ppid_column = health_dv_metadata['person_enrollment_ID']
-    enroll_merge = enroll_merge.merge(health_dv, how='left',
-                                      left_on=enrollment_enid_column,
-                                      right_on=health_dv_ppid_column)
-
-    if enrollment_enid_column != health_dv_ppid_column and \
-            health_dv_ppid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(health_dv_ppid_column, axis=1)
-
-    # Merge income in
-    income = get_income(county=county, file_spec=files.get('income', None),
-                        metadata_file=meta_files.get('income', None),
-                        data_dir=data_dir, paths=paths)
-    print('income n_rows:', len(income))
-    income_metadata = get_metadata_dict(meta_files.get('income',
-                                        METADATA_FILES['income']))
-    income_ppid_column = income_metadata['person_enrollment_ID']
-    enroll_merge = enroll_merge.merge(income, how='left',
-                                      left_on=enrollment_enid_column,
-                                      right_on=income_ppid_column)
-
-    if enrollment_enid_column != income_ppid_column and \
-            income_ppid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(income_ppid_column, axis=1)
+    report.count('n_bad_dob', n_bad_dob)
+    report.message('Found %d entries with bad DOBs' % n_bad_dob)
+
+    return client
+
+
+def _join_table(enroll_merge, df, left_column, right_column, how='left'):
+    """
+    Join a table into the merged enrollments, dropping the table's key
+    column if it has a different name.
+    """
+    enroll_merge = pd.merge(left=enroll_merge, right=df, how=how,
+                            left_on=left_column, right_on=right_column)
+
+    if left_column != right_column and right_column in enroll_merge.columns:
+        enroll_merge = enroll_merge.drop(right_column, axis=1)
+    return enroll_merge
+
+
+def _id_columns(metadata):
+    """Domains of a table's ID columns (see puget.ids), keyed by column."""
+    return {metadata[key]: domain for key, domain in ID_DOMAINS.items()
+            if key in metadata}
+
+
+def _fill_missing_codes(df, columns):
+    """
+    Restore encoded ID columns to int32 after an outer join, which leaves
+    missing values (and float columns) for the rows without a match.
+    """
+    for column in columns:
+        if column in df.columns and df[column].isnull().any():
+            df[column] = df[column].fillna(MISSING).astype(np.int32)
+    return df
+
+
+# The tables merge_tables joins into the enrollments, in order
+MERGE_TABLE_ORDER = ['exit', 'client', 'disabilities', 'employment_education',
+                     'health_dv', 'income', 'project']
+
+
+def merge_fingerprints(county=None, meta_files=METADATA_FILES, data_dir=None,
+                       paths=None, files=None, groups=True,
+                       name_exclusion=False, usecols=None, entry_dates=None,
+                       project_types=None):
+    """
+    Fingerprints of the inputs of each stage of merge_tables, for
+    checkpointing (see puget.checkpoint).
+
+    The stages are 'enrollment', then for each table in MERGE_TABLE_ORDER,
+    reading the table and joining it in ('merge_<table>'). Each stage's
+    fingerprint covers the size and modification time of the table's csv
+    files, its metadata, the options that change it and the fingerprint of
+    the stage before it.
+
+    Parameters
+    ----------
+    county, meta_files, data_dir, paths, files, groups, name_exclusion,
+    entry_dates, project_types :
+        As in merge_tables.
+
+    usecols : dict
+        Columns read from each table, from merge_usecols.
+
+    Returns
+    ----------
+    dict of the fingerprint of each stage, in the order they are run
+    """
+    if not isinstance(files, dict):
+        files = {}
+    if usecols is None:
+        usecols = {}
+
+    def table_inputs(table):
+        file_spec = _resolve_file_spec(files.get(table, TABLE_FILES[table]),
+                                       county=county, data_dir=data_dir,
+                                       paths=paths)
+        metadata = get_metadata_dict(meta_files.get(table,
+                                                    METADATA_FILES[table]))
+        return {'files': [file_fingerprint(fname)
+                          for path, fname in _read_order(file_spec)],
+                'metadata': metadata, 'usecols': usecols.get(table, None)}
+
+    inputs = {'enrollment': table_inputs('enrollment')}
+    inputs['enrollment'].update({'groups': groups, 'entry_dates': entry_dates,
+                                 'project_types': project_types,
+                                 'version': __version__})
+    if project_types is not None:
+        inputs['enrollment']['project'] = table_inputs('project')
+    stages = ['enrollment']
+    for table in MERGE_TABLE_ORDER:
+        inputs[table] = table_inputs(table)
+        stages += [table, 'merge_' + table]
+    inputs['client']['name_exclusion'] = name_exclusion
+    return chain_fingerprints(stages, inputs)
+
+
+def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
+                 paths=None, files=None, groups=True, name_exclusion=False,
+                 n_shards=1, n_jobs=None, shard_dir=None, columns=None,
+                 entry_dates=None, project_types=None, run_dir=None,
+                 ids=None, compact=False, report=None, profile=None):
+    """ Run all functions that clean up raw tables separately, and merge them
+        all into the enrollment table, where each row represents the project
+        enrollment of an individual.
+
+        Parameters
+        ----------
+        county: string
+            name of county
+
+        meta_files: dict
+            dictionary giving names of metadata files for each table type
+            If any table type is missing it is defaulted using METADATA_FILES
+
+        files: dict
+            dictionary giving short data file names for each table type.
+                (these must be combined with data_dir, county & paths to get
+                the full file names)
+            If any table type is missing the file name is defaulted in the
+            respective get_* functions
+
+        data_dir : string
+            full path to general data folder (usually puget/data)
+
+        paths : list
+            list of directories inside data_dir to look for csv files in
+
+        n_shards : int
+            If more than 1, hash-partition the raw tables by person into
+            this many shards on disk (see partition_tables), merge the
+            shards in parallel and concatenate them. The result is the same
+            as the unsharded merge, but no process holds all the tables.
+
+        n_jobs : int
+            Number of worker processes for the shards. Defaults to the
+            number of CPUs; 1 merges the shards one at a time in this
+            process.
+
+        shard_dir : string
+            Directory in which to write the (temporary) shards. Defaults to
+            the system temporary directory.
+
+        columns : list
+            Output columns to return. Only the raw columns these are made
+            from (and the columns needed for deduplication and joins) are
+            read, see merge_usecols. Default is None (all columns).
+
+        entry_dates : tuple
+            (start, end) dates: only merge the enrollments with an entry
+            date from start up to (not including) end. Either can be None
+            for an open-ended range. Default is None (all dates).
+
+        project_types : list
+            Only merge the enrollments in projects of these types, given as
+            names (e.g. 'Emergency Shelter') or numeric codes (see
+            project_type.json). Default is None (all project types).
+
+        The entry_dates and project_types predicates are applied while the
+        enrollment table is read, and the exit, client and entry/exit tables
+        are then only read for the enrollments (and people) that pass them.
+        So, whereas without a cohort the clients with no enrollment are kept
+        (with empty enrollment columns), with a cohort there is a row for
+        each of the cohort's enrollments only: clients with no enrollment in
+        the cohort are left out. Households (if groups is True) and the DOB
+        checks are based on the cohort's enrollments alone.
+
+        run_dir : string
+            Directory in which to checkpoint the output of each stage (see
+            merge_fingerprints), with a manifest of the stages' input
+            fingerprints. If merge_tables is run again with the same
+            run_dir, it resumes from the last checkpoint whose inputs are
+            unchanged, and stages with unchanged inputs are loaded rather
+            than recomputed. Not supported with n_shards > 1. Default is
+            None (no checkpoints).
+
+        ids : puget.ids.IDDictionary
+            If given, the person, enrollment, household and project ID
+            columns are encoded as dense int32 codes in this dictionary
+            (missing IDs are -1) as each table is read, so the tables are
+            joined on the codes. Decode the output with
+            ids.decode_columns. Not supported with run_dir. Default is None
+            (IDs as they are read).
+
+        compact : boolean
+            If True, convert the output columns to compact dtypes driven by
+            the metadata files (nullable booleans, 8 bit codes,
+            categoricals and float32 amounts, see compact_dtypes). Nothing
+            is printed: the memory used by each converted column, and in
+            total, before and after is recorded as a message of the report's
+            'compact' stage, with the totals as its 'bytes_before' and
+            'bytes_after' counts. Default is False.
+
+        report : puget.metrics.RunReport
+            Report in which to record the wall time, CPU time, peak memory
+            and row counts of each stage, and whose progress callback is
+            called as the stages run. If run_dir is given, the report is
+            also written there as report.json. Default is None (a new
+            report without a progress callback).
+
+        profile : string
+            Directory in which to write a cProfile .pstats file of each
+            stage (e.g. 'client.pstats'), whose top hotspots are also
+            printed, see puget.metrics.RunReport. The stages run in the
+            shard worker processes are not profiled. Default is None (no
+            profiling).
+
+        Returns
+        ----------
+        dataframe with rows representing the record of a person per
+        project enrollment
+    """
+    if ids is not None and run_dir is not None:
+        raise ValueError("ids can't be used with run_dir: checkpoints of "
+                         "encoded IDs are not supported")
+    if n_shards > 1 and run_dir is not None:
+        raise ValueError("run_dir can't be used with n_shards > 1: "
+                         "checkpoints are not supported for sharded merges")
+    if report is None:
+        report = RunReport(county)
+    with report.profiling(profile):
+        return _merge_tables(county=county, meta_files=meta_files,
+                             data_dir=data_dir, paths=paths, files=files,
+                             groups=groups, name_exclusion=name_exclusion,
+                             n_shards=n_shards, n_jobs=n_jobs,
+                             shard_dir=shard_dir, columns=columns,
+                             entry_dates=entry_dates,
+                             project_types=project_types, run_dir=run_dir,
+                             ids=ids, compact=compact, report=report)
+
+
+def _merge_tables(county, meta_files, data_dir, paths, files, groups,
+                  name_exclusion, n_shards, n_jobs, shard_dir, columns,
+                  entry_dates, project_types, run_dir, ids, compact, report):
+    """The merge of merge_tables, once its arguments are checked."""
+    if n_shards > 1:
+        enroll_merge = _merge_tables_sharded(
+            n_shards, n_jobs=n_jobs, shard_dir=shard_dir, county=county,
+            meta_files=meta_files, data_dir=data_dir, paths=paths,
+            files=files, groups=groups, name_exclusion=name_exclusion,
+            columns=columns, entry_dates=entry_dates,
+            project_types=project_types, report=report)
+        if ids is not None:
+            # The shards are merged in other processes, so the IDs are
+            # encoded once they are back together
+            enrollment_metadata = get_metadata_dict(
+                meta_files.get('enrollment', METADATA_FILES['enrollment']))
+            ids.encode_columns(enroll_merge, _id_columns(enrollment_metadata))
+        if compact:
+            enroll_merge = _compact_merged(enroll_merge, meta_files, report)
+        return enroll_merge
+
+    if not isinstance(files, dict):
+        files = {}
+
+    if columns is not None:
+        usecols = merge_usecols(columns, county=county, meta_files=meta_files,
+                                data_dir=data_dir, paths=paths, files=files,
+                                name_exclusion=name_exclusion)
+    else:
+        usecols = {}
+
+    fingerprints = merge_fingerprints(county=county, meta_files=meta_files,
+                                      data_dir=data_dir, paths=paths,
+                                      files=files, groups=groups,
+                                      name_exclusion=name_exclusion,
+                                      usecols=usecols,
+                                      entry_dates=entry_dates,
+                                      project_types=project_types)
+    # Only the enrollment stage and the stages after each join hold
+    # everything the later stages need.
+    checkpoints = StageCheckpoints(run_dir, fingerprints,
+                                   resume_stages=['enrollment'] +
+                                   ['merge_' + table
+                                    for table in MERGE_TABLE_ORDER])
+
+    def run_stage(name, compute, n_rows_in=None):
+        """Run a stage (or load its checkpoint), recording its metrics."""
+        with report.stage(name, n_rows_in=n_rows_in) as metrics:
+            if checkpoints.is_skipped(name):
+                metrics.status = 'skipped'
+            elif checkpoints.is_valid(name):
+                metrics.status = 'checkpoint'
+            df = checkpoints.stage(name, compute)
+            if df is not None:
+                metrics.n_rows_out = df.shape[0]
+        return df
+
+    def n_rows(df):
+        return None if df is None else df.shape[0]
+
+    enrollment_metadata = get_metadata_dict(meta_files.get('enrollment',
+                                            METADATA_FILES['enrollment']))
+    enrollment_enid_column = enrollment_metadata['person_enrollment_ID']
+    enrollment_pid_column = enrollment_metadata['person_ID']
+    enrollment_prid_column = enrollment_metadata['program_ID']
+    cohort = entry_dates is not None or project_types is not None
+
+    def encoded(df, metadata):
+        if ids is None:
+            return df
+        return ids.encode_columns(df, _id_columns(metadata))
+
+    def filter_values(column, key):
+        """Distinct IDs in a column of the merge so far, as read."""
+        values = enroll_merge[column].dropna().unique()
+        if ids is not None:
+            values = ids.decode(ID_DOMAINS[key],
+                                values[values != MISSING]).values
+        return values
+
+    # Get enrollment data
+    def read_enrollment():
+        enrollment_filter = cohort_filter(entry_dates=entry_dates,
+                                          project_types=project_types,
+                                          county=county,
+                                          meta_files=meta_files,
+                                          data_dir=data_dir, paths=paths,
+                                          files=files)
+        enroll = get_enrollment(county=county,
+                                file_spec=files.get('enrollment', None),
+                                metadata_file=meta_files.get('enrollment',
+                                                             None),
+                                groups=groups, data_dir=data_dir,
+                                paths=paths, row_filter=enrollment_filter,
+                                usecols=usecols.get('enrollment', None))
+        return encoded(enroll, enrollment_metadata)
+    enroll_merge = run_stage('enrollment', read_enrollment)
+
+    # Merge exit in. Only the exits of the enrollments we kept are read.
+    exit_metadata = get_metadata_dict(meta_files.get('exit',
+                                      METADATA_FILES['exit']))
+    exit_ppid_column = exit_metadata['person_enrollment_ID']
+
+    def read_exit():
+        exit_table = get_exit(county=county,
+                              file_spec=files.get('exit', None),
+                              metadata_file=meta_files.get('exit', None),
+                              data_dir=data_dir, paths=paths,
+                              row_filter={exit_ppid_column: filter_values(
+                                  enrollment_enid_column,
+                                  'person_enrollment_ID')},
+                              usecols=usecols.get('exit', None))
+        return encoded(exit_table, exit_metadata)
+    exit_table = run_stage('exit', read_exit)
+    enroll_merge = run_stage(
+        'merge_exit', lambda: _join_table(enroll_merge, exit_table,
+                                          enrollment_enid_column,
+                                          exit_ppid_column),
+        n_rows_in=n_rows(enroll_merge))
+
+    # Merge client in. For a cohort, only the cohort's people are read.
+    client_metadata = get_metadata_dict(meta_files.get('client',
+                                        METADATA_FILES['client']))
+    client_pid_column = client_metadata['person_ID']
+
+    def read_client():
+        if cohort:
+            client_filter = {client_pid_column: filter_values(
+                enrollment_pid_column, 'person_ID')}
+        else:
+            client_filter = None
+        client = get_client(county=county,
+                            file_spec=files.get('client', None),
+                            metadata_file=meta_files.get('client', None),
+                            data_dir=data_dir, paths=paths,
+                            name_exclusion=name_exclusion,
+                            row_filter=client_filter,
+                            usecols=usecols.get('client', None))
+        client = encoded(client, client_metadata)
+        return _clean_client_dob(client, enroll_merge, client_metadata,
+                                 enrollment_metadata, report)
+    client = run_stage('client', read_client)
+    enroll_merge = run_stage(
+        'merge_client', lambda: _join_table(enroll_merge, client,
+                                            enrollment_pid_column,
+                                            client_pid_column, how='right'),
+        n_rows_in=n_rows(enroll_merge))
+    if ids is not None:
+        # Clients without enrollments have no enrollment IDs
+        enroll_merge = _fill_missing_codes(enroll_merge,
+                                           _id_columns(enrollment_metadata))
+
+    # Merge the entry/exit tables in. Only the rows of the enrollments that
+    # are left after the client merge are read.
+    for table, get_table in [('disabilities', get_disabilities),
+                             ('employment_education',
+                              get_employment_education),
+                             ('health_dv', get_health_dv),
+                             ('income', get_income)]:
+        table_metadata = get_metadata_dict(meta_files.get(table,
+                                           METADATA_FILES[table]))
+        table_ppid_column = table_metadata['person_enrollment_ID']
+
+        def read_side_table():
+            df = get_table(county=county, file_spec=files.get(table, None),
+                           metadata_file=meta_files.get(table, None),
+                           data_dir=data_dir, paths=paths,
+                           row_filter={table_ppid_column: filter_values(
+                               enrollment_enid_column,
+                               'person_enrollment_ID')},
+                           usecols=usecols.get(table, None))
+            return encoded(df, table_metadata)
+        df = run_stage(table, read_side_table)
+        enroll_merge = run_stage(
+            'merge_' + table, lambda: _join_table(enroll_merge, df,
+                                                  enrollment_enid_column,
+                                                  table_ppid_column),
+            n_rows_in=n_rows(enroll_merge))
 
     # Merge project in
-    project = get_project(county=county, file_spec=files.get('project', None),
-                          metadata_file=meta_files.get('project', None),
-                          data_dir=data_dir, paths=paths)
-    print('project n_rows:', len(project))
     project_metadata = get_metadata_dict(meta_files.get('project',
                                          METADATA_FILES['project']))
     project_prid_column = project_metadata['program_ID']
-    enroll_merge = enroll_merge.merge(project, how='left',
-                                      left_on=enrollment_prid_column,
-                                      right_on=project_prid_column)
-
-    if enrollment_prid_column != project_prid_column and \
-            project_prid_column in enroll_merge.columns:
-        enroll_merge = enroll_merge.drop(project_prid_column, axis=1)
-
 
+    def read_project():
+        prid_values = filter_values(enrollment_prid_column, 'program_ID')
+        project = get_project(county=county,
+                              file_spec=files.get('project', None),
+                              metadata_file=meta_files.get('project', None),
+                              data_dir=data_dir, paths=paths,
+                              row_filter={project_prid_column: prid_values},
+                              usecols=usecols.get('project', None))
+        return encoded(project, project_metadata)
+    project = run_stage('project', read_project)
+    enroll_merge = run_stage(
+        'merge_project', lambda: _join_table(enroll_merge, project,
+                                             enrollment_prid_column,
+                                             project_prid_column),
+        n_rows_in=n_rows(enroll_merge))
+
+    if columns is not None:
+        enroll_merge = enroll_merge[list(columns)]
+    if compact:
+        enroll_merge = _compact_merged(enroll_merge, meta_files, report)
+
+    if run_dir is not None:
+        report.write(op.join(run_dir, REPORT_FILE))
     return enroll_merge
 
 
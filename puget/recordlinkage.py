@@ -1,41 +1,738 @@
 """
 
 """
+import contextlib
+import os
+import os.path as op
+import pickle
 import numpy as np
+import pandas as pd
 import recordlinkage as rl
 import networkx
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from puget.string_similarity import BATCH_STRING_METHODS
+from puget.pprl import dice_similarity, filter_columns
+from puget.ids import encode_ids
+from puget.metrics import RunReport
 
 
 MATCH_THRESHOLD = 0.5
 STRING_THRESHOLD = 0.85
 
-def block_and_match(df, block_variable, comparison_dict, match_threshold=MATCH_THRESHOLD,
-                    string_method="jarowinkler", string_threshold=STRING_THRESHOLD):
+# Number of candidate pairs held in memory at a time by the out-of-core
+# pair store:
+WINDOW_SIZE = 1000000
+
+
+def _within_one_edit(a, b):
     """
-    Use recordlinkage to block on one variable and compare on others
+    Check whether two strings differ by at most one substitution, insertion,
+    deletion or transposition of adjacent characters.
+    """
+    if a == b:
+        return True
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > 1:
+        return False
+    if len_a == len_b:
+        diff = [i for i in range(len_a) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (len(diff) == 2 and diff[1] == diff[0] + 1 and
+                a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len_a < len_b:
+        a, b = b, a
+    for i in range(len(a)):
+        if a[:i] + a[i + 1:] == b:
+            return True
+    return False
+
+
+def _deletion_neighbourhood(values):
+    """
+    Build the symmetric-deletion neighbourhood of a set of strings.
+
+    Parameters
+    ----------
+    values : Series
+        Distinct strings, indexed by an integer code.
+
+    Returns
+    -------
+    DataFrame with columns 'key' and 'code': one row for each string itself
+    and one for each string with a single character deleted.
+    """
+    lengths = values.str.len()
+    keys = [pd.DataFrame({'key': values.values, 'code': values.index})]
+    for i in range(int(lengths.max())):
+        these = values[lengths > i]
+        deleted = these.str[:i] + these.str[i + 1:]
+        keys.append(pd.DataFrame({'key': deleted.values,
+                                  'code': these.index}))
+    keys = pd.concat(keys, ignore_index=True)
+    return keys.drop_duplicates()
+
+
+def _pairs_to_index(position_a, position_b, df, df_b=None):
+    """
+    Turn pairs of record positions into a MultiIndex of record labels.
+
+    For deduplication (`df_b` is None), pairs are oriented like the
+    `recordlinkage` indexers, with the later record first, and self-pairs are
+    dropped. For linkage, positions refer to `df` followed by `df_b`, and only
+    pairs with one record in each frame are kept, with the `df` record first.
+    """
+    position_a = np.asarray(position_a, dtype=np.int64)
+    position_b = np.asarray(position_b, dtype=np.int64)
+    if df_b is None:
+        first = np.maximum(position_a, position_b)
+        second = np.minimum(position_a, position_b)
+        keep = first != second
+        index_a, index_b = df.index, df.index
+    else:
+        n_a = df.shape[0]
+        first = np.minimum(position_a, position_b)
+        second = np.maximum(position_a, position_b) - n_a
+        keep = (first < n_a) & (second >= 0)
+        index_a, index_b = df.index, df_b.index
+    pairs = pd.DataFrame({'first': first[keep], 'second': second[keep]})
+    pairs = pairs.drop_duplicates().sort_values(['first', 'second'])
+    return pd.MultiIndex.from_arrays([index_a[pairs['first'].values],
+                                      index_b[pairs['second'].values]])
+
+
+def near_match_index(df, variable, df_b=None):
+    """
+    Find record pairs whose values of a string variable are within one edit.
+
+    Two values are candidates if they share an element of their
+    symmetric-deletion neighbourhood (the string itself, or the string with
+    one character deleted), which catches single substitutions, insertions,
+    deletions and adjacent transpositions without comparing all pairs.
+    Candidates are then verified, so only pairs at edit distance zero or one
+    are returned.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The records to index.
+
+    variable : string
+        The string column to match on (e.g. 'ssn_as_str'). Missing values
+        are never matched.
+
+    df_b : DataFrame, optional
+        If given, pairs are made between the records of `df` and `df_b`
+        rather than within `df`.
+
+    Returns
+    -------
+    MultiIndex of record pairs, oriented like the `recordlinkage` indexers
+    (when deduplicating, the first label is the later record in `df`; when
+    linking, the first label is from `df` and the second from `df_b`).
+    """
+    values = df[variable]
+    if df_b is not None:
+        values = pd.concat([values, df_b[variable]], ignore_index=True)
+    valid = values.notnull().values
+    if not valid.any():
+        return _pairs_to_index([], [], df, df_b)
+    codes, uniques = pd.factorize(values[valid])
+    uniques = pd.Series(uniques, dtype=object)
+
+    # Candidate pairs of distinct values sharing a deletion key:
+    keys = _deletion_neighbourhood(uniques)
+    candidates = keys.merge(keys, on='key', suffixes=('_a', '_b'))
+    candidates = candidates[candidates['code_a'] < candidates['code_b']]
+    candidates = candidates[['code_a', 'code_b']].drop_duplicates()
+    is_near = [_within_one_edit(uniques[a], uniques[b]) for a, b in
+               zip(candidates['code_a'], candidates['code_b'])]
+    value_pairs = candidates[np.array(is_near, dtype=bool)]
+
+    # Identical values are always neighbours of each other:
+    same = pd.DataFrame({'code_a': np.arange(len(uniques)),
+                         'code_b': np.arange(len(uniques))})
+    value_pairs = pd.concat([same, value_pairs], ignore_index=True)
+
+    # Expand value pairs to record pairs:
+    records = pd.DataFrame({'code': codes,
+                            'position': np.where(valid)[0]})
+    pairs = value_pairs.merge(
+        records.rename(columns={'code': 'code_a', 'position': 'position_a'}),
+        on='code_a')
+    pairs = pairs.merge(
+        records.rename(columns={'code': 'code_b', 'position': 'position_b'}),
+        on='code_b')
+
+    return _pairs_to_index(pairs['position_a'].values,
+                           pairs['position_b'].values, df, df_b)
+
+
+# Mersenne prime used for the MinHash permutations. Q-gram hashes are
+# reduced below it, so that the products in the permutations fit in 64 bits:
+_MINHASH_PRIME = np.uint64((1 << 31) - 1)
+
+
+def _pairs_within_buckets(keys, positions, max_bucket_size=None):
+    """
+    Generate all (later, earlier) position pairs that share a bucket key.
+
+    Buckets larger than `max_bucket_size` are skipped.
+    """
+    buckets = pd.DataFrame({'key': keys, 'position': positions})
+    sizes = buckets.groupby('key')['position'].transform('size')
+    keep = sizes > 1
+    if max_bucket_size is not None:
+        keep &= sizes <= max_bucket_size
+    buckets = buckets[keep]
+    pairs = buckets.merge(buckets, on='key', suffixes=('_a', '_b'))
+    pairs = pairs[pairs['position_a'] > pairs['position_b']]
+    return pd.DataFrame({'position_a': pairs['position_a'].values,
+                         'position_b': pairs['position_b'].values})
+
+
+class LSHIndex(object):
+    """
+    Locality-sensitive hashing indexer for approximate name blocking.
+
+    Each record is represented by the set of character q-grams of the
+    variables in `on`, summarized by a MinHash signature of `num_perm`
+    values. The signature is cut into `bands` bands, and records that agree
+    on every value of at least one band become candidate pairs. Pairs of
+    records with q-gram Jaccard similarity s are found with probability
+    1 - (1 - s ** r) ** bands, with r = num_perm / bands rows per band, so
+    more bands (fewer rows per band) raises recall and the candidate count.
+
+    The `index` method follows the `recordlinkage` indexer interface, so an
+    instance can be given as the 'indexer' of a `link_list` entry in place
+    of blocking on a single variable.
+
+    Parameters
+    ----------
+    on : string or list
+        The variable(s) to compute q-grams on, e.g. ['fname', 'lname'].
+
+    q : int
+        Length of the character q-grams. Default: 2.
+
+    num_perm : int
+        Number of MinHash permutations. Default: 32.
+
+    bands : int
+        Number of bands; must divide `num_perm`. Default: 8.
+
+    max_bucket_size : int, optional
+        Buckets with more records than this are skipped, bounding the
+        number of pairs generated by very common names. Default: None.
+
+    chunk_size : int
+        Number of records to compute signatures for at a time, which bounds
+        the memory used. Default: 100000.
+
+    seed : int
+        Seed for drawing the MinHash permutations. Default: 0.
+    """
+    def __init__(self, on, q=2, num_perm=32, bands=8, max_bucket_size=None,
+                 chunk_size=100000, seed=0):
+        if num_perm % bands != 0:
+            raise ValueError('bands must divide num_perm')
+        if isinstance(on, str):
+            on = [on]
+        self.on = list(on)
+        self.q = q
+        self.num_perm = num_perm
+        self.bands = bands
+        self.max_bucket_size = max_bucket_size
+        self.chunk_size = chunk_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2 ** 31 - 1,
+                              size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 2 ** 31 - 1,
+                              size=num_perm).astype(np.uint64)
+
+    def _shingles(self, df):
+        """
+        Hash the q-grams of each record.
+
+        Returns the record positions and the q-gram hashes, reduced modulo
+        _MINHASH_PRIME and sorted by position.
+        """
+        positions = []
+        hashes = []
+        for i, col in enumerate(self.on):
+            values = df[col]
+            valid = values.notnull().values
+            padded = '#' + values[valid].astype(str).str.upper() + '#'
+            where = np.where(valid)[0]
+            lengths = padded.str.len().values
+            for start in range(int(lengths.max()) - self.q + 1
+                               if len(lengths) else 0):
+                has_gram = lengths >= start + self.q
+                grams = padded[has_gram].str[start:start + self.q]
+                # Prefix by the variable so that q-grams of different
+                # variables are distinct:
+                grams = str(i) + grams
+                positions.append(where[has_gram])
+                hashes.append(pd.util.hash_array(grams.values.astype(object)))
+        if len(positions) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.uint64)
+        positions = np.concatenate(positions)
+        hashes = np.concatenate(hashes) % _MINHASH_PRIME
+        order = np.argsort(positions, kind='mergesort')
+        return positions[order], hashes[order]
+
+    def signatures(self, df):
+        """
+        Compute MinHash signatures.
+
+        Parameters
+        ----------
+        df : DataFrame
+            The records to compute signatures for.
+
+        Returns
+        -------
+        positions : ndarray
+            The positions in `df` of the records that have at least one
+            q-gram.
+
+        signatures : ndarray
+            Array of shape (len(positions), num_perm).
+        """
+        positions, hashes = self._shingles(df)
+        positions, starts = np.unique(positions, return_index=True)
+        signatures = np.empty((len(positions), self.num_perm),
+                              dtype=np.uint64)
+        for k in range(self.num_perm):
+            permuted = (self._a[k] * hashes + self._b[k]) % _MINHASH_PRIME
+            if len(starts):
+                signatures[:, k] = np.minimum.reduceat(permuted, starts)
+        return positions, signatures
+
+    def _band_keys(self, signatures, band):
+        rows = self.num_perm // self.bands
+        keys = np.zeros(signatures.shape[0], dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for k in range(band * rows, (band + 1) * rows):
+                keys = keys * np.uint64(1000003) + signatures[:, k]
+        # Make keys from different bands distinct:
+        return keys ^ np.uint64(band)
+
+    def band_pairs(self, df, df_b=None):
+        """
+        Generate the candidate pairs of each band in turn.
+
+        The pairs of different bands can overlap. Only one band's pairs are
+        held in memory at a time, so they can be written out as they are
+        made (see `block_and_match` with a `pair_file`).
+
+        Parameters
+        ----------
+        df, df_b : DataFrame
+            As in `index`.
+
+        Yields
+        ------
+        DataFrame with columns 'position_a' and 'position_b' of the pairs of
+        a band, as positions in `df` (followed by `df_b`, if given), with
+        position_a > position_b.
+        """
+        records = df[self.on]
+        if df_b is not None:
+            records = pd.concat([records, df_b[self.on]], ignore_index=True)
+        positions = []
+        keys = [[] for _ in range(self.bands)]
+        for start in range(0, records.shape[0], self.chunk_size):
+            chunk = records.iloc[start:start + self.chunk_size]
+            these_positions, these_signatures = self.signatures(chunk)
+            positions.append(these_positions + start)
+            for band in range(self.bands):
+                keys[band].append(self._band_keys(these_signatures, band))
+        if len(positions) == 0:
+            return
+        positions = np.concatenate(positions)
+        for band in range(self.bands):
+            band_pairs = _pairs_within_buckets(
+                np.concatenate(keys[band]), positions,
+                max_bucket_size=self.max_bucket_size)
+            if df_b is not None:
+                # Only pairs across the two frames are needed:
+                n_a = df.shape[0]
+                across = ((band_pairs['position_a'] >= n_a) !=
+                          (band_pairs['position_b'] >= n_a))
+                band_pairs = band_pairs[across]
+            yield band_pairs
+
+    def index(self, df, df_b=None):
+        """
+        Make candidate record pairs.
+
+        Parameters
+        ----------
+        df : DataFrame
+            The records to deduplicate.
+
+        df_b : DataFrame, optional
+            If given, pairs are made between the records of `df` and `df_b`
+            rather than within `df`.
+
+        Returns
+        -------
+        MultiIndex of record pairs, oriented like the `recordlinkage`
+        indexers (when deduplicating, the first label is the later record in
+        `df`; when linking, the first label is from `df` and the second from
+        `df_b`).
+        """
+        pairs = pd.DataFrame({'position_a': np.array([], dtype=np.int64),
+                              'position_b': np.array([], dtype=np.int64)})
+        for band_pairs in self.band_pairs(df, df_b=df_b):
+            pairs = pd.concat([pairs, band_pairs],
+                              ignore_index=True).drop_duplicates()
+        return _pairs_to_index(pairs['position_a'].values,
+                               pairs['position_b'].values, df, df_b)
+
 
+def _batch_string_compare(s_left, s_right, string_method, string_threshold):
     """
+    Compare strings with one of the batched methods in
+    `puget.string_similarity`, thresholding like `recordlinkage`.
+    """
+    c = BATCH_STRING_METHODS[string_method](s_left.values, s_right.values)
+    if string_threshold is not None:
+        c = np.where(np.isnan(c), np.nan, c >= string_threshold)
+    return pd.Series(c, index=s_left.index)
+
+
+def _bloom_compare(*args):
+    """
+    Compare Bloom-filter encoded values (see `puget.pprl`) by their Dice
+    similarity, thresholding like string comparisons.
+
+    `args` are the word columns of the left records, those of the right
+    records and the threshold.
+    """
+    words, string_threshold = args[:-1], args[-1]
+    n_words = len(words) // 2
+    f1 = np.column_stack([w.values for w in words[:n_words]])
+    f2 = np.column_stack([w.values for w in words[n_words:]])
+    c = dice_similarity(f1, f2)
+    if string_threshold is not None:
+        c = np.where(np.isnan(c), np.nan, c >= string_threshold)
+    return pd.Series(c, index=words[0].index)
+
+
+def _make_compare(comparison_dict, string_method="jarowinkler",
+                  string_threshold=STRING_THRESHOLD, columns=()):
+    """
+    Set up the recordlinkage comparisons described by `comparison_dict`.
 
-    indexer = rl.BlockIndex(on=block_variable)
-    pairs = indexer.index(df)
+    `string_method` can be any method of `recordlinkage.Compare.string`, or
+    one of the batched methods in `puget.string_similarity`
+    ('batch_jarowinkler' or 'batch_levenshtein'). Variables compared with
+    "bloom" were encoded with `puget.pprl.encode_records`, and are compared
+    by the Dice similarity of the filters in their word columns, found in
+    `columns`, with the same threshold as strings.
+    """
     compare = rl.Compare()
     for k, v in comparison_dict.items():
         if v == "string":
-            compare.string(k, k, method=string_method,
-                           threshold=string_threshold, label=k,
-                           missing_value=np.nan)
+            if string_method in BATCH_STRING_METHODS:
+                compare.compare_vectorized(_batch_string_compare, k, k,
+                                           string_method, string_threshold,
+                                           label=k)
+            else:
+                compare.string(k, k, method=string_method,
+                               threshold=string_threshold, label=k,
+                               missing_value=np.nan)
+        if v == "bloom":
+            words = filter_columns(k, columns)
+            compare.compare_vectorized(_bloom_compare, words, words,
+                                       string_threshold, label=k)
         if v == "date":
             compare.date(k, k, label=k, missing_value=np.nan)
+    return compare
+
 
-    features = compare.compute(pairs, df)
+def _score(features, match_threshold=MATCH_THRESHOLD):
+    """
+    Average the comparison features and decide which pairs match.
+    """
     features["mean"] = features.mean(axis=1, skipna=True)
     features["match"] = features["mean"] > match_threshold
-
     return features
 
 
+def write_block_pairs(df, block_variable, fname, chunk_size=WINDOW_SIZE):
+    """
+    Write the candidate pairs of blocking on one variable to a file.
+
+    Pairs are generated a chunk at a time and appended to `fname` as int32
+    (later, earlier) record positions, so a pandas MultiIndex of all the
+    pairs is never held in memory.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The records to block.
+
+    block_variable : string
+        The variable to block on. Missing values are never paired.
+
+    fname : string
+        The file to write to. It is overwritten.
+
+    chunk_size : int
+        Approximate number of pairs to generate at a time.
+
+    Returns
+    -------
+    int : the number of pairs written.
+    """
+    values = df[block_variable]
+    valid = values.notnull().values
+    codes, _ = pd.factorize(values[valid])
+    order = np.argsort(codes, kind='mergesort')
+    positions = np.where(valid)[0][order].astype(np.int32)
+    codes = codes[order]
+
+    # Each record pairs with the records before it in its block:
+    group_starts = np.concatenate([[0], np.where(np.diff(codes))[0] + 1])
+    group_sizes = np.diff(np.concatenate([group_starts, [len(codes)]]))
+    starts = np.repeat(group_starts, group_sizes)
+    ranks = np.arange(len(codes)) - starts
+    ends = np.cumsum(ranks)
+
+    n_pairs = 0
+    with open(fname, 'wb') as f:
+        first = 0
+        while first < len(codes):
+            # Take records until the chunk has about chunk_size pairs:
+            last = max(np.searchsorted(ends, n_pairs + chunk_size,
+                                       side='right'), first + 1)
+            these_ranks = ranks[first:last]
+            total = these_ranks.sum()
+            within = (np.arange(total) -
+                      np.repeat(np.cumsum(these_ranks) - these_ranks,
+                                these_ranks))
+            pairs = np.empty((total, 2), dtype=np.int32)
+            pairs[:, 0] = np.repeat(positions[first:last], these_ranks)
+            pairs[:, 1] = positions[np.repeat(starts[first:last],
+                                              these_ranks) + within]
+            f.write(pairs.tobytes())
+            n_pairs += total
+            first = last
+    return int(n_pairs)
+
+
+def write_pairs(pairs, df, fname, append=False):
+    """
+    Write pairs of records of `df`, as a MultiIndex, to a pair file.
+
+    Parameters
+    ----------
+    pairs : MultiIndex
+        Pairs of record labels of `df`.
+
+    df : DataFrame
+        The records the labels refer to.
+
+    fname : string
+        The file to write to.
+
+    append : bool
+        Whether to add to the end of the file rather than overwrite it.
+
+    Returns
+    -------
+    int : the number of pairs written.
+    """
+    positions = np.empty((len(pairs), 2), dtype=np.int32)
+    for i in range(2):
+        positions[:, i] = df.index.get_indexer(pairs.get_level_values(i))
+    with open(fname, 'ab' if append else 'wb') as f:
+        f.write(positions.tobytes())
+    return positions.shape[0]
+
+
+def read_pairs(fname):
+    """
+    Memory-map a pair file.
+
+    Returns
+    -------
+    ndarray of shape (n_pairs, 2) with int32 record positions, backed by the
+    file rather than loaded into memory.
+    """
+    if op.getsize(fname) == 0:
+        # numpy can't memory-map an empty file
+        return np.empty((0, 2), dtype=np.int32)
+    pairs = np.memmap(fname, dtype=np.int32, mode='r')
+    return pairs.reshape(-1, 2)
+
+
+def dedupe_pair_file(fname, window_size=WINDOW_SIZE):
+    """
+    Remove repeated pairs from a pair file, in place.
+
+    The pairs are spread over temporary bucket files by their first record,
+    about `window_size` pairs to a bucket, and each bucket is deduplicated
+    in memory, so memory use doesn't grow with the number of pairs. The
+    pairs are left sorted within each bucket.
+
+    Parameters
+    ----------
+    fname : string
+        The pair file (see `write_block_pairs` and `write_pairs`).
+
+    window_size : int
+        Approximate number of pairs held in memory at a time.
+
+    Returns
+    -------
+    int : the number of pairs left.
+    """
+    pairs = read_pairs(fname)
+    n_buckets = max(1, -(-pairs.shape[0] // window_size))
+    bucket_fnames = ['%s.%d' % (fname, i) for i in range(n_buckets)]
+    with contextlib.ExitStack() as stack:
+        buckets = [stack.enter_context(open(bucket_fname, 'wb'))
+                   for bucket_fname in bucket_fnames]
+        for start in range(0, pairs.shape[0], window_size):
+            window = np.asarray(pairs[start:start + window_size])
+            # A pair as one int64, so np.unique can compare them
+            keys = ((window[:, 0].astype(np.int64) << 32) |
+                    window[:, 1].astype(np.int64))
+            bucket = window[:, 0] % n_buckets
+            for i in np.unique(bucket):
+                buckets[i].write(keys[bucket == i].tobytes())
+    del pairs
+
+    n_pairs = 0
+    with open(fname, 'wb') as f:
+        for bucket_fname in bucket_fnames:
+            keys = np.unique(np.fromfile(bucket_fname, dtype=np.int64))
+            os.remove(bucket_fname)
+            unique = np.empty((len(keys), 2), dtype=np.int32)
+            unique[:, 0] = keys >> 32
+            unique[:, 1] = keys & 0xffffffff
+            f.write(unique.tobytes())
+            n_pairs += len(keys)
+    return n_pairs
+
+
+def block_and_match(df, block_variable, comparison_dict, match_threshold=MATCH_THRESHOLD,
+                    string_method="jarowinkler", string_threshold=STRING_THRESHOLD,
+                    near_match_variable=None, indexer=None, df_b=None,
+                    pair_file=None, window_size=WINDOW_SIZE):
+    """
+    Use recordlinkage to block on one variable and compare on others
+
+    If `near_match_variable` is given, pairs of records whose values of that
+    variable are within one edit of each other (see `near_match_index`) are
+    compared as well as the pairs found by blocking.
+
+    If `indexer` is given (e.g. an `LSHIndex`), it is used to make the
+    candidate pairs instead of blocking on `block_variable`.
+
+    If `df_b` is given, records in `df` are compared to records in `df_b`,
+    instead of to each other.
+
+    If `pair_file` is given, the candidate pairs are written to that file
+    (see `write_block_pairs`) and compared `window_size` pairs at a time, so
+    that memory use doesn't grow with the number of pairs. Only the features
+    of the matching pairs are then returned. The pairs of an indexer with a
+    `band_pairs` method (like `LSHIndex`) are written a band at a time;
+    those of other indexers are made in memory first. A pair file can only
+    be used when deduplicating `df`, not with `df_b`.
+    """
+
+    if pair_file is not None:
+        if df_b is not None:
+            raise ValueError("pair_file can only be used to deduplicate one "
+                             "frame, not with df_b")
+        return _stream_block_and_match(df, block_variable, comparison_dict,
+                                       pair_file, window_size=window_size,
+                                       match_threshold=match_threshold,
+                                       string_method=string_method,
+                                       string_threshold=string_threshold,
+                                       near_match_variable=near_match_variable,
+                                       indexer=indexer)
+
+    if indexer is None:
+        indexer = rl.BlockIndex(on=block_variable)
+    if df_b is None:
+        pairs = indexer.index(df)
+    else:
+        pairs = indexer.index(df, df_b)
+    if near_match_variable is not None:
+        pairs = pairs.union(near_match_index(df, near_match_variable,
+                                             df_b=df_b))
+    compare = _make_compare(comparison_dict, string_method=string_method,
+                            string_threshold=string_threshold,
+                            columns=df.columns)
+
+    if df_b is None:
+        features = compare.compute(pairs, df)
+    else:
+        features = compare.compute(pairs, df, df_b)
+
+    return _score(features, match_threshold=match_threshold)
+
+
+def _stream_block_and_match(df, block_variable, comparison_dict, pair_file,
+                            window_size=WINDOW_SIZE,
+                            match_threshold=MATCH_THRESHOLD,
+                            string_method="jarowinkler",
+                            string_threshold=STRING_THRESHOLD,
+                            near_match_variable=None, indexer=None):
+    """
+    Out-of-core version of `block_and_match`: write the candidate pairs to
+    `pair_file`, compare them a window at a time and keep the matches.
+    """
+    if indexer is None:
+        write_block_pairs(df, block_variable, pair_file,
+                          chunk_size=window_size)
+    elif hasattr(indexer, 'band_pairs'):
+        with open(pair_file, 'wb') as f:
+            for band_pairs in indexer.band_pairs(df):
+                f.write(band_pairs[['position_a', 'position_b']].values.astype(
+                    np.int32).tobytes())
+    else:
+        write_pairs(indexer.index(df), df, pair_file)
+    if near_match_variable is not None:
+        write_pairs(near_match_index(df, near_match_variable), df, pair_file,
+                    append=True)
+    if indexer is not None or near_match_variable is not None:
+        # The pairs of different bands, and the near matches, can repeat
+        # pairs that were already written
+        dedupe_pair_file(pair_file, window_size=window_size)
+
+    compare = _make_compare(comparison_dict, string_method=string_method,
+                            string_threshold=string_threshold,
+                            columns=df.columns)
+    pairs = read_pairs(pair_file)
+    matches = []
+    for start in range(0, pairs.shape[0], window_size):
+        window = np.asarray(pairs[start:start + window_size])
+        window_pairs = pd.MultiIndex.from_arrays([df.index[window[:, 0]],
+                                                  df.index[window[:, 1]]])
+        features = _score(compare.compute(window_pairs, df),
+                          match_threshold=match_threshold)
+        matches.append(features[features["match"]])
+    del pairs
+
+    if len(matches) == 0:
+        features = _score(compare.compute(
+            pd.MultiIndex.from_arrays([df.index[:0], df.index[:0]]), df))
+        return features
+    return pd.concat(matches)
+
+
 def link_records(prelink_ids, link_list, match_threshold=MATCH_THRESHOLD,
-                 string_method="jarowinkler", string_threshold=STRING_THRESHOLD):
+                 string_method="jarowinkler", string_threshold=STRING_THRESHOLD,
+                 pair_dir=None, window_size=WINDOW_SIZE, report=None,
+                 profile=None):
     """
     Link records from a dataset, using an iterative approach
 
@@ -56,32 +753,837 @@ def link_records(prelink_ids, link_list, match_threshold=MATCH_THRESHOLD,
             {'block_variable': 'ssn_as_str',
               'match_variables':{"fname": "string",
                                   "lname": "string",
-                                  "dob":"date"}}]
+                                  "dob":"date"},
+              'near_match_variable': 'ssn_as_str'}]
+
+        Each dict may also have a 'near_match_variable' entry, naming a
+        string variable whose near matches (within one edit, e.g. SSN
+        typos) are compared in addition to the blocked pairs, and an
+        'indexer' entry (e.g. an `LSHIndex`) to use instead of blocking on
+        'block_variable', in which case 'block_variable' can be omitted.
+
+    string_method : string
+        The string comparison method: any method of
+        `recordlinkage.Compare.string`, or 'batch_jarowinkler' or
+        'batch_levenshtein' to use the batched kernels in
+        `puget.string_similarity`.
+
+    pair_dir : string, optional
+        If given, the candidate pairs of each pass are written to a file in
+        this directory and compared `window_size` pairs at a time, instead
+        of being held in memory (see `block_and_match`).
 
+    window_size : int
+        Number of pairs to compare at a time when `pair_dir` is given.
+
+    report : puget.metrics.RunReport, optional
+        Report in which to record the metrics of each pass (the matches as
+        output rows) and of finding the linked groups, and the progress
+        through the passes.
+
+    profile : string, optional
+        Directory in which to write a cProfile .pstats file of each pass
+        (e.g. 'pass_0.pstats') and of finding the linked groups, whose top
+        hotspots are also printed.
     """
-    matches = []
+    if report is None:
+        report = RunReport()
+    n_records = prelink_ids.shape[0]
+
+    with report.profiling(profile), \
+            report.stage('link_records', n_rows_in=n_records) as link_metrics:
+        matches = []
+        for i, link in enumerate(link_list):
+            if pair_dir is None:
+                pair_file = None
+            else:
+                pair_file = op.join(pair_dir, 'pairs_%d.bin' % i)
+            with report.stage('pass_%d' % i, n_rows_in=n_records) as metrics:
+                features = block_and_match(
+                    prelink_ids, link.get('block_variable', None),
+                    link['match_variables'], match_threshold=match_threshold,
+                    string_method=string_method,
+                    string_threshold=string_threshold,
+                    near_match_variable=link.get('near_match_variable',
+                                                 None),
+                    indexer=link.get('indexer', None), pair_file=pair_file,
+                    window_size=window_size)
+                matches.append(features[features["match"]])
+                metrics.n_rows_out = matches[-1].shape[0]
+                # Only the matches of a streamed pass are kept, so count
+                # its pairs from the pair file
+                if pair_file is None:
+                    metrics.counts['n_pairs'] = features.shape[0]
+                else:
+                    metrics.counts['n_pairs'] = read_pairs(
+                        pair_file).shape[0]
+            report.progress((i + 1) / len(link_list))
+
+        with report.stage('components') as metrics:
+            _link_components(prelink_ids, matches)
+            metrics.n_rows_out = n_records
+            metrics.counts['n_people'] = (prelink_ids["linkage_PID"].max()
+                                          if n_records else 0)
+        link_metrics.n_rows_out = n_records
+
+    return prelink_ids
+
+
+def _link_components(prelink_ids, matches):
+    """
+    Set the linkage_PID of the records to the linked groups of the matches.
+    """
+    # Encode the matched records as dense codes, in the order they first
+    # appear in the matches, and find the linked groups of records:
+    matched = [match.index for match in matches]
+    # Start from an empty array, for when there are no passes
+    empty = [np.array([], dtype=prelink_ids.index.dtype)]
+    ends = np.column_stack([np.concatenate(empty +
+                                           [m.get_level_values(0)
+                                            for m in matched]),
+                            np.concatenate(empty +
+                                           [m.get_level_values(1)
+                                            for m in matched])])
+    codes, records = encode_ids(ends.ravel())
+    codes = codes.reshape(-1, 2)
+    graph = csr_matrix((np.ones(codes.shape[0]), (codes[:, 0], codes[:, 1])),
+                       shape=(len(records), len(records)))
+    _, components = connected_components(graph, directed=False)
+    # Number the groups in order of their first record in the matches:
+    _, first = np.unique(components, return_index=True)
+    number = np.empty(len(first), dtype=int)
+    number[np.argsort(first)] = np.arange(1, len(first) + 1)
+
+    pids = np.zeros(prelink_ids.shape[0], dtype=int)
+    pids[prelink_ids.index.get_indexer(records)] = number[components]
+    # Records that aren't linked to any other are people of their own:
+    unlinked = pids == 0
+    pids[unlinked] = np.arange(len(first) + 1,
+                               len(first) + 1 + unlinked.sum())
+    prelink_ids["linkage_PID"] = pids
+
+
+def pairwise_precision_recall(pids, true_pids):
+    """
+    Precision and recall of linked PIDs over pairs of records.
+
+    A pair of records is linked if they have the same PID, and truly linked
+    if they have the same true PID (e.g. the ground truth of a
+    `puget.synth` extract).
+
+    Parameters
+    ----------
+    pids : array-like
+        The linked PID of each record, e.g. the linkage_PID column from
+        `link_records`.
+
+    true_pids : array-like
+        The true PID of each record.
+
+    Returns
+    -------
+    precision : float
+        Fraction of linked pairs that are truly linked (1 if no pairs are
+        linked).
+
+    recall : float
+        Fraction of truly linked pairs that are linked (1 if no pairs are
+        truly linked).
+    """
+    df = pd.DataFrame({'pid': np.asarray(pids),
+                       'true_pid': np.asarray(true_pids)})
+
+    def n_pairs(groups):
+        sizes = df.groupby(groups).size().values.astype(np.int64)
+        return (sizes * (sizes - 1) // 2).sum()
+
+    n_both = n_pairs(['pid', 'true_pid'])
+    n_linked = n_pairs('pid')
+    n_true = n_pairs('true_pid')
+    precision = n_both / n_linked if n_linked else 1.0
+    recall = n_both / n_true if n_true else 1.0
+    return precision, recall
+
+
+def link_sources(df_a, df_b, link_list, match_threshold=MATCH_THRESHOLD,
+                 string_method="jarowinkler",
+                 string_threshold=STRING_THRESHOLD):
+    """
+    Link records across two data sources (e.g. HMIS and PHA).
+
+    Unlike `link_records` on the two sources concatenated, only pairs with
+    one record from each source are compared. Records from the same source
+    only get the same PID if they are linked through records of the other
+    source.
+
+    Parameters
+    ----------
+    df_a, df_b : DataFrame
+        The prelinked data of the two sources, with the same linkage
+        variables.
+
+    link_list : list of dicts
+        The linkage passes, as in `link_records`.
+
+    match_threshold, string_method, string_threshold :
+        As in `link_records`.
+
+    Returns
+    -------
+    linked_a, linked_b : DataFrame
+        Copies of `df_a` and `df_b` with a 'linkage_PID' column that is
+        shared between linked records of the two sources.
+    """
+    G = networkx.Graph()
+    G.add_nodes_from(('a', i) for i in range(df_a.shape[0]))
+    G.add_nodes_from(('b', i) for i in range(df_b.shape[0]))
     for link in link_list:
-        features = block_and_match(prelink_ids,
-                                   link['block_variable'],
+        features = block_and_match(df_a,
+                                   link.get('block_variable', None),
                                    link['match_variables'],
                                    match_threshold=match_threshold,
                                    string_method=string_method,
-                                   string_threshold=string_threshold)
-        matches.append(features[features["match"]])
+                                   string_threshold=string_threshold,
+                                   near_match_variable=link.get(
+                                       'near_match_variable', None),
+                                   indexer=link.get('indexer', None),
+                                   df_b=df_b)
+        match = features[features["match"]].index
+        positions_a = df_a.index.get_indexer(match.get_level_values(0))
+        positions_b = df_b.index.get_indexer(match.get_level_values(1))
+        G.add_edges_from(zip([('a', i) for i in positions_a],
+                             [('b', i) for i in positions_b]))
 
-    G = networkx.Graph()
-    for match in matches:
-        for ix, row in match.iterrows():
-            G.add_edge(row.name[0], row.name[1])
+    pids = {'a': np.zeros(df_a.shape[0], dtype=int),
+            'b': np.zeros(df_b.shape[0], dtype=int)}
+    # Number people in order of their first record, df_a before df_b:
+    components = sorted(networkx.connected_components(G), key=min)
+    for new_pid, component in enumerate(components, 1):
+        for source, i in component:
+            pids[source][i] = new_pid
+
+    linked_a = df_a.copy()
+    linked_a["linkage_PID"] = pids['a']
+    linked_b = df_b.copy()
+    linked_b["linkage_PID"] = pids['b']
+    return linked_a, linked_b
+
+
+class FeatureCache(object):
+    """
+    Continuous comparison scores of all candidate pairs of a linkage run.
+
+    The expensive part of `link_records` (blocking and string comparison) is
+    done once, without thresholding the string and Bloom-filter similarities
+    (which `link_records` thresholds alike), so that many combinations of
+    `match_threshold` and `string_threshold` can then be evaluated with
+    `sweep`.
+
+    Parameters
+    ----------
+    prelink_ids : DataFrame
+        A Pandas DataFrame with prelinked data.
+
+    link_list : list of dicts
+        The linkage passes, as in `link_records`.
+
+    string_method : string
+        As in `link_records`.
+    """
+    def __init__(self, prelink_ids, link_list, string_method="jarowinkler"):
+        self.n_records = prelink_ids.shape[0]
+        self.features = []
+        self.string_columns = []
+        for link in link_list:
+            features = block_and_match(prelink_ids,
+                                       link.get('block_variable', None),
+                                       link['match_variables'],
+                                       string_method=string_method,
+                                       string_threshold=None,
+                                       near_match_variable=link.get(
+                                           'near_match_variable', None),
+                                       indexer=link.get('indexer', None))
+            features = features.drop(["mean", "match"], axis=1)
+            # Keep record positions rather than labels:
+            features.index = pd.MultiIndex.from_arrays(
+                [prelink_ids.index.get_indexer(
+                    features.index.get_level_values(i)) for i in range(2)])
+            self.features.append(features)
+            self.string_columns.append(
+                [k for k, v in link['match_variables'].items()
+                 if v in ("string", "bloom")])
+
+    def _means(self, string_threshold):
+        """Mean score of each pair in each pass, at one string threshold."""
+        means = []
+        for features, string_columns in zip(self.features,
+                                            self.string_columns):
+            scores = features.copy()
+            for col in string_columns:
+                scores[col] = np.where(scores[col].isnull(), np.nan,
+                                       scores[col] >= string_threshold)
+            means.append(scores.mean(axis=1, skipna=True).values)
+        return means
+
+    def sweep(self, match_thresholds=(MATCH_THRESHOLD,),
+              string_thresholds=(STRING_THRESHOLD,)):
+        """
+        Count links and clusters for combinations of thresholds.
+
+        Parameters
+        ----------
+        match_thresholds : sequence of floats
+            Values of `match_threshold` to evaluate.
+
+        string_thresholds : sequence of floats
+            Values of `string_threshold` to evaluate.
+
+        Returns
+        -------
+        DataFrame with one row per combination of thresholds and columns
+        'match_threshold', 'string_threshold', 'n_links' (the number of
+        distinct linked pairs) and 'n_clusters' (the number of PIDs
+        `link_records` would assign).
+        """
+        rows = []
+        for string_threshold in string_thresholds:
+            means = self._means(string_threshold)
+            for match_threshold in match_thresholds:
+                first = []
+                second = []
+                for features, mean in zip(self.features, means):
+                    match = mean > match_threshold
+                    first.append(features.index.get_level_values(0)[match])
+                    second.append(features.index.get_level_values(1)[match])
+                links = pd.DataFrame({'first': np.concatenate(first),
+                                      'second': np.concatenate(second)})
+                links = links.drop_duplicates()
+                graph = csr_matrix((np.ones(links.shape[0]),
+                                    (links['first'].values,
+                                     links['second'].values)),
+                                   shape=(self.n_records, self.n_records))
+                n_clusters, _ = connected_components(graph, directed=False)
+                rows.append({'match_threshold': match_threshold,
+                             'string_threshold': string_threshold,
+                             'n_links': links.shape[0],
+                             'n_clusters': n_clusters})
+        return pd.DataFrame(rows, columns=['match_threshold',
+                                           'string_threshold', 'n_links',
+                                           'n_clusters'])
+
+    def save(self, fname):
+        """Save the cached features to a file."""
+        with open(fname, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fname):
+        """Load features saved with `save`."""
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+
+
+# Number of appended segments an index keeps before merging them into one:
+MAX_SEGMENTS = 8
+
+
+def _grouped_segment(values, positions):
+    """
+    Group record positions by their (non-missing) values.
+
+    Returns
+    -------
+    keys : Index
+        The distinct values.
+
+    positions : ndarray
+        The positions, grouped by value in the order of keys.
+
+    offsets : ndarray
+        Start of each value's run of positions, and the end of the last.
+    """
+    codes, uniques = pd.factorize(values)
+    order = np.argsort(codes, kind='mergesort')
+    counts = np.bincount(codes, minlength=len(uniques))
+    return (pd.Index(uniques), np.asarray(positions)[order],
+            np.concatenate([[0], np.cumsum(counts)]))
+
+
+class _KeyIndex(object):
+    """
+    Exact-match index from the values of a blocking variable to the positions
+    of the records that have them.
+
+    Positions are stored grouped by value, so that looking up a batch of
+    values doesn't need a pass over all the indexed records. Records that
+    are appended go into a new segment, and the segments are merged once
+    there are more than `MAX_SEGMENTS`, so appending a batch doesn't rebuild
+    the whole index.
+
+    Parameters
+    ----------
+    values : Series
+        The values of the records.
+
+    positions : ndarray, optional
+        The positions of the records. Default: 0, 1, 2...
+    """
+    def __init__(self, values, positions=None):
+        self.segments = []
+        self.n_records = 0
+        self.append(values, positions=positions)
+
+    def append(self, values, positions=None):
+        """
+        Add records to the index.
+
+        Parameters
+        ----------
+        values : Series
+            The values of the records.
+
+        positions : ndarray, optional
+            The positions of the records. Default: the positions after the
+            indexed records.
+        """
+        values = pd.Series(values)
+        if positions is None:
+            positions = self.n_records + np.arange(len(values))
+        self.n_records = max(self.n_records,
+                             int(np.max(positions, initial=-1)) + 1)
+        valid = values.notnull().values
+        if valid.any():
+            self.segments.append(_grouped_segment(
+                values[valid].values, np.asarray(positions)[valid]))
+        if len(self.segments) > MAX_SEGMENTS:
+            self._merge_segments()
+
+    def _merge_segments(self):
+        values = np.concatenate([np.repeat(keys.values, np.diff(offsets))
+                                 for keys, _, offsets in self.segments])
+        positions = np.concatenate([positions for _, positions, _
+                                    in self.segments])
+        self.segments = [_grouped_segment(values, positions)]
+
+    def lookup(self, values):
+        """
+        Find the indexed records with each of `values`.
+
+        Returns
+        -------
+        query_positions, positions : ndarray
+            Positions in `values` and the positions of the indexed records
+            with the same value.
+        """
+        query_positions = [np.array([], dtype=np.int64)]
+        found = [np.array([], dtype=np.int64)]
+        for keys, positions, offsets in self.segments:
+            codes = keys.get_indexer(values)
+            these = np.where(codes >= 0)[0]
+            starts = offsets[codes[these]]
+            counts = offsets[codes[these] + 1] - starts
+            # Offsets into each record's run of matching positions:
+            within = (np.arange(counts.sum()) -
+                      np.repeat(np.cumsum(counts) - counts, counts))
+            query_positions.append(np.repeat(these, counts))
+            found.append(positions[np.repeat(starts, counts) + within])
+        return np.concatenate(query_positions), np.concatenate(found)
+
+
+class _NearMatchIndex(object):
+    """
+    Index of the values of a string variable for finding the records within
+    one edit of new values (see `near_match_index`), without rebuilding the
+    deletion neighbourhood of the indexed values for each lookup.
+
+    Parameters
+    ----------
+    values : Series
+        The values of the records, at positions 0, 1, 2...
+    """
+    def __init__(self, values):
+        self.values = pd.Index([], dtype=object)
+        # Deletion keys to the codes of the distinct values, and distinct
+        # values to the positions of their records:
+        self.key_index = _KeyIndex(pd.Series([], dtype=object))
+        self.record_index = _KeyIndex(pd.Series([], dtype=object))
+        self.append(values)
+
+    def append(self, values):
+        """Add records, at the positions after the indexed records."""
+        values = pd.Series(values).astype(object)
+        self.record_index.append(values)
+        distinct = pd.Index(values.dropna().unique())
+        new_values = distinct[self.values.get_indexer(distinct) < 0]
+        if len(new_values):
+            keys = _deletion_neighbourhood(pd.Series(
+                new_values.values, index=len(self.values) +
+                np.arange(len(new_values))))
+            self.key_index.append(keys['key'], positions=keys['code'].values)
+            self.values = self.values.append(new_values)
+
+    def lookup(self, values):
+        """
+        Find the indexed records within one edit of each of `values`.
+
+        Returns
+        -------
+        query_positions, positions : ndarray
+            Positions in `values` and the positions of the indexed records
+            within one edit.
+        """
+        values = pd.Series(values).astype(object)
+        valid = values.notnull().values
+        codes, uniques = pd.factorize(values[valid])
+        if len(uniques) == 0:
+            return (np.array([], dtype=np.int64),
+                    np.array([], dtype=np.int64))
+        uniques = pd.Series(uniques, dtype=object)
+        keys = _deletion_neighbourhood(uniques)
+        key_rows, value_codes = self.key_index.lookup(keys['key'].values)
+        value_pairs = pd.DataFrame({'code': keys['code'].values[key_rows],
+                                    'value_code': value_codes})
+        value_pairs = value_pairs.drop_duplicates()
+        is_near = [_within_one_edit(uniques[a], self.values[b]) for a, b in
+                   zip(value_pairs['code'], value_pairs['value_code'])]
+        value_pairs = value_pairs[np.array(is_near, dtype=bool)]
+
+        # Expand value pairs to record pairs:
+        pair_rows, positions = self.record_index.lookup(
+            self.values[value_pairs['value_code'].values])
+        indexed = pd.DataFrame({'code': value_pairs['code'].values[pair_rows],
+                                'position': positions})
+        queries = pd.DataFrame({'code': codes,
+                                'query_position': np.where(valid)[0]})
+        pairs = queries.merge(indexed, on='code')
+        return (pairs['query_position'].values.astype(np.int64),
+                pairs['position'].values.astype(np.int64))
+
+
+class _LSHPopulationIndex(object):
+    """
+    The band keys of an `LSHIndex`'s signatures of indexed records, for
+    finding the indexed records that share a band with new records without
+    signing the indexed records again for each lookup.
+
+    Parameters
+    ----------
+    indexer : LSHIndex
+        The indexer whose signatures and bands are used.
+
+    df : DataFrame
+        The records, at positions 0, 1, 2...
+    """
+    def __init__(self, indexer, df):
+        self.indexer = indexer
+        self.band_indexes = [_KeyIndex(pd.Series([], dtype=np.uint64))
+                             for _ in range(indexer.bands)]
+        self.n_records = 0
+        self.append(df)
+
+    def _band_keys(self, df):
+        """Positions of the records with signatures, and their band keys."""
+        positions = []
+        keys = [[] for _ in range(self.indexer.bands)]
+        for chunk_start in range(0, df.shape[0], self.indexer.chunk_size):
+            chunk = df.iloc[chunk_start:chunk_start + self.indexer.chunk_size]
+            these_positions, signatures = self.indexer.signatures(chunk)
+            positions.append(these_positions + chunk_start)
+            for band in range(self.indexer.bands):
+                keys[band].append(self.indexer._band_keys(signatures, band))
+        if len(positions) == 0:
+            return (np.array([], dtype=np.int64),
+                    [np.array([], dtype=np.uint64)] * self.indexer.bands)
+        return (np.concatenate(positions),
+                [np.concatenate(band_keys) for band_keys in keys])
+
+    def append(self, df):
+        """Add records, at the positions after the indexed records."""
+        positions, keys = self._band_keys(df[self.indexer.on])
+        for band_index, band_keys in zip(self.band_indexes, keys):
+            band_index.append(pd.Series(band_keys),
+                              positions=positions + self.n_records)
+        self.n_records += df.shape[0]
+
+    def lookup(self, df):
+        """
+        Find the indexed records that share a band with the records of
+        `df`. Buckets with more than the indexer's max_bucket_size records
+        (indexed and new) are skipped.
+
+        Returns
+        -------
+        query_positions, positions : ndarray
+            Positions in `df` and of the indexed records, without repeats.
+        """
+        positions, keys = self._band_keys(df[self.indexer.on])
+        pairs = []
+        for band_index, band_keys in zip(self.band_indexes, keys):
+            query_rows, found = band_index.lookup(band_keys)
+            band_pairs = pd.DataFrame({'key': band_keys[query_rows],
+                                       'query_position':
+                                       positions[query_rows],
+                                       'position': found})
+            max_bucket_size = self.indexer.max_bucket_size
+            if max_bucket_size is not None:
+                n_indexed = band_pairs.groupby(
+                    ['key', 'query_position'])['position'].transform('size')
+                n_new = pd.Series(band_keys).value_counts()
+                sizes = (n_indexed.values +
+                         n_new.loc[band_pairs['key'].values].values)
+                band_pairs = band_pairs[sizes <= max_bucket_size]
+            pairs.append(band_pairs[['query_position', 'position']])
+        if len(pairs) == 0:
+            return (np.array([], dtype=np.int64),
+                    np.array([], dtype=np.int64))
+        pairs = pd.concat(pairs, ignore_index=True).drop_duplicates()
+        return (pairs['query_position'].values.astype(np.int64),
+                pairs['position'].values.astype(np.int64))
+
+
+class LinkageState(object):
+    """
+    A linked population that batches of new records can be linked against.
+
+    The state holds the linked records with their 'linkage_PID', the
+    `link_list` and thresholds they were linked with, and indexes of the
+    population's blocking, near-match and LSH keys, so that new records are
+    only compared to each other and to the existing records they block with.
+    The indexes are built once, updated with each linked batch, and saved
+    with the state.
+    Existing PIDs are kept, except when a new record links two existing
+    people, in which case the larger PID is merged into the smaller one.
+
+    Parameters
+    ----------
+    population : DataFrame
+        Linked records, e.g. the output of `link_records`, with a
+        'linkage_PID' column.
+
+    link_list : list of dicts
+        The linkage passes, as in `link_records`.
+
+    match_threshold, string_method, string_threshold :
+        As in `link_records`.
+    """
+    def __init__(self, population, link_list, match_threshold=MATCH_THRESHOLD,
+                 string_method="jarowinkler",
+                 string_threshold=STRING_THRESHOLD):
+        if "linkage_PID" not in population.columns:
+            raise ValueError('population must have a linkage_PID column')
+        self.population = population.reset_index(drop=True)
+        self.link_list = link_list
+        self.match_threshold = match_threshold
+        self.string_method = string_method
+        self.string_threshold = string_threshold
+        self._build_indexes()
+
+    def _build_indexes(self):
+        """
+        Index the population's blocking variables, near match variables and
+        LSH band keys, for finding the existing records that new records are
+        compared to.
+        """
+        self.block_indexes = {}
+        self.near_match_indexes = {}
+        self.lsh_indexes = {}
+        for i, link in enumerate(self.link_list):
+            indexer = link.get('indexer', None)
+            block_variable = link.get('block_variable', None)
+            near_match_variable = link.get('near_match_variable', None)
+            if isinstance(indexer, LSHIndex):
+                self.lsh_indexes[i] = _LSHPopulationIndex(indexer,
+                                                          self.population)
+            elif indexer is None and \
+                    block_variable not in self.block_indexes:
+                self.block_indexes[block_variable] = _KeyIndex(
+                    self.population[block_variable])
+            if near_match_variable is not None and \
+                    near_match_variable not in self.near_match_indexes:
+                self.near_match_indexes[near_match_variable] = \
+                    _NearMatchIndex(self.population[near_match_variable])
+
+    def _append_indexes(self, new):
+        """Add new records, appended to the population, to the indexes."""
+        for block_variable, index in self.block_indexes.items():
+            index.append(new[block_variable])
+        for near_match_variable, index in self.near_match_indexes.items():
+            index.append(new[near_match_variable])
+        for index in self.lsh_indexes.values():
+            index.append(new)
+
+    @property
+    def next_pid(self):
+        """The PID that the next new person will get."""
+        if self.population.shape[0] == 0:
+            return 1
+        return int(self.population["linkage_PID"].max()) + 1
+
+    def _existing_pairs(self, i, new):
+        """Candidate pairs between new records and the population."""
+        link = self.link_list[i]
+        if i in self.lsh_indexes:
+            new_positions, positions = self.lsh_indexes[i].lookup(new)
+        elif link.get('indexer', None) is not None:
+            # Other indexers index the whole population again
+            pairs = link['indexer'].index(new, self.population)
+            new_positions = new.index.get_indexer(pairs.get_level_values(0))
+            positions = self.population.index.get_indexer(
+                pairs.get_level_values(1))
+        else:
+            index = self.block_indexes[link['block_variable']]
+            new_positions, positions = index.lookup(
+                new[link['block_variable']])
+        near_match_variable = link.get('near_match_variable', None)
+        if near_match_variable is not None:
+            index = self.near_match_indexes[near_match_variable]
+            near_new, near = index.lookup(new[near_match_variable])
+            new_positions = np.concatenate([new_positions, near_new])
+            positions = np.concatenate([positions, near])
+        pairs = pd.DataFrame({'new': new_positions, 'existing': positions})
+        pairs = pairs.drop_duplicates().sort_values(['new', 'existing'])
+        return pd.MultiIndex.from_arrays(
+            [new.index[pairs['new'].values],
+             self.population.index[pairs['existing'].values]])
+
+    def candidates(self, new_ids):
+        """
+        Find the existing people that new records could belong to, without
+        changing the population.
+
+        Parameters
+        ----------
+        new_ids : DataFrame
+            New prelinked records, with the same columns as the population.
+
+        Returns
+        -------
+        DataFrame with one row per new record and candidate PID, with columns
+        'record' (position of the record in `new_ids`), 'linkage_PID',
+        'score' (the best mean comparison score over the linkage passes) and
+        'match' (whether the score is above the match threshold), sorted by
+        record and decreasing score.
+        """
+        new = new_ids.reset_index(drop=True)
+        pids = self.population["linkage_PID"].values
+        scores = []
+        for i, link in enumerate(self.link_list):
+            compare = _make_compare(link['match_variables'],
+                                    string_method=self.string_method,
+                                    string_threshold=self.string_threshold,
+                                    columns=new.columns)
+            features = _score(compare.compute(self._existing_pairs(i, new),
+                                              new, self.population),
+                              match_threshold=self.match_threshold)
+            scores.append(pd.DataFrame(
+                {'record': features.index.get_level_values(0),
+                 'linkage_PID': pids[features.index.get_level_values(1)],
+                 'score': features["mean"].values}))
+        scores = pd.concat(scores, ignore_index=True)
+        scores = scores.groupby(['record', 'linkage_PID'], as_index=False)[
+            'score'].max()
+        scores['match'] = scores['score'] > self.match_threshold
+        scores = scores.sort_values(['record', 'score'],
+                                    ascending=[True, False])
+        return scores.reset_index(drop=True)
+
+    def link(self, new_ids):
+        """
+        Link a batch of new records and add them to the population.
+
+        Parameters
+        ----------
+        new_ids : DataFrame
+            New prelinked records, with the same columns as the population.
+
+        Returns
+        -------
+        linked : DataFrame
+            A copy of `new_ids` with a 'linkage_PID' column.
+
+        merges : DataFrame
+            One row per existing PID that was merged into another, with
+            columns 'old_linkage_PID' and 'linkage_PID'.
+        """
+        new = new_ids.reset_index(drop=True)
+
+        G = networkx.Graph()
+        G.add_nodes_from(('new', i) for i in range(new.shape[0]))
+        pids = self.population["linkage_PID"].values
+        for i, link in enumerate(self.link_list):
+            # New records against each other:
+            features = block_and_match(new,
+                                       link.get('block_variable', None),
+                                       link['match_variables'],
+                                       match_threshold=self.match_threshold,
+                                       string_method=self.string_method,
+                                       string_threshold=self.string_threshold,
+                                       near_match_variable=link.get(
+                                           'near_match_variable', None),
+                                       indexer=link.get('indexer', None))
+            for a, b in features[features["match"]].index:
+                G.add_edge(('new', a), ('new', b))
+
+            # New records against the existing population:
+            compare = _make_compare(link['match_variables'],
+                                    string_method=self.string_method,
+                                    string_threshold=self.string_threshold,
+                                    columns=new.columns)
+            features = _score(compare.compute(self._existing_pairs(i, new),
+                                              new, self.population),
+                              match_threshold=self.match_threshold)
+            for a, b in features[features["match"]].index:
+                G.add_edge(('new', a), ('pid', pids[b]))
+
+        new_pids = np.zeros(new.shape[0], dtype=int)
+        merged = {}
+        next_pid = self.next_pid
+        components = sorted(networkx.connected_components(G),
+                            key=lambda c: min(n[1] for n in c
+                                              if n[0] == 'new'))
+        for component in components:
+            existing = sorted(n[1] for n in component if n[0] == 'pid')
+            if len(existing):
+                pid = existing[0]
+                for old_pid in existing[1:]:
+                    merged[old_pid] = pid
+            else:
+                pid = next_pid
+                next_pid = next_pid + 1
+            for n in component:
+                if n[0] == 'new':
+                    new_pids[n[1]] = pid
+
+        merges = pd.DataFrame({'old_linkage_PID': list(merged.keys()),
+                               'linkage_PID': list(merged.values())},
+                              columns=['old_linkage_PID', 'linkage_PID'])
+        if len(merged):
+            self.population["linkage_PID"] = \
+                self.population["linkage_PID"].replace(merged)
+
+        linked = new_ids.copy()
+        linked["linkage_PID"] = new_pids
+        self.population = pd.concat([self.population, linked],
+                                    ignore_index=True)
+        self._append_indexes(linked)
+
+        return linked, merges
 
-    prelink_ids["linkage_PID"] = np.nan
-    new_pid = 1
-    for linked in networkx.connected.connected_components(G):
-        prelink_ids.loc[linked, "linkage_PID"] = new_pid
-        new_pid = new_pid + 1
+    def save(self, fname):
+        """
+        Save the state to a file.
 
-    ix = prelink_ids["linkage_PID"].isnull()
-    prelink_ids.loc[ix, "linkage_PID"] = np.arange(new_pid, new_pid + ix.sum())
-    prelink_ids["linkage_PID"] = prelink_ids["linkage_PID"].astype(int)
+        The state is written to a temporary file next to `fname`, which then
+        replaces it, so that readers (e.g. a `puget.lookup.LinkageLookup`)
+        never see a partly written state.
+        """
+        temp_file = fname + '.tmp'
+        with open(temp_file, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, fname)
 
-    return prelink_ids
\ No newline at end of file
+    @classmethod
+    def load(cls, fname):
+        """Load a state saved with `save`."""
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
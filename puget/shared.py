@@ -0,0 +1,235 @@
+"""
+Publish a DataFrame in shared memory, for analysis in several processes.
+
+Instead of each worker process loading its own copy of the output of
+`puget.preprocess.merge_tables` (or `puget.cluster.cluster`), the frame is
+published once with `publish`, which copies its columns into one
+`multiprocessing.shared_memory` block and returns a small, JSON serializable
+descriptor of the layout. Workers `attach` with the descriptor and get a
+read-only DataFrame whose columns are views of the shared block, without
+copying::
+
+    shared = publish(df)
+    # in a worker, given shared.descriptor:
+    view = attach(descriptor)
+    view.frame.groupby('HouseholdID').size()
+    view.close()
+    # when all the workers are done:
+    shared.close()
+
+Numeric, boolean and datetime columns, and nullable (masked) integer and
+boolean columns, are shared as they are. Categorical columns share their
+codes. String (object) columns are shared as categoricals, so only the
+distinct strings are copied into each worker.
+"""
+import multiprocessing
+import os
+import pickle
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import pandas as pd
+
+# Alignment of the column buffers in the shared block, in bytes:
+ALIGNMENT = 64
+
+
+def _aligned(offset):
+    """Round an offset up to the alignment."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _column_buffers(values):
+    """
+    Split a column into the arrays to share.
+
+    Returns
+    -------
+    kind : string
+        How to rebuild the column: 'numpy', 'datetime', 'masked' or
+        'categorical'.
+
+    arrays : dict
+        The numpy arrays to put in shared memory, by name.
+
+    extra : dict
+        JSON serializable information to rebuild the column.
+
+    categories : list or None
+        The categories of categorical columns (and the strings of string
+        columns), which are pickled rather than shared.
+    """
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return ('categorical', {'codes': values.cat.codes.values},
+                {'ordered': bool(dtype.ordered)}, list(dtype.categories))
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        array = values.array
+        if isinstance(array, (pd.arrays.IntegerArray, pd.arrays.BooleanArray,
+                              pd.arrays.FloatingArray)):
+            return ('masked', {'data': array._data, 'mask': array._mask},
+                    {'dtype': str(dtype)}, None)
+        raise TypeError("Can't share column of dtype %s" % dtype)
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return ('datetime', {'data': values.values.view(np.int64)},
+                {'dtype': str(dtype)}, None)
+    if dtype == object:
+        codes, uniques = pd.factorize(values)
+        # Share the codes with the dtype the attached categorical will have
+        codes = pd.Categorical.from_codes(codes, categories=uniques).codes
+        return ('categorical', {'codes': codes}, {'ordered': False},
+                list(uniques))
+    return 'numpy', {'data': values.values}, {}, None
+
+
+class SharedFrame(object):
+    """
+    A DataFrame published in shared memory, owned by the publishing
+    process. Made by `publish`.
+
+    Attributes
+    ----------
+    descriptor : dict
+        JSON serializable layout of the frame, to pass to `attach`.
+    """
+    def __init__(self, shm, descriptor):
+        self.shm = shm
+        self.descriptor = descriptor
+
+    def close(self):
+        """Free the shared memory (once no process needs it any more)."""
+        self.shm.close()
+        self.shm.unlink()
+
+
+def publish(df, name=None):
+    """
+    Copy a DataFrame into shared memory.
+
+    Parameters
+    ----------
+    df : dataframe
+        The frame to publish, e.g. from merge_tables. Its index is not
+        published; attached frames have a RangeIndex.
+
+    name : string
+        Name of the shared memory block. Default is None (a unique name).
+
+    Returns
+    ----------
+    SharedFrame, whose descriptor is passed to `attach` in the workers and
+    which must be closed to free the memory
+    """
+    columns = []
+    layout = []
+    categories = {}
+    offset = 0
+    for i, column in enumerate(df.columns):
+        kind, arrays, extra, column_categories = _column_buffers(
+            df.iloc[:, i])
+        buffers = {}
+        for buffer_name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = _aligned(offset)
+            buffers[buffer_name] = {'offset': offset,
+                                    'dtype': array.dtype.str}
+            layout.append((offset, array))
+            offset += array.nbytes
+        if column_categories is not None:
+            categories[i] = column_categories
+        columns.append({'name': column, 'kind': kind, 'buffers': buffers,
+                        'extra': extra})
+
+    # The categories are pickled at the end of the block
+    pickled = pickle.dumps(categories, protocol=pickle.HIGHEST_PROTOCOL)
+    categories_offset = offset
+    size = max(categories_offset + len(pickled), 1)
+
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    for start, array in layout:
+        target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf,
+                            offset=start)
+        target[...] = array
+        del target
+    shm.buf[categories_offset:categories_offset + len(pickled)] = pickled
+
+    descriptor = {'name': shm.name, 'pid': os.getpid(),
+                  'n_rows': int(df.shape[0]),
+                  'columns': columns,
+                  'categories': [categories_offset, len(pickled)]}
+    return SharedFrame(shm, descriptor)
+
+
+class AttachedFrame(object):
+    """
+    A read-only view of a published DataFrame. Made by `attach`.
+
+    Attributes
+    ----------
+    frame : dataframe
+        The frame, whose columns are views of the shared memory. Writing to
+        them raises an error.
+    """
+    def __init__(self, shm, frame):
+        self.shm = shm
+        self.frame = frame
+
+    def close(self):
+        """Detach from the shared memory. The frame can't be used after."""
+        self.frame = None
+        self.shm.close()
+
+
+def attach(descriptor):
+    """
+    Attach to a DataFrame published with `publish`, without copying it.
+
+    Parameters
+    ----------
+    descriptor : dict
+        The SharedFrame's descriptor.
+
+    Returns
+    ----------
+    AttachedFrame, whose frame attribute is the read-only DataFrame
+    """
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    # Only the publishing process should free the block. Processes started
+    # by multiprocessing share the publisher's resource tracker, which
+    # frees the block if the publisher dies, but an unrelated process has
+    # its own tracker, which would free the block when that process exits.
+    if (os.getpid() != descriptor['pid'] and
+            multiprocessing.parent_process() is None):
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    n_rows = descriptor['n_rows']
+    start, length = descriptor['categories']
+    categories = pickle.loads(bytes(shm.buf[start:start + length]))
+
+    def view(buffer):
+        array = np.ndarray((n_rows,), dtype=np.dtype(buffer['dtype']),
+                           buffer=shm.buf, offset=buffer['offset'])
+        array.flags.writeable = False
+        return array
+
+    data = {}
+    for i, column in enumerate(descriptor['columns']):
+        buffers = column['buffers']
+        kind = column['kind']
+        if kind == 'numpy':
+            values = view(buffers['data'])
+        elif kind == 'datetime':
+            values = view(buffers['data']).view(column['extra']['dtype'])
+        elif kind == 'masked':
+            dtype = pd.api.types.pandas_dtype(column['extra']['dtype'])
+            values = dtype.construct_array_type()(view(buffers['data']),
+                                                  view(buffers['mask']),
+                                                  copy=False)
+        else:
+            dtype = pd.CategoricalDtype(categories[i],
+                                        ordered=column['extra']['ordered'])
+            values = pd.Categorical.from_codes(view(buffers['codes']),
+                                               dtype=dtype)
+        data[i] = values
+    frame = pd.DataFrame(data, copy=False)
+    frame.columns = [column['name'] for column in descriptor['columns']]
+    return AttachedFrame(shm, frame)
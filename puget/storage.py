@@ -0,0 +1,331 @@
+"""
+Columnar storage of the merged enrollments.
+
+`write_parquet` stores the output of `puget.preprocess.merge_tables` as a
+Parquet dataset partitioned by county and entry year, in directories such
+as::
+
+    root/county=king/entry_year=2014/part-0.parquet
+
+Dtypes are kept: timestamps stay timestamps, and string columns with few
+distinct values are stored as dictionary-encoded categoricals. `read_parquet`
+loads selected partitions and columns, reading only the files and columns it
+needs.
+
+`write_feather` and `read_feather` hand data to and from the R scripts as
+Feather (Arrow IPC) files with a stable schema, see `handoff_schema` and the
+R hand-off section of the documentation.
+
+This needs the optional dependency pyarrow.
+"""
+import os.path as op
+import shutil
+import urllib.parse
+import numpy as np
+import pandas as pd
+
+from puget.preprocess import METADATA_FILES, get_metadata_dict
+
+# Partition columns
+COUNTY_COLUMN = 'county'
+YEAR_COLUMN = 'entry_year'
+
+# Columns of the linked tables written by the R scripts:
+LINKED_ID_COLUMNS = ['pid0', 'pid1', 'pid2']
+LINKED_PID_COLUMN = 'linkage_PID'
+LINKED_DATE_COLUMNS = ['dob']
+
+# String columns with at most this fraction of distinct values are stored as
+# categoricals:
+CATEGORY_MAX_FRACTION = 0.5
+
+
+def _import_pyarrow():
+    """Import pyarrow and its dataset module, which are optional."""
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError("Parquet and Arrow storage need pyarrow, "
+                          "e.g. pip install pyarrow")
+    return pa, ds
+
+
+def _partitioning(ds, pa):
+    """The hive partitioning of the dataset, by county and entry year."""
+    return ds.partitioning(pa.schema([(COUNTY_COLUMN, pa.string()),
+                                      (YEAR_COLUMN, pa.int32())]),
+                           flavor='hive')
+
+
+def categorical_columns(df, max_fraction=CATEGORY_MAX_FRACTION):
+    """
+    Columns of a DataFrame to store as categoricals: the columns of strings
+    with at most max_fraction of distinct values (among their non-missing
+    values), and the columns that are categorical already.
+    """
+    columns = []
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns.append(column)
+        elif values.dtype == object:
+            values = values.dropna()
+            if (len(values) > 0 and
+                    values.map(type).eq(str).all() and
+                    values.nunique() <= max_fraction * len(values)):
+                columns.append(column)
+    return columns
+
+
+def write_parquet(df, root, county,
+                  metadata_file=METADATA_FILES['enrollment'],
+                  categorical=None):
+    """
+    Write merged enrollments to a Parquet dataset partitioned by county and
+    entry year.
+
+    The county's partitions are replaced if they are already in the
+    dataset; other counties' partitions are left as they are.
+
+    Parameters
+    ----------
+    df : dataframe
+        Merged enrollments, from merge_tables.
+
+    root : string
+        Directory of the dataset.
+
+    county : string
+        Name of the county of the enrollments.
+
+    metadata_file : string
+        Enrollment metadata file, which names the entry date column.
+
+    categorical : list
+        Columns to store as dictionary-encoded categoricals. Defaults to
+        categorical_columns(df).
+    """
+    pa, ds = _import_pyarrow()
+    entry_date_column = get_metadata_dict(metadata_file)['entry_date']
+    if categorical is None:
+        categorical = categorical_columns(df)
+
+    df = df.copy()
+    for column in categorical:
+        df[column] = df[column].astype('category')
+    df[COUNTY_COLUMN] = county
+    df[YEAR_COLUMN] = pd.to_datetime(df[entry_date_column]).dt.year.astype(
+        'Int32')
+
+    # Partition values are URI encoded in the directory names
+    county_dir = op.join(root, '%s=%s' % (COUNTY_COLUMN,
+                                          urllib.parse.quote(county,
+                                                             safe='')))
+    if op.isdir(county_dir):
+        shutil.rmtree(county_dir)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(table, root, format='parquet',
+                     partitioning=_partitioning(ds, pa),
+                     basename_template='part-{i}.parquet',
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def read_parquet(root, counties=None, entry_years=None, columns=None):
+    """
+    Read merged enrollments from a dataset written by write_parquet.
+
+    Parameters
+    ----------
+    root : string
+        Directory of the dataset.
+
+    counties : list
+        Counties to read. Default is None (all counties).
+
+    entry_years : list
+        Entry years to read. Default is None (all years, including
+        enrollments without an entry date).
+
+    columns : list
+        Columns to read, which may include the partition columns 'county'
+        and 'entry_year'. Default is None (all columns).
+
+    Returns
+    ----------
+    dataframe of the enrollments, grouped by partition, with the partition
+    columns 'county' and 'entry_year' (unless columns leaves them out)
+    """
+    pa, ds = _import_pyarrow()
+    dataset = ds.dataset(root, format='parquet',
+                         partitioning=_partitioning(ds, pa))
+    selection = None
+    if counties is not None:
+        selection = ds.field(COUNTY_COLUMN).isin(list(counties))
+    if entry_years is not None:
+        in_years = ds.field(YEAR_COLUMN).isin([int(year)
+                                               for year in entry_years])
+        selection = in_years if selection is None else selection & in_years
+    df = dataset.to_table(columns=columns, filter=selection).to_pandas()
+    if YEAR_COLUMN in df.columns:
+        df[YEAR_COLUMN] = df[YEAR_COLUMN].astype('Int32')
+    return df
+
+
+def handoff_schema(df):
+    """
+    Arrow schema of a DataFrame for the hand-off to R.
+
+    The Arrow type of each column only depends on its dtype, so the schema
+    is the same from run to run, and each type reads into R as a native
+    type:
+
+    =====================  =======================  ===========
+    dtype                  Arrow type               R type
+    =====================  =======================  ===========
+    datetime64             date32                   Date
+    integer (incl. Int64)  int32                    integer
+    float                  float64                  numeric
+    bool                   bool                     logical
+    category               dictionary<int32, utf8>  factor
+    object                 utf8                     character
+    =====================  =======================  ===========
+
+    R has no 64 bit integers, so integers must fit in 32 bits; times of day
+    are dropped from dates.
+    """
+    pa, ds = _import_pyarrow()
+    fields = []
+    for column in df.columns:
+        dtype = df[column].dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            arrow_type = pa.date32()
+        elif isinstance(dtype, pd.CategoricalDtype):
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        elif pd.api.types.is_bool_dtype(dtype):
+            arrow_type = pa.bool_()
+        elif pd.api.types.is_integer_dtype(dtype):
+            arrow_type = pa.int32()
+        elif pd.api.types.is_float_dtype(dtype):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(str(column), arrow_type))
+    return pa.schema(fields)
+
+
+def _handoff_table(df, schema=None):
+    """Convert a DataFrame to an Arrow table with the hand-off schema."""
+    pa, ds = _import_pyarrow()
+    if schema is None:
+        schema = handoff_schema(df)
+    if list(df.columns) != schema.names:
+        raise ValueError("Columns %s don't match the schema's columns %s" %
+                         (list(df.columns), schema.names))
+    arrays = []
+    for column, field in zip(df.columns, schema):
+        values = df[column]
+        if pa.types.is_date32(field.type):
+            values = pd.to_datetime(values).dt.date
+        elif pa.types.is_integer(field.type):
+            values = values.astype('Int64')
+            info = np.iinfo(np.int32)
+            if ((values < info.min) | (values > info.max)).any():
+                raise OverflowError("Column %s doesn't fit in 32 bits" %
+                                    column)
+        elif pa.types.is_dictionary(field.type):
+            values = values.astype(str).where(values.notnull(),
+                                              None).astype('category')
+        elif pa.types.is_string(field.type):
+            values = values.astype(str).where(values.notnull(), None)
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_feather(df, fname, schema=None):
+    """
+    Write a DataFrame to a Feather (Arrow IPC) file for the R scripts.
+
+    The file is uncompressed, so it can be memory-mapped in R with
+    arrow::read_feather(fname, mmap = TRUE) without parsing.
+
+    Parameters
+    ----------
+    df : dataframe
+        Data to write, e.g. the output of merge_tables.
+
+    fname : string
+        File to write, conventionally ending in '.feather'.
+
+    schema : pyarrow.Schema
+        Schema to write the data with, e.g. from an earlier run's file (see
+        read_schema). Its columns must match df's. Defaults to
+        handoff_schema(df).
+
+    Returns
+    ----------
+    the schema of the file
+    """
+    import pyarrow.feather as feather
+    table = _handoff_table(df, schema)
+    feather.write_feather(table, fname, compression='uncompressed')
+    return table.schema
+
+
+def read_schema(fname):
+    """Read the schema of a Feather file."""
+    pa, ds = _import_pyarrow()
+    return ds.dataset(fname, format='ipc').schema
+
+
+def read_feather(fname, columns=None):
+    """
+    Read a Feather (Arrow IPC) file, memory-mapped.
+
+    Parameters
+    ----------
+    fname : string
+        File to read, written by write_feather or by R's arrow::write_feather.
+
+    columns : list
+        Columns to read. Default is None (all columns).
+
+    Returns
+    ----------
+    dataframe, with dates as datetime64 and dictionaries as categoricals
+    """
+    import pyarrow.feather as feather
+    table = feather.read_table(fname, columns=columns, memory_map=True)
+    return table.to_pandas(date_as_object=False)
+
+
+def read_linked(fname):
+    """
+    Read the linked PHA and HMIS records written by the R scripts
+    (PHA_HMIS_linked), as a Feather file or a csv file.
+
+    Either way, the ID columns (pid0, pid1, pid2) are strings, linkage_PID
+    is an integer and dob is a date, as in the Feather hand-off schema.
+
+    Parameters
+    ----------
+    fname : string
+        File to read. Files ending in '.csv' are read as csv files, others
+        as Feather files.
+
+    Returns
+    ----------
+    dataframe of the linked records
+    """
+    if not fname.endswith('.csv'):
+        return read_feather(fname)
+
+    header = pd.read_csv(fname, nrows=0).columns
+    df = pd.read_csv(fname, dtype={column: str for column in header
+                                   if column in LINKED_ID_COLUMNS},
+                     parse_dates=[column for column in header
+                                  if column in LINKED_DATE_COLUMNS])
+    # Convert to the hand-off types, so the csv and Feather files read the
+    # same
+    table = _handoff_table(df)
+    return table.to_pandas(date_as_object=False)
@@ -0,0 +1,195 @@
+"""
+Batched string similarity kernels for record linkage.
+
+These compute the same similarities as the per-pair comparisons that
+`recordlinkage` makes with `jellyfish`, but for whole arrays of string pairs
+at once: the strings are converted to padded, fixed-width arrays of code
+points, and the comparisons are NumPy operations over all the pairs in a
+chunk, looping only over character positions.
+"""
+import numpy as np
+import pandas as pd
+
+# Number of pairs to compare at a time, which bounds the memory used:
+CHUNK_SIZE = 100000
+
+# Number of leading characters considered by the Winkler prefix bonus:
+WINKLER_PREFIX = 4
+
+
+def _code_points(strings):
+    """
+    Convert strings to a padded array of unicode code points.
+
+    Returns
+    -------
+    codes : ndarray
+        Array of shape (n, width), with width the length of the longest
+        string. Positions after the end of each string are 0.
+
+    lengths : ndarray
+        The length of each string.
+    """
+    fixed = np.asarray(strings, dtype=str)
+    width = fixed.dtype.itemsize // 4
+    codes = fixed.view(np.uint32).reshape(len(strings), width)
+    lengths = (codes != 0).sum(axis=1)
+    return codes, lengths
+
+
+def _pad(codes, width):
+    """Pad an array of code points with zeros to `width` columns."""
+    if codes.shape[1] == width:
+        return codes
+    padded = np.zeros((codes.shape[0], width), dtype=codes.dtype)
+    padded[:, :codes.shape[1]] = codes
+    return padded
+
+
+def _jaro_winkler_chunk(a, b, len1, len2):
+    """Jaro-Winkler similarity of a chunk of strings, as code points."""
+    n = a.shape[0]
+    width = max(a.shape[1], b.shape[1])
+    a = _pad(a, width)
+    b = _pad(b, width)
+    positions = np.arange(width)
+    rows = np.arange(n)
+
+    search_range = np.maximum(np.maximum(len1, len2) // 2 - 1, 0)
+    # Characters of s2 that are not yet matched:
+    available = positions[None, :] < len2[:, None]
+    flags_a = np.zeros((n, width), dtype=bool)
+
+    # For each character of s1, flag the first available equal character of
+    # s2 within the search range:
+    offsets = np.abs(positions[:, None] - positions[None, :])
+    for i in range(width):
+        candidates = (b == a[:, i:i + 1])
+        candidates &= available
+        candidates &= offsets[i][None, :] <= search_range[:, None]
+        j = candidates.argmax(axis=1)
+        found = candidates[rows, j]
+        found &= i < len1
+        flags_a[found, i] = True
+        available[rows[found], j[found]] = False
+
+    flags_b = (positions[None, :] < len2[:, None]) & ~available
+    common = flags_a.sum(axis=1)
+
+    # Transpositions: compare the flagged characters of each string in order,
+    # placing each at its rank among the flagged characters of its string.
+    matched_a = np.zeros((n, width), dtype=a.dtype)
+    matched_b = np.zeros((n, width), dtype=b.dtype)
+    rank_a = np.cumsum(flags_a, axis=1) - 1
+    rank_b = np.cumsum(flags_b, axis=1) - 1
+    row_a, col_a = np.nonzero(flags_a)
+    row_b, col_b = np.nonzero(flags_b)
+    matched_a[row_a, rank_a[row_a, col_a]] = a[row_a, col_a]
+    matched_b[row_b, rank_b[row_b, col_b]] = b[row_b, col_b]
+    transpositions = (matched_a != matched_b).sum(axis=1) // 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jaro = (common / len1 + common / len2 +
+                (common - transpositions) / common) / 3.
+    jaro = np.where(common > 0, jaro, 0.)
+
+    # Winkler bonus for a common prefix, for pairs that are already similar:
+    n_prefix = min(WINKLER_PREFIX, width)
+    same = ((a[:, :n_prefix] == b[:, :n_prefix]) &
+            (positions[None, :n_prefix] < np.minimum(len1, len2)[:, None]))
+    prefix = np.logical_and.accumulate(same, axis=1).sum(axis=1)
+    return np.where(jaro > 0.7, jaro + prefix * 0.1 * (1. - jaro), jaro)
+
+
+def _levenshtein_chunk(a, b, len1, len2):
+    """Levenshtein distance of a chunk of strings, as code points."""
+    n = a.shape[0]
+    columns = np.arange(b.shape[1] + 1)
+
+    # Rows of the edit-distance table, for all pairs at once:
+    previous = np.tile(columns, (n, 1))
+    distance = len2.copy()
+    for i in range(1, a.shape[1] + 1):
+        cost = (b != a[:, i - 1:i]).astype(previous.dtype)
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        current[:, 1:] = np.minimum(previous[:, 1:] + 1,
+                                    previous[:, :-1] + cost)
+        # Insertions: current[j] = min over k <= j of current[k] + (j - k),
+        # which is a running minimum of current - j.
+        current = np.minimum.accumulate(current - columns, axis=1) + columns
+        done = len1 == i
+        distance[done] = current[done, len2[done]]
+        previous = current
+    return distance
+
+
+def _batched(kernel, s1, s2, chunk_size):
+    """Apply a kernel to the pairs with both strings present, in chunks."""
+    s1 = pd.Series(np.asarray(s1, dtype=object))
+    s2 = pd.Series(np.asarray(s2, dtype=object))
+    valid = (s1.notnull() & s2.notnull()).values
+    s1 = s1[valid].astype(str).values
+    s2 = s2[valid].astype(str).values
+
+    result = np.full(valid.shape[0], np.nan)
+    out = np.empty(len(s1))
+    for start in range(0, len(s1), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        a, len1 = _code_points(s1[chunk])
+        b, len2 = _code_points(s2[chunk])
+        out[chunk] = kernel(a, b, len1, len2)
+    result[valid] = out
+    return result
+
+
+def jarowinkler_similarity(s1, s2, chunk_size=CHUNK_SIZE):
+    """
+    Jaro-Winkler similarity of pairs of strings.
+
+    Parameters
+    ----------
+    s1, s2 : array-like
+        The strings to compare, pairwise. Missing values are allowed.
+
+    chunk_size : int
+        Number of pairs to compare at a time.
+
+    Returns
+    -------
+    ndarray of similarities between 0 and 1, NaN where either string is
+    missing. Values match `jellyfish.jaro_winkler`.
+    """
+    return _batched(_jaro_winkler_chunk, s1, s2, chunk_size)
+
+
+def levenshtein_similarity(s1, s2, chunk_size=CHUNK_SIZE):
+    """
+    Levenshtein similarity of pairs of strings.
+
+    The similarity is 1 - d / max(len(s1), len(s2)), with d the Levenshtein
+    distance, as in `recordlinkage`. Two empty strings have similarity 1.
+
+    Parameters
+    ----------
+    s1, s2 : array-like
+        The strings to compare, pairwise. Missing values are allowed.
+
+    chunk_size : int
+        Number of pairs to compare at a time.
+
+    Returns
+    -------
+    ndarray of similarities between 0 and 1, NaN where either string is
+    missing.
+    """
+    def kernel(a, b, len1, len2):
+        longest = np.maximum(np.maximum(len1, len2), 1)
+        return 1. - _levenshtein_chunk(a, b, len1, len2) / longest
+
+    return _batched(kernel, s1, s2, chunk_size)
+
+
+# Batched methods that can be used as `string_method` in linkage:
+BATCH_STRING_METHODS = {'batch_jarowinkler': jarowinkler_similarity,
+                        'batch_levenshtein': levenshtein_similarity}
@@ -0,0 +1,699 @@
+"""
+Synthetic HMIS extracts, for testing and benchmarking at scale.
+
+`generate` writes the raw tables that `puget.preprocess.merge_tables` reads
+(the Client, Enrollment, Exit, Disabilities, EmploymentEducation,
+HealthAndDV, IncomeBenefits and Project csv files) for a county, in the
+folders of `COUNTY_FOLDERS`, with made up people instead of real personal
+information::
+
+    truth = generate(data_dir, county='king', n_people=1000000, seed=0)
+    df = merge_tables(county='king', data_dir=data_dir)
+
+The tables are consistent with each other and with the metadata files.
+People are made in households, whose members are enrolled together, with a
+shared HouseholdID, in one or more projects. Each enrollment has entry/exit
+table rows at entry and, if it has ended, at exit, and some have update and
+annual assessment rows too. Enrollments are written to the folder of their
+entry year, and each person's client rows to the folders of their
+enrollments.
+
+To exercise the cleaning and linkage steps:
+
+- some client rows are repeated with a conflicting DOB,
+- some people have a second PersonalID (as when they are entered again by
+  another agency), whose names and SSN may have typos or a nickname,
+- some categorical values are unknown (8, 9 or 99).
+
+The true person of each PersonalID is returned and written to
+GroundTruth.csv in data_dir, to evaluate record linkage against.
+
+People are made in chunks that are appended to the csv files, so memory use
+doesn't grow with the number of people.
+"""
+import json
+import os
+import os.path as op
+import re
+import numpy as np
+import pandas as pd
+
+from puget.data import DATA_PATH
+from puget.preprocess import COUNTY_FOLDERS, TABLE_FILES, get_metadata_dict
+import puget.utils as pu
+
+# Probability of each household size:
+HOUSEHOLD_SIZES = {1: 0.6, 2: 0.15, 3: 0.12, 4: 0.08, 5: 0.05}
+
+# Years of folders whose names don't have any:
+DEFAULT_YEARS = (2012, 2016)
+
+# File of the ground truth person of each PersonalID:
+TRUTH_FILE = 'GroundTruth.csv'
+
+# Columns the export system adds to every table, which are dropped:
+EXPORT_COLUMNS = ['DateCreated', 'DateUpdated', 'UserID', 'DateDeleted',
+                  'ExportID']
+
+# Columns of each table:
+COLUMNS = {
+    'client': ['PersonalID', 'FirstName', 'LastName', 'NameDataQuality',
+               'SSN', 'SSNDataQuality', 'DOB', 'DOBDataQuality',
+               'AmIndAKNative', 'Asian', 'BlackAfAmerican',
+               'NativeHIOtherPacific', 'White', 'RaceNone', 'Ethnicity',
+               'Gender', 'OtherGender', 'VeteranStatus', 'YearEnteredService',
+               'YearSeparated', 'WorldWarII', 'KoreanWar', 'VietnamWar',
+               'DesertStorm', 'AfghanistanOEF', 'IraqOIF', 'IraqOND',
+               'OtherTheater', 'MilitaryBranch', 'DischargeStatus'],
+    'enrollment': ['ProjectEntryID', 'PersonalID', 'ProjectID', 'EntryDate',
+                   'HouseholdID', 'RelationshipToHoH', 'ResidencePrior',
+                   'ResidencePriorLengthOfStay', 'DisablingCondition',
+                   'DateToStreetESSH'],
+    'exit': ['ExitID', 'ProjectEntryID', 'PersonalID', 'ExitDate',
+             'Destination', 'OtherDestination'],
+    'disabilities': ['DisabilitiesID', 'ProjectEntryID', 'PersonalID',
+                     'InformationDate', 'DisabilityType',
+                     'DisabilityResponse', 'IndefiniteAndImpairs',
+                     'DataCollectionStage'],
+    'employment_education': ['EmploymentEducationID', 'ProjectEntryID',
+                             'PersonalID', 'InformationDate',
+                             'LastGradeCompleted', 'SchoolStatus', 'Employed',
+                             'EmploymentType', 'NotEmployedReason',
+                             'DataCollectionStage'],
+    'health_dv': ['HealthAndDVID', 'ProjectEntryID', 'PersonalID',
+                  'InformationDate', 'DomesticViolenceVictim', 'WhenOccurred',
+                  'GeneralHealthStatus', 'DentalHealthStatus',
+                  'MentalHealthStatus', 'PregnancyStatus', 'DueDate',
+                  'DataCollectionStage'],
+    'income': ['IncomeBenefitsID', 'ProjectEntryID', 'PersonalID',
+               'InformationDate', 'IncomeFromAnySource', 'TotalMonthlyIncome',
+               'Earned', 'EarnedAmount', 'TANF', 'TANFAmount', 'GA',
+               'GAAmount', 'ChildSupport', 'ChildSupportAmount',
+               'BenefitsFromAnySource', 'SNAP', 'WIC', 'TANFChildCare',
+               'RentalAssistanceOngoing', 'RentalAssistanceTemp',
+               'InsuranceFromAnySource', 'Medicaid', 'Medicare', 'SCHIP',
+               'DataCollectionStage'],
+    'project': ['ProjectID', 'OrganizationID', 'ProjectName', 'ProjectType',
+                'ContinuumProject', 'TrackingMethod']}
+
+# Values of the data collection stages:
+ENTRY_STAGE = 1
+UPDATE_STAGE = 2
+EXIT_STAGE = 3
+ANNUAL_STAGE = 5
+
+# Codes of unknown values:
+UNKNOWN_CODES = [8, 9, 99]
+
+# Income sources and their amounts:
+INCOME_SOURCES = {'Earned': 'EarnedAmount', 'TANF': 'TANFAmount',
+                  'GA': 'GAAmount', 'ChildSupport': 'ChildSupportAmount'}
+BENEFITS = ['SNAP', 'WIC', 'TANFChildCare', 'RentalAssistanceOngoing',
+            'RentalAssistanceTemp']
+INSURANCE = ['Medicaid', 'Medicare', 'SCHIP']
+
+# Syllables that surnames are made of:
+SURNAME_SYLLABLES = ['an', 'ber', 'car', 'dal', 'ed', 'fen', 'gar', 'hol',
+                     'is', 'jor', 'kel', 'lan', 'mor', 'ner', 'ol', 'per',
+                     'quin', 'ros', 'son', 'ter', 'ul', 'van', 'wil', 'yor']
+
+# Codes of the prior residence, and its length of stay:
+RESIDENCE_PRIOR = [1, 2, 3, 4, 5, 6, 7, 12, 13, 14, 15, 16, 17, 18, 19, 20]
+LENGTH_OF_STAY = [2, 3, 4, 5, 10, 11]
+
+
+def _folder_years(paths):
+    """The (first, last) entry years of the enrollments in each folder."""
+    years = []
+    for path in paths:
+        found = [int(year) for year in re.findall(r'\d{4}', path)]
+        if len(found) == 0:
+            years.append(DEFAULT_YEARS)
+        else:
+            years.append((min(found), max(found)))
+    return years
+
+
+def _first_names():
+    """First names and the nicknames of each, in upper case."""
+    with open(op.join(DATA_PATH, 'metadata', 'nicknames.json')) as f:
+        nicknames = json.load(f)
+    names = sorted(set(nicknames.values()))
+    by_name = {name: [nick for nick, full in nicknames.items()
+                      if full == name] for name in names}
+    return names, by_name
+
+
+def _surnames():
+    """Surnames made of two or three syllables."""
+    syllables = SURNAME_SYLLABLES
+    names = [a + b for a in syllables for b in syllables]
+    names += [a + b + c for a in syllables[:8] for b in syllables
+              for c in syllables[8:]]
+    return [name.upper() for name in names]
+
+
+def _typo(value, rng, alphabet):
+    """A copy of a string with one substitution, deletion or transposition."""
+    if len(value) < 2:
+        return value
+    i = rng.integers(len(value) - 1)
+    kind = rng.integers(3)
+    if kind == 0:
+        return value[:i] + alphabet[rng.integers(len(alphabet))] + \
+            value[i + 1:]
+    if kind == 1 and len(value) > 3:
+        return value[:i] + value[i + 1:]
+    return value[:i] + value[i + 1] + value[i] + value[i + 2:]
+
+
+def _with_unknowns(values, rate, rng):
+    """Replace a fraction of values by unknown codes."""
+    values = np.asarray(values, dtype=int)
+    unknown = rng.random(len(values)) < rate
+    values[unknown] = rng.choice(UNKNOWN_CODES, size=unknown.sum())
+    return values
+
+
+def _days(dates):
+    """Days since the epoch as dates."""
+    return pd.to_datetime(np.asarray(dates, dtype='int64'), unit='D')
+
+
+def _household_sizes(n_people, household_sizes, rng):
+    """Sizes of households that add up to n_people."""
+    sizes = np.array(list(household_sizes.keys()))
+    p = np.array(list(household_sizes.values()), dtype=float)
+    p /= p.sum()
+    n_households = int(n_people / (sizes * p).sum()) + 10
+    drawn = rng.choice(sizes, size=n_households, p=p)
+    while drawn.sum() < n_people:
+        drawn = np.concatenate([drawn, rng.choice(sizes, size=n_households,
+                                                  p=p)])
+    total = np.cumsum(drawn)
+    last = np.searchsorted(total, n_people)
+    drawn = drawn[:last + 1]
+    drawn[-1] -= total[last] - n_people
+    return drawn
+
+
+class _Generator(object):
+    """State of a run of `generate`: the ID counters and the names."""
+    def __init__(self, rng, paths, n_projects, params):
+        self.rng = rng
+        self.paths = paths
+        self.params = params
+        self.first_names, self.nicknames = _first_names()
+        self.surnames = _surnames()
+        self.folder_years = _folder_years(paths)
+        first = min(years[0] for years in self.folder_years)
+        last = max(years[1] for years in self.folder_years)
+        epoch = pd.Timestamp('1970-01-01')
+        self.start_day = (pd.Timestamp('%d-01-01' % first) - epoch).days
+        self.end_day = (pd.Timestamp('%d-01-01' % (last + 1)) - epoch).days
+        self.n_projects = n_projects
+        mappings = pd.read_csv(op.join(pu.METADATA,
+                                       'destination_mappings.csv'))
+        self.destinations = mappings.loc[
+            mappings.Standard == 'New Standards',
+            'DestinationNumeric'].dropna().astype(int).values
+        self.disability_types = [int(k) for k in get_metadata_dict(
+            op.join(DATA_PATH, 'metadata', 'disability_type.json'))]
+        self.next_id = {table: 1 for table in COLUMNS}
+        self.next_id['person'] = 1
+        self.next_id['household'] = 1
+
+    def ids(self, kind, n):
+        """The next n IDs of a kind."""
+        start = self.next_id[kind]
+        self.next_id[kind] += n
+        return np.arange(start, start + n)
+
+    def folder_of(self, entry_days):
+        """Index of the folder of enrollments, by entry year."""
+        years = _days(entry_days).year.values
+        folders = np.full(len(years), -1)
+        for i, (first, last) in reversed(list(enumerate(self.folder_years))):
+            folders[(years >= first) & (years <= last)] = i
+        # Enrollments in years that no folder covers go anywhere
+        missing = folders < 0
+        folders[missing] = self.rng.integers(len(self.paths),
+                                             size=missing.sum())
+        return folders
+
+    def people(self, n_people):
+        """The true people of a chunk, in households."""
+        rng = self.rng
+        p = self.params
+        sizes = _household_sizes(n_people, p['household_sizes'], rng)
+        household = np.repeat(np.arange(len(sizes)), sizes)
+        member = np.arange(n_people) - np.repeat(np.cumsum(sizes) - sizes,
+                                                 sizes)
+        # The head of household, an adult partner in half the households,
+        # and children
+        adult = (member == 0) | ((member == 1) & (rng.random(n_people) < .5))
+        relationship = np.where(member == 0, 1, np.where(adult, 3, 2))
+        epoch = pd.Timestamp('1970-01-01')
+        adult_days = ((pd.Timestamp('1945-01-01') - epoch).days,
+                      (pd.Timestamp('1995-12-31') - epoch).days)
+        child_days = ((pd.Timestamp('2000-01-01') - epoch).days,
+                      (pd.Timestamp('2011-12-31') - epoch).days)
+        dob = np.where(adult, rng.integers(*adult_days, size=n_people),
+                       rng.integers(*child_days, size=n_people))
+        # Members of a household mostly share the head's surname
+        surnames = np.array(self.surnames)[rng.integers(len(self.surnames),
+                                                        size=len(sizes))]
+        last_name = surnames[household]
+        other = rng.random(n_people) < .2
+        last_name[other] = np.array(self.surnames)[
+            rng.integers(len(self.surnames), size=other.sum())]
+        first_name = np.array(self.first_names)[
+            rng.integers(len(self.first_names), size=n_people)]
+        ssn = np.char.zfill(rng.integers(1, 999999999,
+                                         size=n_people).astype(str), 9)
+        race = rng.choice(5, size=n_people, p=[.02, .05, .25, .03, .65])
+        veteran = adult & (rng.random(n_people) < .1)
+        return {'household_sizes': sizes, 'household': household,
+                'relationship': relationship, 'adult': adult, 'dob': dob,
+                'first_name': first_name, 'last_name': last_name,
+                'ssn': ssn, 'race': race, 'veteran': veteran,
+                'gender': np.where(rng.random(n_people) < .98,
+                                   rng.integers(2, size=n_people),
+                                   rng.integers(2, 5, size=n_people)),
+                'ethnicity': (rng.random(n_people) < .15).astype(int)}
+
+    def identities(self, people):
+        """
+        The PersonalIDs of the people: one each, and a second one for some
+        people, with typos.
+        """
+        rng = self.rng
+        p = self.params
+        n_people = len(people['dob'])
+        n_ids = 1 + (rng.random(n_people) < p['split_rate'])
+        person = np.repeat(np.arange(n_people), n_ids)
+        second = np.zeros(len(person), dtype=bool)
+        second[1:] = person[1:] == person[:-1]
+        identity = {'person': person,
+                    'personal_id': self.ids('person', len(person)),
+                    'first_name': people['first_name'][person].astype(object),
+                    'last_name': people['last_name'][person].astype(object),
+                    'ssn': people['ssn'][person].astype(object),
+                    'first_index': np.cumsum(n_ids) - n_ids,
+                    'n_ids': n_ids}
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        for i in np.where(second)[0]:
+            if rng.random() < p['typo_rate']:
+                nicknames = self.nicknames[identity['first_name'][i]]
+                if len(nicknames) and rng.random() < p['nickname_rate']:
+                    identity['first_name'][i] = nicknames[
+                        rng.integers(len(nicknames))]
+                else:
+                    identity['first_name'][i] = _typo(
+                        identity['first_name'][i], rng, letters)
+            if rng.random() < p['typo_rate']:
+                identity['last_name'][i] = _typo(identity['last_name'][i],
+                                                 rng, letters)
+            if rng.random() < p['typo_rate']:
+                identity['ssn'][i] = _typo(identity['ssn'][i], rng,
+                                           '0123456789')
+        return identity
+
+    def enrollments(self, people, identity):
+        """Enrollments of the households, and the people enrolled."""
+        rng = self.rng
+        p = self.params
+        sizes = people['household_sizes']
+        n_episodes = 1 + rng.poisson(max(p['enrollments_per_household'] - 1,
+                                         0), size=len(sizes))
+        episode_household = np.repeat(np.arange(len(sizes)), n_episodes)
+        n = len(episode_household)
+        entry = rng.integers(self.start_day, self.end_day, size=n)
+        stay = 1 + rng.exponential(90, size=n).astype(int)
+        exited = rng.random(n) < p['exit_rate']
+        project = rng.integers(1, self.n_projects + 1, size=n)
+        household_id = self.ids('household', n)
+
+        # One enrollment of each household member in each episode
+        episode_sizes = sizes[episode_household]
+        episode = np.repeat(np.arange(n), episode_sizes)
+        household_start = np.cumsum(sizes) - sizes
+        member = np.arange(len(episode)) - np.repeat(
+            np.cumsum(episode_sizes) - episode_sizes, episode_sizes)
+        person = household_start[episode_household][episode] + member
+        # People with two PersonalIDs are enrolled with either
+        first_index = identity['first_index'][person]
+        which = first_index + (rng.random(len(person)) *
+                               identity['n_ids'][person]).astype(int)
+        return {'person': person, 'identity': which,
+                'personal_id': identity['personal_id'][which],
+                'enrollment_id': self.ids('enrollment', len(person)),
+                'project': project[episode],
+                'household_id': household_id[episode],
+                'entry': entry[episode],
+                'exit': (entry + stay)[episode],
+                'exited': exited[episode],
+                'folder': self.folder_of(entry[episode])}
+
+    def client_table(self, people, identity, enrollments):
+        """Client rows of each PersonalID in each folder it's enrolled in."""
+        rng = self.rng
+        p = self.params
+        rows = pd.DataFrame({'identity': enrollments['identity'],
+                             'folder': enrollments['folder']})
+        rows = rows.drop_duplicates().sort_values(['identity', 'folder'])
+        # Some client rows are repeated with a conflicting DOB
+        repeated = rows[rng.random(len(rows)) < p['duplicate_rate']]
+        rows = pd.concat([rows, repeated])
+        i = rows['identity'].values
+        person = identity['person'][i]
+        dob = people['dob'][person].copy()
+        shift = rng.integers(1, 720, size=len(repeated)) * \
+            rng.choice([-1, 1], size=len(repeated))
+        dob[len(rows) - len(repeated):] += shift
+        n = len(rows)
+        unknown = p['unknown_rate']
+        veteran = people['veteran'][person]
+        race = people['race'][person]
+        df = pd.DataFrame({'folder': rows['folder'].values,
+                           'PersonalID': identity['personal_id'][i],
+                           'FirstName': identity['first_name'][i],
+                           'LastName': identity['last_name'][i],
+                           'NameDataQuality': 1,
+                           'SSN': identity['ssn'][i],
+                           'SSNDataQuality': 1,
+                           'DOB': _days(dob),
+                           'DOBDataQuality': 1})
+        for k, column in enumerate(['AmIndAKNative', 'Asian',
+                                    'BlackAfAmerican', 'NativeHIOtherPacific',
+                                    'White']):
+            df[column] = _with_unknowns(race == k, unknown, rng)
+        df['RaceNone'] = np.nan
+        df['Ethnicity'] = _with_unknowns(people['ethnicity'][person],
+                                         unknown, rng)
+        df['Gender'] = _with_unknowns(people['gender'][person], unknown, rng)
+        df['OtherGender'] = np.nan
+        df['VeteranStatus'] = _with_unknowns(veteran, unknown, rng)
+        df['YearEnteredService'] = np.nan
+        df['YearSeparated'] = np.nan
+        for column in ['WorldWarII', 'KoreanWar', 'VietnamWar', 'DesertStorm',
+                       'AfghanistanOEF', 'IraqOIF', 'IraqOND',
+                       'OtherTheater']:
+            df[column] = np.where(veteran, rng.random(n) < .1, np.nan)
+        df['MilitaryBranch'] = np.where(veteran, rng.integers(1, 5, size=n),
+                                        np.nan)
+        df['DischargeStatus'] = np.where(veteran, rng.integers(1, 8, size=n),
+                                         np.nan)
+        return df
+
+    def enrollment_table(self, people, enrollments):
+        rng = self.rng
+        n = len(enrollments['person'])
+        unknown = self.params['unknown_rate']
+        return pd.DataFrame({
+            'folder': enrollments['folder'],
+            'ProjectEntryID': enrollments['enrollment_id'],
+            'PersonalID': enrollments['personal_id'],
+            'ProjectID': enrollments['project'],
+            'EntryDate': _days(enrollments['entry']),
+            'HouseholdID': enrollments['household_id'],
+            'RelationshipToHoH': people['relationship'][
+                enrollments['person']],
+            'ResidencePrior': _with_unknowns(
+                rng.choice(RESIDENCE_PRIOR, size=n), unknown, rng),
+            'ResidencePriorLengthOfStay': _with_unknowns(
+                rng.choice(LENGTH_OF_STAY, size=n), unknown, rng),
+            'DisablingCondition': (rng.random(n) < .3).astype(int),
+            'DateToStreetESSH': _days(enrollments['entry'] -
+                                      rng.integers(0, 365, size=n))})
+
+    def exit_table(self, enrollments):
+        exited = enrollments['exited']
+        n = exited.sum()
+        return pd.DataFrame({
+            'folder': enrollments['folder'][exited],
+            'ExitID': self.ids('exit', n),
+            'ProjectEntryID': enrollments['enrollment_id'][exited],
+            'PersonalID': enrollments['personal_id'][exited],
+            'ExitDate': _days(enrollments['exit'][exited]),
+            'Destination': self.rng.choice(self.destinations, size=n),
+            'OtherDestination': np.nan})
+
+    def stages(self, enrollments):
+        """
+        The entry/exit table rows of the enrollments: at entry, at exit if
+        they have ended, and some at an update and an annual assessment.
+        """
+        rng = self.rng
+        p = self.params
+        n = len(enrollments['person'])
+        index = np.arange(n)
+        update = index[rng.random(n) < p['update_rate']]
+        annual = index[rng.random(n) < p['annual_rate']]
+        exited = index[enrollments['exited']]
+        rows = np.concatenate([index, update, annual, exited])
+        stage = np.repeat([ENTRY_STAGE, UPDATE_STAGE, ANNUAL_STAGE,
+                           EXIT_STAGE],
+                          [n, len(update), len(annual), len(exited)])
+        entry = enrollments['entry'][rows]
+        end = enrollments['exit'][rows]
+        date = np.where(stage == ENTRY_STAGE, entry,
+                        np.where(stage == EXIT_STAGE, end,
+                                 (entry + end) // 2))
+        return pd.DataFrame({
+            'folder': enrollments['folder'][rows],
+            'ProjectEntryID': enrollments['enrollment_id'][rows],
+            'PersonalID': enrollments['personal_id'][rows],
+            'InformationDate': _days(date),
+            'DataCollectionStage': stage})
+
+    def disabilities_table(self, stages):
+        types = self.disability_types
+        df = stages.loc[stages.index.repeat(len(types))].reset_index(
+            drop=True)
+        n = len(df)
+        df['DisabilitiesID'] = self.ids('disabilities', n)
+        df['DisabilityType'] = np.tile(types, len(stages))
+        df['DisabilityResponse'] = _with_unknowns(
+            self.rng.random(n) < .2, self.params['unknown_rate'], self.rng)
+        df['IndefiniteAndImpairs'] = np.nan
+        return df
+
+    def employment_education_table(self, stages):
+        rng = self.rng
+        df = stages.copy()
+        n = len(df)
+        df['EmploymentEducationID'] = self.ids('employment_education', n)
+        df['LastGradeCompleted'] = rng.integers(1, 8, size=n)
+        df['SchoolStatus'] = np.nan
+        df['Employed'] = _with_unknowns(rng.random(n) < .25,
+                                        self.params['unknown_rate'], rng)
+        df['EmploymentType'] = np.nan
+        df['NotEmployedReason'] = np.nan
+        return df
+
+    def health_dv_table(self, stages):
+        rng = self.rng
+        unknown = self.params['unknown_rate']
+        df = stages.copy()
+        n = len(df)
+        df['HealthAndDVID'] = self.ids('health_dv', n)
+        df['DomesticViolenceVictim'] = _with_unknowns(rng.random(n) < .2,
+                                                      unknown, rng)
+        df['WhenOccurred'] = np.nan
+        df['GeneralHealthStatus'] = _with_unknowns(
+            rng.integers(1, 6, size=n), unknown, rng)
+        df['DentalHealthStatus'] = np.nan
+        df['MentalHealthStatus'] = np.nan
+        df['PregnancyStatus'] = _with_unknowns(rng.random(n) < .05, unknown,
+                                               rng)
+        df['DueDate'] = np.nan
+        return df
+
+    def income_table(self, stages):
+        rng = self.rng
+        df = stages.copy()
+        n = len(df)
+        df['IncomeBenefitsID'] = self.ids('income', n)
+        total = np.zeros(n)
+        any_income = np.zeros(n, dtype=bool)
+        for source, amount in INCOME_SOURCES.items():
+            has = rng.random(n) < .15
+            amounts = np.round(rng.gamma(2, 400, size=n), 2)
+            df[source] = has.astype(int)
+            df[amount] = np.where(has, amounts, np.nan)
+            total += np.where(has, amounts, 0)
+            any_income |= has
+        df['IncomeFromAnySource'] = any_income.astype(int)
+        df['TotalMonthlyIncome'] = total
+        any_benefit = np.zeros(n, dtype=bool)
+        for benefit in BENEFITS:
+            has = rng.random(n) < .2
+            df[benefit] = has.astype(int)
+            any_benefit |= has
+        df['BenefitsFromAnySource'] = any_benefit.astype(int)
+        any_insurance = np.zeros(n, dtype=bool)
+        for insurance in INSURANCE:
+            has = rng.random(n) < .3
+            df[insurance] = has.astype(int)
+            any_insurance |= has
+        df['InsuranceFromAnySource'] = any_insurance.astype(int)
+        return df
+
+    def project_table(self):
+        rng = self.rng
+        n = self.n_projects
+        project_types = [int(k) for k in get_metadata_dict(
+            op.join(DATA_PATH, 'metadata', 'project_type.json'))]
+        return pd.DataFrame({'ProjectID': np.arange(1, n + 1),
+                             'OrganizationID': rng.integers(1, n // 5 + 2,
+                                                            size=n),
+                             'ProjectName': ['Project %d' % i
+                                             for i in range(1, n + 1)],
+                             'ProjectType': rng.choice(project_types,
+                                                       size=n),
+                             'ContinuumProject': 1,
+                             'TrackingMethod': np.nan})
+
+
+def generate(data_dir, county='king', n_people=1000, paths=None,
+             household_sizes=HOUSEHOLD_SIZES, enrollments_per_household=1.5,
+             n_projects=50, exit_rate=0.9, update_rate=0.2, annual_rate=0.1,
+             duplicate_rate=0.05, split_rate=0.05, typo_rate=0.5,
+             nickname_rate=0.5, unknown_rate=0.02, chunk_size=100000,
+             seed=None):
+    """
+    Write a synthetic HMIS extract for a county.
+
+    Parameters
+    ----------
+    data_dir : string
+        Directory in which to write the extract: the tables are written to
+        the folders in paths inside it, as merge_tables(county=county,
+        data_dir=data_dir) reads them.
+
+    county : string
+        Name of the county, whose folders in COUNTY_FOLDERS are used if
+        paths is None.
+
+    n_people : int
+        Number of (true) people.
+
+    paths : list
+        Folders to write the tables to. The years in the folders' names
+        (e.g. '2014' or '2012_2016') are the years of the entry dates of
+        their enrollments. Defaults to COUNTY_FOLDERS[county].
+
+    household_sizes : dict
+        Probability of each household size.
+
+    enrollments_per_household : float
+        Mean number of enrollments of each household (at least one).
+
+    n_projects : int
+        Number of projects.
+
+    exit_rate : float
+        Fraction of enrollments that have ended, with an exit.
+
+    update_rate, annual_rate : float
+        Fractions of enrollments with update and annual assessment rows in
+        the entry/exit tables (which merge_tables leaves out).
+
+    duplicate_rate : float
+        Fraction of client rows that are repeated with a conflicting DOB.
+
+    split_rate : float
+        Fraction of people with a second PersonalID.
+
+    typo_rate : float
+        Probability that each of the first name, last name and SSN of a
+        second PersonalID has a typo (or, for first names, is a nickname).
+
+    nickname_rate : float
+        Probability that a first name with a typo is replaced by one of its
+        nicknames instead, when it has any.
+
+    unknown_rate : float
+        Fraction of categorical values that are unknown (8, 9 or 99).
+
+    chunk_size : int
+        Number of people to make at a time.
+
+    seed : int
+        Seed of the random numbers, for a reproducible extract.
+
+    Returns
+    ----------
+    dataframe with the true person of each PersonalID in the Client tables
+    (columns PersonalID and PersonID), also written to GroundTruth.csv in
+    data_dir
+    """
+    if paths is None:
+        paths = COUNTY_FOLDERS[county]
+    params = {'household_sizes': household_sizes,
+              'enrollments_per_household': enrollments_per_household,
+              'exit_rate': exit_rate, 'update_rate': update_rate,
+              'annual_rate': annual_rate, 'duplicate_rate': duplicate_rate,
+              'split_rate': split_rate, 'typo_rate': typo_rate,
+              'nickname_rate': nickname_rate,
+              'unknown_rate': unknown_rate}
+    generator = _Generator(np.random.default_rng(seed), paths, n_projects,
+                           params)
+
+    files = {}
+    for path in paths:
+        os.makedirs(op.join(data_dir, path), exist_ok=True)
+        for table, columns in COLUMNS.items():
+            fname = op.join(data_dir, path, TABLE_FILES[table])
+            pd.DataFrame(columns=columns + EXPORT_COLUMNS).to_csv(
+                fname, index=False)
+            files[path, table] = fname
+
+    def write(table, df):
+        df = df.copy()
+        df['DateCreated'] = '2017-01-01'
+        df['DateUpdated'] = '2017-01-01'
+        df['UserID'] = 'synth'
+        df['DateDeleted'] = np.nan
+        for i, path in enumerate(paths):
+            df['ExportID'] = i + 1
+            rows = df[df['folder'] == i]
+            rows.to_csv(files[path, table], mode='a', header=False,
+                        index=False, columns=COLUMNS[table] + EXPORT_COLUMNS,
+                        date_format='%Y-%m-%d')
+
+    projects = generator.project_table()
+    projects['folder'] = 0
+    for i in range(len(paths)):
+        projects['folder'] = i
+        write('project', projects)
+
+    truth = []
+    person_offset = 0
+    for start in range(0, n_people, chunk_size):
+        n_chunk = min(chunk_size, n_people - start)
+        people = generator.people(n_chunk)
+        identity = generator.identities(people)
+        enrollments = generator.enrollments(people, identity)
+        client = generator.client_table(people, identity, enrollments)
+        write('client', client)
+        write('enrollment', generator.enrollment_table(people, enrollments))
+        write('exit', generator.exit_table(enrollments))
+        stages = generator.stages(enrollments)
+        write('disabilities', generator.disabilities_table(stages))
+        write('employment_education',
+              generator.employment_education_table(stages))
+        write('health_dv', generator.health_dv_table(stages))
+        write('income', generator.income_table(stages))
+
+        written = np.isin(identity['personal_id'],
+                          client['PersonalID'].values)
+        truth.append(pd.DataFrame({
+            'PersonalID': identity['personal_id'][written],
+            'PersonID': person_offset + 1 + identity['person'][written]}))
+        person_offset += n_chunk
+
+    truth = pd.concat(truth, ignore_index=True)
+    truth.to_csv(op.join(data_dir, TRUTH_FILE), index=False)
+    return truth
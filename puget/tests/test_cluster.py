@@ -4,6 +4,7 @@ import numpy.testing as npt
 
 import pandas as pd
 import pandas.util.testing as pdt
+import pytest
 
 import puget.cluster as cluster
 
@@ -245,3 +246,23 @@ def test_cluster_w_nulls():
 
     pdt.assert_frame_equal(df1_out.sort_index(axis=1),
                            true_df1_out.sort_index(axis=1))
+
+
+def test_groups_co_occurrence_mapping():
+    # The mapping can cover individuals that aren't in the data-frame:
+    df = pd.DataFrame({'individual_var': [10, 20], 'group_var': [1, 1]})
+    mapping = {5: 0, 10: 1, 20: 2}
+    true_T = np.array([[0, 0, 0], [0, 0, 1], [0, 1, 0]])
+    for sparse in [True, False]:
+        T = cluster.groups_co_occurrence(df, 'individual_var', 'group_var',
+                                         mapping=mapping, sparse=sparse)
+        if sparse:
+            T = T.toarray()
+        npt.assert_equal(T, true_T)
+
+    # Individuals that aren't in the mapping are named:
+    with pytest.raises(ValueError, match="30"):
+        cluster.groups_co_occurrence(pd.DataFrame({'individual_var': [10, 30],
+                                                   'group_var': [1, 1]}),
+                                     'individual_var', 'group_var',
+                                     mapping=mapping)
@@ -0,0 +1,54 @@
+import os.path as op
+import tempfile
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from puget.database import EnrollmentDatabase
+
+
+def make_merged():
+    return pd.DataFrame({'PersonalID': [1, 2, 3, 1, 4],
+                         'ProjectEntryID': [10, 20, 30, 40, 50],
+                         'HouseholdID': [100, 100, 300, 400, 400],
+                         'EntryDate': pd.to_datetime(['2011-01-13',
+                                                      '2011-01-13',
+                                                      '2012-12-05',
+                                                      '2013-09-10', None]),
+                         'ProjectType': ['Emergency Shelter'] * 5,
+                         'income_entry': [1., np.nan, 3., 4., 5.]})
+
+
+def test_database():
+    df = make_merged()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = EnrollmentDatabase(op.join(temp_dir, 'test.sqlite'))
+        db.load(df)
+        indexes = db.query("SELECT name FROM sqlite_master WHERE "
+                           "type = 'index'")['name'].tolist()
+        assert sorted(indexes) == ['ix_enrollments_EntryDate',
+                                   'ix_enrollments_HouseholdID',
+                                   'ix_enrollments_PersonalID',
+                                   'ix_enrollments_ProjectEntryID']
+
+        pdt.assert_frame_equal(db.enrollments(), df)
+        pdt.assert_frame_equal(db.enrollments(person_id=np.int64(1)),
+                               df.iloc[[0, 3]].reset_index(drop=True))
+        pdt.assert_frame_equal(db.enrollments(enrollment_id=[20, 30]),
+                               df.iloc[[1, 2]].reset_index(drop=True))
+        pdt.assert_frame_equal(
+            db.enrollments(entry_dates=('2011-02-01', None),
+                           columns=['PersonalID', 'EntryDate']),
+            df.iloc[[2, 3], [0, 3]].reset_index(drop=True))
+        assert db.enrollments(household_id=400,
+                              entry_dates=(None, '2012-01-01')).shape[0] == 0
+
+        members = db.household_members(2, columns=['PersonalID'])
+        assert members['PersonalID'].tolist() == [1, 2]
+        members = db.household_members(1)
+        assert members['PersonalID'].tolist() == [1, 2, 1, 4]
+
+        # Reloading replaces the table
+        db.load(df.iloc[:2])
+        assert db.enrollments().shape[0] == 2
+        db.close()
@@ -0,0 +1,54 @@
+"""Tests for functions in ids.py."""
+import os.path as op
+import tempfile
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pandas.util.testing as pdt
+
+from puget.ids import IDDictionary, MISSING, encode_ids
+
+
+def test_encode_ids():
+    codes, uniques = encode_ids([30, 10, np.nan, 30, 20])
+    npt.assert_equal(codes, [0, 1, MISSING, 0, 2])
+    assert codes.dtype == np.int32
+    npt.assert_equal(list(uniques), [30, 10, 20])
+
+    # IDs read as floats because of missing values match integer IDs
+    codes_float, uniques_float = encode_ids(pd.Series([30., 10., np.nan]))
+    codes_int, uniques_int = encode_ids(pd.Series([30, 10]))
+    assert uniques_float.equals(uniques_int.astype('Int64'))
+
+
+def test_id_dictionary():
+    ids = IDDictionary()
+    npt.assert_equal(ids.encode('person', ['a', 'b', None, 'a']),
+                     [0, 1, MISSING, 0])
+    # New IDs are added, known IDs keep their codes
+    npt.assert_equal(ids.encode('person', ['c', 'b']), [2, 1])
+    npt.assert_equal(ids.encode('person', [None]), [MISSING])
+    # Domains are separate
+    npt.assert_equal(ids.encode('enrollment', [5., 7., np.nan]),
+                     [0, 1, MISSING])
+
+    pdt.assert_series_equal(ids.decode('person', [2, MISSING, 0]),
+                            pd.Series(['c', np.nan, 'a']))
+    pdt.assert_frame_equal(ids.mapping('person'),
+                           pd.DataFrame({'code': np.arange(3, dtype=np.int32),
+                                         'id': ['a', 'b', 'c']}))
+
+    df = pd.DataFrame({'pid': ['b', 'd'], 'enid': [7, 9], 'x': [1, 2]})
+    columns = {'pid': 'person', 'enid': 'enrollment'}
+    df_codes = ids.encode_columns(df.copy(), columns)
+    npt.assert_equal(df_codes['pid'].values, [1, 3])
+    npt.assert_equal(df_codes['enid'].values, [1, 2])
+    df_decoded = ids.decode_columns(df_codes, columns)
+    df_decoded['enid'] = df_decoded['enid'].astype(np.int64)
+    pdt.assert_frame_equal(df_decoded, df)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'ids.pkl')
+        ids.save(fname)
+        loaded = IDDictionary.load(fname)
+        npt.assert_equal(loaded.encode('person', ['d', 'e']), [3, 4])
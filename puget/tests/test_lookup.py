@@ -0,0 +1,129 @@
+import json
+import os
+import os.path as op
+import tempfile
+import threading
+import urllib.request
+import numpy.testing as npt
+import pandas as pd
+from puget.recordlinkage import link_records, LinkageState
+from puget.lookup import LinkageLookup, make_server
+
+link_list = [{'block_variable': 'lname',
+              'match_variables': {"fname": "string",
+                                  "ssn_as_str": "string",
+                                  "dob": "date"}},
+             {'block_variable': 'ssn_as_str',
+              'match_variables': {"fname": "string",
+                                  "lname": "string",
+                                  "dob": "date"}}]
+
+
+def make_state(fname, n_people=2):
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1", "HMIS0_2",
+                                              "HMIS0_3"][:n_people + 1],
+                                     'ssn_as_str': ['123456789', '123456789',
+                                                    '246801357',
+                                                    '555555555'][:n_people + 1],
+                                     'lname': ["QWERT", "QWERT", "QWERT",
+                                               "LKJH"][:n_people + 1],
+                                     'fname': ["QWERT", "QWERT", "ZXCV",
+                                               "LKJH"][:n_people + 1],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1977-03-04",
+                                             "1970-01-01"][:n_people + 1]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    linked = link_records(prelink_ids, link_list)
+    LinkageState(linked, link_list).save(fname)
+
+
+def test_lookup():
+    record = {'pid0': "HMIS0_9", 'ssn_as_str': '123456789', 'lname': "QWERT",
+              'fname': "QWERTY", 'dob': "1990-02-01"}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'state.pkl')
+        make_state(fname)
+        lookup = LinkageLookup(fname)
+        candidates = lookup.lookup(record)
+        npt.assert_equal(candidates['linkage_PID'].values, [1, 2])
+        npt.assert_equal(candidates['match'].values, [True, False])
+        assert candidates['score'].iloc[0] > candidates['score'].iloc[1]
+
+        # No candidates:
+        assert lookup.lookup({'lname': "LKJH", 'fname': "LKJH"}).shape[0] == 0
+
+        # Hot reload when a new state is saved:
+        make_state(fname, n_people=3)
+        os.utime(fname, ns=(lookup.mtime + 10 ** 9, lookup.mtime + 10 ** 9))
+        candidates = lookup.lookup({'lname': "LKJH", 'fname': "LKJH"})
+        npt.assert_equal(candidates['linkage_PID'].values, [3])
+        assert not lookup.reload_if_changed()
+
+
+def test_lookup_server():
+    record = {'ssn_as_str': '123456789', 'lname': "QWERT", 'fname': "QWERTY",
+              'dob': "1990-02-01"}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'state.pkl')
+        make_state(fname)
+        server = make_server(LinkageLookup(fname), port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/lookup' % server.server_address[1]
+            request = urllib.request.Request(
+                url, data=json.dumps(record).encode('utf-8'), method='POST')
+            with urllib.request.urlopen(request) as response:
+                candidates = json.loads(response.read().decode('utf-8'))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+    assert [c['linkage_PID'] for c in candidates] == [1, 2]
+    assert candidates[0]['match']
+
+
+def test_lookup_server_rewrite():
+    # The state file is rewritten while the server is running
+    record = {'lname': "LKJH", 'fname': "LKJH"}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'state.pkl')
+        make_state(fname)
+        lookup = LinkageLookup(fname)
+        server = make_server(lookup, port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = 'http://127.0.0.1:%d/' % server.server_address[1]
+
+        def post(path, body):
+            request = urllib.request.Request(
+                url + path, data=json.dumps(body).encode('utf-8'),
+                method='POST')
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read().decode('utf-8'))
+
+        try:
+            assert post('lookup', record) == []
+
+            # A partly written state is logged and the current one kept:
+            with open(fname, 'rb') as f:
+                partial = f.read()[:100]
+            with open(fname, 'wb') as f:
+                f.write(partial)
+            os.utime(fname, ns=(lookup.mtime + 10 ** 9,
+                                lookup.mtime + 10 ** 9))
+            assert post('lookup', record) == []
+            assert post('reload', {}) == {'reloaded': False}
+
+            # Saving goes through a temporary file, and the new state is
+            # loaded once it is complete:
+            make_state(fname, n_people=3)
+            assert os.listdir(temp_dir) == ['state.pkl']
+            os.utime(fname, ns=(lookup.mtime + 2 * 10 ** 9,
+                                lookup.mtime + 2 * 10 ** 9))
+            candidates = post('lookup', record)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+    assert [c['linkage_PID'] for c in candidates] == [3]
@@ -0,0 +1,101 @@
+"""Tests for functions in metrics.py."""
+import json
+import pstats
+import os.path as op
+import tempfile
+import pandas as pd
+
+import puget.cluster as cluster
+from puget.metrics import RunReport, console_progress
+
+
+def test_run_report():
+    events = []
+    report = RunReport('test', progress=events.append, trace_memory=True)
+    with report.stage('outer', n_rows_in=3) as outer:
+        with report.stage('inner') as inner:
+            data = list(range(100000))
+            report.message('a note')
+            report.count('n_bad', 2)
+            report.progress(0.5)
+            inner.n_rows_out = len(data)
+        del data
+        outer.n_rows_out = 1
+
+    assert [(event['event'], event['stage']) for event in events] == [
+        ('start', 'outer'), ('start', 'inner'), ('message', 'inner'),
+        ('progress', 'inner'), ('end', 'inner'), ('end', 'outer')]
+    inner, outer = report.stages
+    assert inner.depth == 1 and outer.depth == 0
+    assert inner.messages == ['a note']
+    assert inner.counts == {'n_bad': 2}
+    assert outer.n_rows_in == 3 and outer.n_rows_out == 1
+    assert inner.wall_time <= outer.wall_time
+    # The list was allocated in the inner stage, which is part of the outer
+    assert inner.peak_traced > 100000 * 8
+    assert outer.peak_traced >= inner.peak_traced
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'report.json')
+        report.write(fname)
+        with open(fname) as f:
+            written = json.load(f)
+    assert written['name'] == 'test'
+    assert [stage['name'] for stage in written['stages']] == ['inner',
+                                                              'outer']
+    assert written['wall_time'] == outer.wall_time
+
+
+def test_console_progress(capsys):
+    report = RunReport(progress=console_progress)
+    df = pd.DataFrame({'individual_var': [1, 2, 3, 1],
+                       'group_var': [1, 1, 2, 2]})
+    cluster.cluster(df, 'individual_var', group_var='group_var',
+                    report=report)
+    assert [stage.name for stage in report.stages] == ['co_occurrence',
+                                                       'clusters']
+    assert report.stages[1].counts == {'n_clusters': 1}
+    out = capsys.readouterr().out
+    assert 'clusters: n_rows 4' in out
+
+
+def test_profile(capsys):
+    df = pd.DataFrame({'individual_var': [1, 2, 3, 1],
+                       'group_var': [1, 1, 2, 2]})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report = RunReport(profile_top=5)
+        cluster.cluster(df, 'individual_var', group_var='group_var',
+                        report=report, profile=temp_dir)
+        for stage in report.stages:
+            assert stage.profile == op.join(temp_dir,
+                                            '%s.pstats' % stage.name)
+        # The co-occurrence counting is in its own stage's profile, not in
+        # the clusters stage's
+        stats = pstats.Stats(report.stages[1].profile)
+        functions = [function for (_, _, function) in stats.stats]
+        assert 'connected_components' in functions
+        assert 'groups_co_occurrence' not in functions
+        out = capsys.readouterr().out
+        assert 'Profile of stage clusters' in out
+        # Only the stages of the call are profiled
+        assert report.profile_dir is None
+        with report.stage('later'):
+            pass
+        assert report.stages[-1].profile is None
+
+        # Nested stages are profiled separately
+        report = RunReport(profile_dir=temp_dir)
+        with report.stage('outer'):
+            with report.stage('inner'):
+                sorted(range(1000))
+        inner = pstats.Stats(op.join(temp_dir, 'inner.pstats'))
+        outer = pstats.Stats(op.join(temp_dir, 'outer.pstats'))
+        assert any('sorted' in function for (_, _, function) in inner.stats)
+        assert not any('sorted' in function
+                       for (_, _, function) in outer.stats)
+
+    # Without a profile directory nothing is written
+    report = RunReport()
+    with report.stage('plain'):
+        pass
+    assert report.stages[0].profile is None
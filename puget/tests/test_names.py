@@ -0,0 +1,77 @@
+import os.path as op
+import tempfile
+import numpy as np
+import pandas as pd
+import pandas.util.testing as pdt
+from puget.names import normalize, load_nicknames, NameKeys
+from puget.recordlinkage import link_records
+
+
+def test_normalize():
+    names = pd.Series(["o'Brien", "Smith-Jones ", "smith  jones", np.nan,
+                       "123", "Bill"])
+    expected = pd.Series(["OBRIEN", "SMITH JONES", "SMITH JONES", np.nan,
+                          np.nan, "BILL"])
+    pdt.assert_series_equal(normalize(names), expected)
+
+    nicknames = load_nicknames()
+    assert nicknames["BILL"] == "WILLIAM"
+    expected[5] = "WILLIAM"
+    pdt.assert_series_equal(normalize(names, nicknames), expected)
+
+
+def test_name_keys():
+    df = pd.DataFrame({'FirstName': ["Bill", "william", None, "Bill"],
+                       'LastName': ["Smith-Jones", "SMITH JONES", "Smith",
+                                    "smyth"]},
+                      index=[10, 11, 12, 13])
+    name_keys = NameKeys()
+    keyed = name_keys.add_keys(df, ['FirstName', 'LastName'],
+                               nickname_columns=['FirstName'])
+    pdt.assert_series_equal(keyed['FirstName_norm'],
+                            pd.Series(["WILLIAM", "WILLIAM", np.nan,
+                                       "WILLIAM"], index=df.index,
+                                      dtype=object, name='FirstName_norm'))
+    assert (keyed['LastName_norm'] == ["SMITHJONES", "SMITHJONES", "SMITH",
+                                       "SMYTH"]).all()
+    assert (keyed['LastName_part'] == ["SMITH", "SMITH", "SMITH",
+                                       "SMYTH"]).all()
+    assert keyed.loc[12, 'LastName_soundex'] == keyed.loc[13,
+                                                          'LastName_soundex']
+    assert keyed.loc[12, 'LastName_metaphone'] == 'SM0'
+    assert pd.isnull(keyed.loc[12, 'FirstName_soundex'])
+
+    # Each distinct name is computed once:
+    assert len(name_keys.cache) == 6
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'names.pkl')
+        name_keys.save(fname)
+        loaded = NameKeys.load(fname)
+    assert loaded.cache == name_keys.cache
+    pdt.assert_frame_equal(loaded.add_keys(df, ['FirstName', 'LastName'],
+                                           nickname_columns=['FirstName']),
+                           keyed)
+
+
+def test_linkage_name_keys():
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1"],
+                                     'ssn_as_str': ['123456789', '987654321'],
+                                     'lname': ["Smith-Jones", "smith jones"],
+                                     'fname': ["Bill", "William"],
+                                     'dob': ["1990-02-01", "1990-02-01"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "dob": "date"}}]
+    linked = link_records(prelink_ids.copy(), link_list)
+    assert linked["linkage_PID"].nunique() == 2
+
+    keyed = NameKeys().add_keys(prelink_ids, ['fname', 'lname'],
+                                nickname_columns=['fname'])
+    link_list = [{'block_variable': 'lname_soundex',
+                  'match_variables': {"fname_norm": "string",
+                                      "lname_norm": "string",
+                                      "dob": "date"}}]
+    linked = link_records(keyed, link_list)
+    assert linked["linkage_PID"].nunique() == 1
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pandas.util.testing as pdt
+import numpy.testing as npt
+import pytest
+from puget.pprl import (encode, encode_records, dice_similarity, popcount,
+                        filter_columns, hmac_values)
+from puget.recordlinkage import link_records, FeatureCache
+
+
+def test_encode():
+    values = pd.Series(["QWERT", "QWERTY", None, "QWERT", "ZXCVB"])
+    filters, missing = encode(values, 'secret', num_bits=256)
+    assert filters.dtype == np.uint64
+    assert filters.shape == (5, 4)
+    npt.assert_equal(missing, [False, False, True, False, False])
+    npt.assert_equal(filters[0], filters[3])
+    npt.assert_equal(filters[2], 0)
+
+    # The filters depend on the key:
+    other, _ = encode(values, 'other secret', num_bits=256)
+    assert not np.array_equal(filters[0], other[0])
+
+    # Dates are encoded as YYYY-MM-DD:
+    dates, _ = encode(pd.to_datetime(pd.Series(["1990-02-01"])), 'secret')
+    strings, _ = encode(pd.Series(["1990-02-01"]), 'secret')
+    npt.assert_equal(dates, strings)
+
+    with pytest.raises(ValueError):
+        encode(values, 'secret', num_bits=100)
+
+
+def test_dice_similarity():
+    words = np.array([[0b1011, 0], [0b0011, 1 << 63], [0, 0]],
+                     dtype=np.uint64)
+    npt.assert_equal(popcount(words), [3, 3, 0])
+    npt.assert_almost_equal(dice_similarity(words[[0, 0, 2]],
+                                            words[[0, 1, 0]]),
+                            [1, 2 * 2 / 6., np.nan])
+
+    encoded = encode_records(pd.DataFrame({'name': ["QWERT", "QWERTY", None,
+                                                    "ZXCVB"],
+                                           'other': [1, 2, 3, 4]}),
+                             ['name'], 'secret')
+    words = filter_columns('name', encoded.columns)
+    assert words == filter_columns('name', 16)
+    assert list(encoded.columns) == ['other'] + words
+    assert (encoded[words].dtypes == np.uint64).all()
+    names = encoded[words].values
+    similarity = dice_similarity(names[[0, 0, 0, 0]], names[[0, 1, 2, 3]])
+    assert similarity[0] == 1
+    assert 0.8 < similarity[1] < 1
+    assert np.isnan(similarity[2])
+    assert similarity[3] < 0.5
+    with pytest.raises(ValueError):
+        filter_columns('other', encoded.columns)
+
+
+def test_hmac_values():
+    values = pd.Series(["QWERT", None, "QWERT", "QWERTY"], index=[3, 4, 5, 6])
+    keys = hmac_values(values, 'secret')
+    pdt.assert_index_equal(keys.index, values.index)
+    assert keys[3] == keys[5]
+    assert keys[3] != keys[6]
+    assert keys[4] is None
+    assert "QWERT" not in keys[3]
+    assert keys[3] != hmac_values(values, 'other secret')[3]
+
+
+def test_linkage_bloom():
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1", "HMIS0_2",
+                                              "HMIS0_3"],
+                                     'ssn_as_str': ['123456789', '123456789',
+                                                    '123456789', '246801357'],
+                                     'lname': ["QWERT", "QWERT", "ASDF",
+                                               "QWERT"],
+                                     'fname': ["QWERTYU", "QWERTYI", "QWERTYU",
+                                               "ZXCVB"],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1990-02-01", "1977-03-04"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'ssn_as_str',
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+    expected = link_records(prelink_ids.copy(), link_list)
+
+    # Block on keyed hashes and compare Bloom filters, so that no plaintext
+    # is used:
+    encoded = encode_records(prelink_ids, ['fname', 'lname', 'dob',
+                                           'ssn_as_str'], 'secret')
+    encoded['lname_key'] = hmac_values(prelink_ids['lname'], 'secret')
+    encoded['ssn_key'] = hmac_values(prelink_ids['ssn_as_str'], 'secret')
+    bloom_list = [{'block_variable': 'lname_key',
+                   'match_variables': {"fname": "bloom",
+                                       "ssn_as_str": "bloom",
+                                       "dob": "bloom"}},
+                  {'block_variable': 'ssn_key',
+                   'match_variables': {"fname": "bloom",
+                                       "lname": "bloom",
+                                       "dob": "bloom"}}]
+    linked = link_records(encoded, bloom_list, string_threshold=0.75)
+    pdt.assert_series_equal(expected["linkage_PID"], linked["linkage_PID"])
+
+
+def test_sweep_bloom():
+    # Dice similarities are thresholded in the sweep as in link_records
+    prelink_ids = pd.DataFrame(data={'lname': ["QWERT", "QWERT", "QWERT",
+                                               "QWERT"],
+                                     'fname': ["QWERTYU", "QWERTYI", "QWERT",
+                                               "ZXCVB"],
+                                     'ssn_as_str': ['123456789', '123456780',
+                                                    '123456789',
+                                                    '246801357']})
+    encoded = encode_records(prelink_ids, ['fname', 'ssn_as_str'], 'secret')
+    encoded['lname_key'] = hmac_values(prelink_ids['lname'], 'secret')
+    bloom_list = [{'block_variable': 'lname_key',
+                   'match_variables': {"fname": "bloom",
+                                       "ssn_as_str": "bloom"}}]
+    cache = FeatureCache(encoded, bloom_list)
+    match_thresholds = [0.4, 0.9]
+    string_thresholds = [0.5, 0.8, 0.95]
+    sweep = cache.sweep(match_thresholds, string_thresholds)
+    for _, row in sweep.iterrows():
+        linked = link_records(encoded.copy(), bloom_list,
+                              match_threshold=row['match_threshold'],
+                              string_threshold=row['string_threshold'])
+        assert row['n_clusters'] == linked["linkage_PID"].nunique()
+    assert sweep['n_clusters'].nunique() > 1
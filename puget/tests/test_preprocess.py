@@ -70,6 +70,18 @@ def test_read_table():
     df_test.index = pd.Int64Index([0, 1, 3])
     pdt.assert_frame_equal(df, df_test)
 
+    # test skipping rows while parsing
+    df = pp.read_table(file_spec, data_dir=None, paths=None,
+                       columns_to_drop=['drop1'], categorical_var=['categ1'],
+                       time_var=['time1'],
+                       duplicate_check_columns=['id', 'time1', 'categ1'],
+                       row_filter={'id': [2, 3]})
+    df_test = pd.DataFrame({'id': [2],
+                            'time1': pd.to_datetime(['2003-06-10']),
+                            'ig_dedup1': [8], 'categ1': [0]})
+    df_test.index = pd.Int64Index([1])
+    pdt.assert_frame_equal(df, df_test)
+
     # test passing a string filename with data_dir and path
     path, fname = op.split(temp_csv_file.name)
     path0, path1 = op.split(path)
@@ -90,6 +102,39 @@ def test_read_table():
         pp.read_table('test', data_dir=None, paths=None)
 
 
+def test_read_csv_filtered():
+    # Reading in chunks gives the same rows as reading then filtering
+    df = pd.DataFrame({'\ufeffid': np.arange(25) % 7,
+                       'date': pd.date_range('2015-01-01', periods=25),
+                       'name': ['a', None, 'c', 'd', 'e'] * 5,
+                       'value': np.arange(25) / 2})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'table.csv')
+        df.to_csv(fname, index=False)
+        row_filter = {'id': [1, 2, 6],
+                      'date': pp.date_range_filter('2015-01-03',
+                                                   '2015-01-20')}
+        full = pd.read_csv(fname, low_memory=False)
+        keys = full.rename(columns=lambda col: col.lstrip('\ufeff'))
+        expected = full[pp._row_filter_mask(keys, row_filter)]
+        expected = expected.reset_index(drop=True)
+        for chunk_size in [4, 25, 100]:
+            filtered = pp._read_csv_filtered(fname, row_filter=row_filter,
+                                             chunk_size=chunk_size)
+            pdt.assert_frame_equal(filtered, expected)
+
+        # Filter columns that aren't in usecols are left out
+        filtered = pp._read_csv_filtered(fname, row_filter=row_filter,
+                                         usecols=['name', 'value'],
+                                         chunk_size=4)
+        pdt.assert_frame_equal(filtered, expected[['name', 'value']])
+
+        # No rows pass
+        filtered = pp._read_csv_filtered(fname, row_filter={'id': [10]},
+                                         chunk_size=4)
+        assert filtered.shape == (0, 4)
+
+
 def test_read_entry_exit():
     temp_csv_file = tempfile.NamedTemporaryFile(mode='w')
     df_init = pd.DataFrame({'id': [11, 11, 12],
@@ -617,184 +662,194 @@ def test_get_project():
     pdt.assert_frame_equal(df, df_test)
 
 
+def _write_merge_files(temp_dir):
+    """
+    Write small raw tables and metadata files for merge_tables to temp_dir.
+
+    Returns the paths and the metadata files to pass to merge_tables.
+    """
+    year_str = '2011'
+    paths = [year_str]
+    dir_year = op.join(temp_dir, year_str)
+    os.makedirs(dir_year, exist_ok=True)
+    # make up all the csv files and metadata files
+    enrollment_df = pd.DataFrame({'personID': [1, 2, 3, 4],
+                                  'person_enrollID': [10, 20, 30, 40],
+                                  'programID': [100, 200, 200, 100],
+                                  'groupID': [1000, 2000, 3000, 4000],
+                                  'entrydate': ['2011-01-13',
+                                                '2011-06-10',
+                                                '2011-12-05',
+                                                '2011-09-10']})
+    # print(enrollment_df)
+    enrollment_metadata = {'name': 'enrollment',
+                           'person_enrollment_ID': 'person_enrollID',
+                           'person_ID': 'personID',
+                           'program_ID': 'programID',
+                           'groupID_column': 'groupID',
+                           'duplicate_check_columns': ['personID',
+                                                       'person_enrollID',
+                                                       'programID',
+                                                       'groupID'],
+                           'columns_to_drop': [],
+                           'time_var': ['entrydate'],
+                           'entry_date': 'entrydate'}
+    enrollment_csv_file = op.join(dir_year, 'Enrollment.csv')
+    enrollment_df.to_csv(enrollment_csv_file, index=False)
+    enrollment_meta_file = op.join(dir_year, 'Enrollment.json')
+    with open(enrollment_meta_file, 'w') as outfile:
+        json.dump(enrollment_metadata, outfile)
+
+    exit_df = pd.DataFrame({'ppid': [10, 20, 30, 40],
+                            'dest_num': [12, 27, 20, 10],
+                            'exitdate': ['2011-08-01', '2011-12-21',
+                                         '2011-12-27', '2011-11-30']})
+    exit_metadata = {'name': 'exit', 'person_enrollment_ID': 'ppid',
+                     'destination_column': 'dest_num',
+                     'duplicate_check_columns': ['ppid'],
+                     'columns_to_drop': [],
+                     'time_var': ['exitdate']}
+    exit_csv_file = op.join(dir_year, 'Exit.csv')
+    exit_df.to_csv(exit_csv_file, index=False)
+    exit_meta_file = op.join(dir_year, 'Exit.json')
+    with open(exit_meta_file, 'w') as outfile:
+        json.dump(exit_metadata, outfile)
+
+    # need to test removal of bad dobs & combining of client records here
+    client_df = pd.DataFrame({'pid': [1, 1, 2, 2, 3, 3, 4, 4],
+                              'dob': ['1990-03-13', '2012-04-16',
+                                      '1955-08-21', '1855-08-21',
+                                      '2001-02-16', '2003-02-16',
+                                      '1983-04-04', '1983-04-06'],
+                              'gender': [0, 0, 1, 1, 1, 1, 0, 0],
+                              'veteran': [0, 0, 1, 1, 0, 0, 0, 0],
+                              'first_name':["AAA", "AAA",
+                                            "noname", "noname",
+                                            "CCC", "CCC",
+                                            "DDD", "DDD"]})
+
+    client_metadata = {'name': 'client', 'person_ID': 'pid',
+                       'dob_column': 'dob',
+                       'time_var': ['dob'],
+                       'categorical_var': ['gender', 'veteran'],
+                       'boolean': ['veteran'],
+                       'numeric_code': ['gender'],
+                       'duplicate_check_columns': ['pid', 'dob'],
+                       'name_columns' :["first_name"]}
+
+    client_csv_file = op.join(dir_year, 'Client.csv')
+    client_df.to_csv(client_csv_file, index=False)
+    client_meta_file = op.join(dir_year, 'Client.json')
+    with open(client_meta_file, 'w') as outfile:
+        json.dump(client_metadata, outfile)
+
+    disabilities_df = pd.DataFrame({'person_enrollID': [10, 10, 20, 20,
+                                                        30, 30, 40, 40],
+                                    'stage': [0, 1, 0, 1, 0, 1, 0, 1],
+                                    'type': [5, 5, 5, 5, 5, 5, 5, 5],
+                                    'response': [0, 0, 1, 1, 0, 0, 0, 1]})
+    disabilities_metadata = {'name': 'disabilities',
+                             'person_enrollment_ID': 'person_enrollID',
+                             'categorical_var': ['response'],
+                             'collection_stage_column': 'stage',
+                             'entry_stage_val': 0, "exit_stage_val": 1,
+                             'update_stage_val': 2,
+                             'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
+                             'type_column': 'type',
+                             'response_column': 'response',
+                             'duplicate_check_columns': ['person_enrollID',
+                                                         'stage', 'type'],
+                             'columns_to_drop': []}
+
+    disabilities_csv_file = op.join(dir_year, 'Disabilities.csv')
+    disabilities_df.to_csv(disabilities_csv_file, index=False)
+    disabilities_meta_file = op.join(dir_year, 'Disabilities.json')
+    with open(disabilities_meta_file, 'w') as outfile:
+        json.dump(disabilities_metadata, outfile)
+
+    emp_edu_df = pd.DataFrame({'ppid': [10, 10, 20, 20, 30, 30, 40, 40],
+                               'stage': [0, 1, 0, 1, 0, 1, 0, 1],
+                               'employed': [0, 0, 0, 1, 1, 1, 0, 1]})
+    emp_edu_metadata = {'name': 'employment_education',
+                        'person_enrollment_ID': 'ppid',
+                        'categorical_var': ['employed'],
+                        'collection_stage_column': 'stage',
+                        'entry_stage_val': 0, "exit_stage_val": 1,
+                        'update_stage_val': 2,
+                        'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
+                        'duplicate_check_columns': ['ppid', 'stage'],
+                        'columns_to_drop': []}
+
+    emp_edu_csv_file = op.join(dir_year, 'EmploymentEducation.csv')
+    emp_edu_df.to_csv(emp_edu_csv_file, index=False)
+    emp_edu_meta_file = op.join(dir_year, 'EmploymentEducation.json')
+    with open(emp_edu_meta_file, 'w') as outfile:
+        json.dump(emp_edu_metadata, outfile)
+
+    health_dv_df = pd.DataFrame({'ppid': [10, 10, 20, 20, 30, 30, 40, 40],
+                                 'stage': [0, 1, 0, 1, 0, 1, 0, 1],
+                                 'health_status': [0, 0, 0, 1, 1, 1, 0, 1]})
+    health_dv_metadata = {'name': 'health_dv',
+                          'person_enrollment_ID': 'ppid',
+                          'categorical_var': ['health_status'],
+                          'collection_stage_column': 'stage',
+                          'entry_stage_val': 0, 'exit_stage_val': 1,
+                          'update_stage_val': 2,
+                          'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
+                          'duplicate_check_columns': ['ppid', 'stage'],
+                          'columns_to_drop': []}
+    health_dv_csv_file = op.join(dir_year, 'HealthAndDV.csv')
+    health_dv_df.to_csv(health_dv_csv_file, index=False)
+    health_dv_meta_file = op.join(dir_year, 'HealthAndDV.json')
+    with open(health_dv_meta_file, 'w') as outfile:
+        json.dump(health_dv_metadata, outfile)
+
+    income_df = pd.DataFrame({'ppid': [10, 10, 20, 20, 30, 30, 40, 40],
+                              'stage': [0, 1, 0, 1, 0, 1, 0, 1],
+                              'income': [0, 0, 0, 1000, 500, 400, 0, 300]})
+    income_metadata = {'name': 'income', 'person_enrollment_ID': 'ppid',
+                       'categorical_var': ['income'],
+                       'collection_stage_column': 'stage',
+                       'entry_stage_val': 0, 'exit_stage_val': 1,
+                       'update_stage_val': 2,
+                       'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
+                       'columns_to_take_max': ['income'],
+                       'duplicate_check_columns': ['ppid', 'stage'],
+                       'columns_to_drop': []}
+
+    income_csv_file = op.join(dir_year, 'IncomeBenefits.csv')
+    income_df.to_csv(income_csv_file, index=False)
+    income_meta_file = op.join(dir_year, 'IncomeBenefits.json')
+    with open(income_meta_file, 'w') as outfile:
+        json.dump(income_metadata, outfile)
+
+    project_df = pd.DataFrame({'pr_id': [100, 200],
+                               'type': [1, 2]})
+    project_metadata = {'name': 'project', 'program_ID': 'pr_id',
+                        'project_type_column': 'type',
+                        'duplicate_check_columns': ['pr_id'],
+                        'columns_to_drop': []}
+
+    project_csv_file = op.join(dir_year, 'Project.csv')
+    project_df.to_csv(project_csv_file, index=False)
+    project_meta_file = op.join(dir_year, 'Project.json')
+    with open(project_meta_file, 'w') as outfile:
+        json.dump(project_metadata, outfile)
+
+    metadata_files = {'enrollment': enrollment_meta_file,
+                      'exit': exit_meta_file,
+                      'client': client_meta_file,
+                      'disabilities': disabilities_meta_file,
+                      'employment_education': emp_edu_meta_file,
+                      'health_dv': health_dv_meta_file,
+                      'income': income_meta_file,
+                      'project': project_meta_file}
+    return paths, metadata_files
+
+
 def test_merge():
     with tempfile.TemporaryDirectory() as temp_dir:
-        year_str = '2011'
-        paths = [year_str]
-        dir_year = op.join(temp_dir, year_str)
-        os.makedirs(dir_year, exist_ok=True)
-        # make up all the csv files and metadata files
-        enrollment_df = pd.DataFrame({'personID': [1, 2, 3, 4],
-                                      'person_enrollID': [10, 20, 30, 40],
-                                      'programID': [100, 200, 200, 100],
-                                      'groupID': [1000, 2000, 3000, 4000],
-                                      'entrydate': ['2011-01-13',
-                                                    '2011-06-10',
-                                                    '2011-12-05',
-                                                    '2011-09-10']})
-        # print(enrollment_df)
-        enrollment_metadata = {'name': 'enrollment',
-                               'person_enrollment_ID': 'person_enrollID',
-                               'person_ID': 'personID',
-                               'program_ID': 'programID',
-                               'groupID_column': 'groupID',
-                               'duplicate_check_columns': ['personID',
-                                                           'person_enrollID',
-                                                           'programID',
-                                                           'groupID'],
-                               'columns_to_drop': [],
-                               'time_var': ['entrydate'],
-                               'entry_date': 'entrydate'}
-        enrollment_csv_file = op.join(dir_year, 'Enrollment.csv')
-        enrollment_df.to_csv(enrollment_csv_file, index=False)
-        enrollment_meta_file = op.join(dir_year, 'Enrollment.json')
-        with open(enrollment_meta_file, 'w') as outfile:
-            json.dump(enrollment_metadata, outfile)
-
-        exit_df = pd.DataFrame({'ppid': [10, 20, 30, 40],
-                                'dest_num': [12, 27, 20, 10],
-                                'exitdate': ['2011-08-01', '2011-12-21',
-                                             '2011-12-27', '2011-11-30']})
-        exit_metadata = {'name': 'exit', 'person_enrollment_ID': 'ppid',
-                         'destination_column': 'dest_num',
-                         'duplicate_check_columns': ['ppid'],
-                         'columns_to_drop': [],
-                         'time_var': ['exitdate']}
-        exit_csv_file = op.join(dir_year, 'Exit.csv')
-        exit_df.to_csv(exit_csv_file, index=False)
-        exit_meta_file = op.join(dir_year, 'Exit.json')
-        with open(exit_meta_file, 'w') as outfile:
-            json.dump(exit_metadata, outfile)
-
-        # need to test removal of bad dobs & combining of client records here
-        client_df = pd.DataFrame({'pid': [1, 1, 2, 2, 3, 3, 4, 4],
-                                  'dob': ['1990-03-13', '2012-04-16',
-                                          '1955-08-21', '1855-08-21',
-                                          '2001-02-16', '2003-02-16',
-                                          '1983-04-04', '1983-04-06'],
-                                  'gender': [0, 0, 1, 1, 1, 1, 0, 0],
-                                  'veteran': [0, 0, 1, 1, 0, 0, 0, 0],
-                                  'first_name':["AAA", "AAA",
-                                                "noname", "noname",
-                                                "CCC", "CCC",
-                                                "DDD", "DDD"]})
-
-        client_metadata = {'name': 'client', 'person_ID': 'pid',
-                           'dob_column': 'dob',
-                           'time_var': ['dob'],
-                           'categorical_var': ['gender', 'veteran'],
-                           'boolean': ['veteran'],
-                           'numeric_code': ['gender'],
-                           'duplicate_check_columns': ['pid', 'dob'],
-                           'name_columns' :["first_name"]}
-
-        client_csv_file = op.join(dir_year, 'Client.csv')
-        client_df.to_csv(client_csv_file, index=False)
-        client_meta_file = op.join(dir_year, 'Client.json')
-        with open(client_meta_file, 'w') as outfile:
-            json.dump(client_metadata, outfile)
-
-        disabilities_df = pd.DataFrame({'person_enrollID': [10, 10, 20, 20,
-                                                            30, 30, 40, 40],
-                                        'stage': [0, 1, 0, 1, 0, 1, 0, 1],
-                                        'type': [5, 5, 5, 5, 5, 5, 5, 5],
-                                        'response': [0, 0, 1, 1, 0, 0, 0, 1]})
-        disabilities_metadata = {'name': 'disabilities',
-                                 'person_enrollment_ID': 'person_enrollID',
-                                 'categorical_var': ['response'],
-                                 'collection_stage_column': 'stage',
-                                 'entry_stage_val': 0, "exit_stage_val": 1,
-                                 'update_stage_val': 2,
-                                 'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
-                                 'type_column': 'type',
-                                 'response_column': 'response',
-                                 'duplicate_check_columns': ['person_enrollID',
-                                                             'stage', 'type'],
-                                 'columns_to_drop': []}
-
-        disabilities_csv_file = op.join(dir_year, 'Disabilities.csv')
-        disabilities_df.to_csv(disabilities_csv_file, index=False)
-        disabilities_meta_file = op.join(dir_year, 'Disabilities.json')
-        with open(disabilities_meta_file, 'w') as outfile:
-            json.dump(disabilities_metadata, outfile)
-
-        emp_edu_df = pd.DataFrame({'ppid': [10, 10, 20, 20, 30, 30, 40, 40],
-                                   'stage': [0, 1, 0, 1, 0, 1, 0, 1],
-                                   'employed': [0, 0, 0, 1, 1, 1, 0, 1]})
-        emp_edu_metadata = {'name': 'employment_education',
-                            'person_enrollment_ID': 'ppid',
-                            'categorical_var': ['employed'],
-                            'collection_stage_column': 'stage',
-                            'entry_stage_val': 0, "exit_stage_val": 1,
-                            'update_stage_val': 2,
-                            'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
-                            'duplicate_check_columns': ['ppid', 'stage'],
-                            'columns_to_drop': []}
-
-        emp_edu_csv_file = op.join(dir_year, 'EmploymentEducation.csv')
-        emp_edu_df.to_csv(emp_edu_csv_file, index=False)
-        emp_edu_meta_file = op.join(dir_year, 'EmploymentEducation.json')
-        with open(emp_edu_meta_file, 'w') as outfile:
-            json.dump(emp_edu_metadata, outfile)
-
-        health_dv_df = pd.DataFrame({'ppid': [10, 10, 20, 20, 30, 30, 40, 40],
-                                     'stage': [0, 1, 0, 1, 0, 1, 0, 1],
-                                     'health_status': [0, 0, 0, 1, 1, 1, 0, 1]})
-        health_dv_metadata = {'name': 'health_dv',
-                              'person_enrollment_ID': 'ppid',
-                              'categorical_var': ['health_status'],
-                              'collection_stage_column': 'stage',
-                              'entry_stage_val': 0, 'exit_stage_val': 1,
-                              'update_stage_val': 2,
-                              'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
-                              'duplicate_check_columns': ['ppid', 'stage'],
-                              'columns_to_drop': []}
-        health_dv_csv_file = op.join(dir_year, 'HealthAndDV.csv')
-        health_dv_df.to_csv(health_dv_csv_file, index=False)
-        health_dv_meta_file = op.join(dir_year, 'HealthAndDV.json')
-        with open(health_dv_meta_file, 'w') as outfile:
-            json.dump(health_dv_metadata, outfile)
-
-        income_df = pd.DataFrame({'ppid': [10, 10, 20, 20, 30, 30, 40, 40],
-                                  'stage': [0, 1, 0, 1, 0, 1, 0, 1],
-                                  'income': [0, 0, 0, 1000, 500, 400, 0, 300]})
-        income_metadata = {'name': 'income', 'person_enrollment_ID': 'ppid',
-                           'categorical_var': ['income'],
-                           'collection_stage_column': 'stage',
-                           'entry_stage_val': 0, 'exit_stage_val': 1,
-                           'update_stage_val': 2,
-                           'annual_assessment_stage_val': 5, 'post_exit_stage_val': 6,
-                           'columns_to_take_max': ['income'],
-                           'duplicate_check_columns': ['ppid', 'stage'],
-                           'columns_to_drop': []}
-
-        income_csv_file = op.join(dir_year, 'IncomeBenefits.csv')
-        income_df.to_csv(income_csv_file, index=False)
-        income_meta_file = op.join(dir_year, 'IncomeBenefits.json')
-        with open(income_meta_file, 'w') as outfile:
-            json.dump(income_metadata, outfile)
-
-        project_df = pd.DataFrame({'pr_id': [100, 200],
-                                   'type': [1, 2]})
-        project_metadata = {'name': 'project', 'program_ID': 'pr_id',
-                            'project_type_column': 'type',
-                            'duplicate_check_columns': ['pr_id'],
-                            'columns_to_drop': []}
-
-        project_csv_file = op.join(dir_year, 'Project.csv')
-        project_df.to_csv(project_csv_file, index=False)
-        project_meta_file = op.join(dir_year, 'Project.json')
-        with open(project_meta_file, 'w') as outfile:
-            json.dump(project_metadata, outfile)
-
-        metadata_files = {'enrollment': enrollment_meta_file,
-                          'exit': exit_meta_file,
-                          'client': client_meta_file,
-                          'disabilities': disabilities_meta_file,
-                          'employment_education': emp_edu_meta_file,
-                          'health_dv': health_dv_meta_file,
-                          'income': income_meta_file,
-                          'project': project_meta_file}
+        paths, metadata_files = _write_merge_files(temp_dir)
 
         for name_exclusion in [False, True]:
 
@@ -854,4 +909,286 @@ def test_merge():
             # sort because column order is not assured because started with dicts
             df = df.sort_index(axis=1)
             df_test = df_test.sort_index(axis=1)
-            pdt.assert_frame_equal(df, df_test)
\ No newline at end of file
+            pdt.assert_frame_equal(df, df_test)
+
+def test_merge_sharded():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        for groups in [False, True]:
+            if groups:
+                # Put the first two people in one household
+                enroll_file = op.join(temp_dir, paths[0], 'Enrollment.csv')
+                enroll = pd.read_csv(enroll_file)
+                enroll['groupID'] = [1000, 1000, 3000, 4000]
+                enroll.to_csv(enroll_file, index=False)
+            df = pp.merge_tables(meta_files=metadata_files,
+                                 data_dir=temp_dir, paths=paths,
+                                 groups=groups)
+            for n_jobs in [1, 2]:
+                df_sharded = pp.merge_tables(meta_files=metadata_files,
+                                             data_dir=temp_dir, paths=paths,
+                                             groups=groups, n_shards=3,
+                                             n_jobs=n_jobs)
+                pdt.assert_frame_equal(df_sharded, df)
+
+
+def test_merge_row_filter():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+
+        # Rows of enrollments that aren't in the enrollment table are
+        # skipped when the side tables are read and don't change the result
+        for fname, ppid in [('Exit.csv', 'ppid'),
+                            ('Disabilities.csv', 'person_enrollID'),
+                            ('IncomeBenefits.csv', 'ppid')]:
+            table_file = op.join(temp_dir, paths[0], fname)
+            table = pd.read_csv(table_file)
+            extra = table.copy()
+            extra[ppid] = extra[ppid] + 1
+            pd.concat([table, extra]).to_csv(table_file, index=False)
+        df_extra = pp.merge_tables(meta_files=metadata_files,
+                                   data_dir=temp_dir, paths=paths,
+                                   groups=False)
+    pdt.assert_frame_equal(df_extra, df)
+
+
+def test_merge_columns():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+
+        columns = ['personID', 'dob', 'exitdate', 'DestinationGroup',
+                   'Physical_exit', 'income_entry', 'ProjectType']
+        usecols = pp.merge_usecols(columns, meta_files=metadata_files,
+                                   data_dir=temp_dir, paths=paths)
+        # Only the needed columns of the pivoted tables are read
+        assert usecols['employment_education'] == ['ppid', 'stage']
+        assert usecols['income'] == ['ppid', 'stage', 'income']
+
+        df_columns = pp.merge_tables(meta_files=metadata_files,
+                                     data_dir=temp_dir, paths=paths,
+                                     groups=False, columns=columns)
+        pdt.assert_frame_equal(df_columns, df[columns])
+
+        df_sharded = pp.merge_tables(meta_files=metadata_files,
+                                     data_dir=temp_dir, paths=paths,
+                                     groups=False, columns=columns,
+                                     n_shards=2, n_jobs=1)
+        pdt.assert_frame_equal(df_sharded, df[columns])
+
+        with pytest.raises(ValueError):
+            pp.merge_usecols(['not_a_column'], meta_files=metadata_files,
+                             data_dir=temp_dir, paths=paths)
+
+
+def test_merge_cohort():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        enroll_file = op.join(temp_dir, paths[0], 'Enrollment.csv')
+        client_file = op.join(temp_dir, paths[0], 'Client.csv')
+        enroll = pd.read_csv(enroll_file)
+        client = pd.read_csv(client_file)
+        # A client with no enrollment, who is only kept without a cohort:
+        no_enrollment = client[client['pid'] == 4].assign(pid=5)
+        client = pd.concat([client, no_enrollment], ignore_index=True)
+        client.to_csv(client_file, index=False)
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+        assert df['person_enrollID'].isnull().sum() == 1
+
+        cohorts = [({'entry_dates': ('2011-06-01', '2011-12-01')}, [20, 40]),
+                   ({'entry_dates': (None, '2011-06-10')}, [10]),
+                   ({'project_types': ['Transitional Housing']}, [20, 30]),
+                   ({'project_types': [1],
+                     'entry_dates': ('2011-02-01', None)}, [40])]
+        for cohort, enids in cohorts:
+            df = pp.merge_tables(meta_files=metadata_files,
+                                 data_dir=temp_dir, paths=paths,
+                                 groups=False, **cohort)
+            df_sharded = pp.merge_tables(meta_files=metadata_files,
+                                         data_dir=temp_dir, paths=paths,
+                                         groups=False, n_shards=2, n_jobs=1,
+                                         **cohort)
+
+            # Same as merging tables with only the cohort's enrollments
+            # and people
+            in_cohort = enroll['person_enrollID'].isin(enids)
+            enroll[in_cohort].to_csv(enroll_file, index=False)
+            client[client['pid'].isin(enroll.loc[in_cohort, 'personID'])
+                   ].to_csv(client_file, index=False)
+            df_test = pp.merge_tables(meta_files=metadata_files,
+                                      data_dir=temp_dir, paths=paths,
+                                      groups=False)
+            enroll.to_csv(enroll_file, index=False)
+            client.to_csv(client_file, index=False)
+
+            pdt.assert_frame_equal(df, df_test)
+            pdt.assert_frame_equal(df_sharded, df_test)
+            assert df['person_enrollID'].notnull().all()
+
+
+def test_merge_checkpoints(monkeypatch):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        run_dir = op.join(temp_dir, 'run')
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('stage should not run')
+
+        # A run that dies in the income stage
+        with monkeypatch.context() as m:
+            m.setattr(pp, 'get_income', fail)
+            with pytest.raises(RuntimeError):
+                pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                                paths=paths, groups=False, run_dir=run_dir)
+        with open(op.join(run_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        assert 'merge_health_dv' in manifest
+        assert 'income' not in manifest
+
+        # is resumed after the last join, without reading the earlier tables
+        with monkeypatch.context() as m:
+            for get_table in ['get_enrollment', 'get_exit', 'get_client',
+                              'get_disabilities', 'get_health_dv']:
+                m.setattr(pp, get_table, fail)
+            df_resumed = pp.merge_tables(meta_files=metadata_files,
+                                         data_dir=temp_dir, paths=paths,
+                                         groups=False, run_dir=run_dir)
+            pdt.assert_frame_equal(df_resumed, df)
+
+            # and a complete run is just loaded
+            m.setattr(pp, 'get_income', fail)
+            m.setattr(pp, 'get_project', fail)
+            df_resumed = pp.merge_tables(meta_files=metadata_files,
+                                         data_dir=temp_dir, paths=paths,
+                                         groups=False, run_dir=run_dir)
+            pdt.assert_frame_equal(df_resumed, df)
+
+        # Changing an input reruns its stage and the ones after it
+        exit_file = op.join(temp_dir, paths[0], 'Exit.csv')
+        exit_table = pd.read_csv(exit_file)
+        exit_table.loc[0, 'exitdate'] = '2011-12-31'
+        exit_table.to_csv(exit_file, index=False)
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+        with monkeypatch.context() as m:
+            m.setattr(pp, 'get_enrollment', fail)
+            df_resumed = pp.merge_tables(meta_files=metadata_files,
+                                         data_dir=temp_dir, paths=paths,
+                                         groups=False, run_dir=run_dir)
+        pdt.assert_frame_equal(df_resumed, df)
+
+
+def test_merge_ids():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+        id_columns = {'personID': 'person',
+                      'person_enrollID': 'enrollment',
+                      'groupID': 'household',
+                      'programID': 'project'}
+        for n_shards in [1, 2]:
+            ids = puget.ids.IDDictionary()
+            df_codes = pp.merge_tables(meta_files=metadata_files,
+                                       data_dir=temp_dir, paths=paths,
+                                       groups=False, n_shards=n_shards,
+                                       n_jobs=1, ids=ids)
+            for column in id_columns:
+                assert df_codes[column].dtype == np.int32
+            df_decoded = ids.decode_columns(df_codes, id_columns)
+            for column in id_columns:
+                df_decoded[column] = df_decoded[column].astype(
+                    df[column].dtype)
+            pdt.assert_frame_equal(df_decoded, df)
+
+        with pytest.raises(ValueError):
+            pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                            paths=paths, ids=puget.ids.IDDictionary(),
+                            run_dir=op.join(temp_dir, 'run'))
+        with pytest.raises(ValueError):
+            pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                            paths=paths, n_shards=2,
+                            run_dir=op.join(temp_dir, 'run'))
+
+
+def test_merge_compact():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        compact_columns = pp.compact_columns(metadata_files)
+        assert compact_columns['veteran'] == 'boolean'
+        assert compact_columns['gender'] == 'Int8'
+        assert compact_columns['employed_exit'] == 'category'
+        assert compact_columns['Physical_entry'] == 'category'
+
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False)
+        df_compact = pp.merge_tables(meta_files=metadata_files,
+                                     data_dir=temp_dir, paths=paths,
+                                     groups=False, compact=True)
+        assert df_compact['veteran'].dtype == 'boolean'
+        assert df_compact['gender'].dtype == 'Int8'
+        assert df_compact['income_entry'].dtype == 'category'
+        for column in df.columns:
+            if df_compact[column].dtype != df[column].dtype:
+                assert_equal(
+                    df_compact[column].astype(df[column].dtype).values,
+                    df[column].values)
+        # (categoricals only save memory on more than a few rows)
+        for column in ['veteran', 'gender']:
+            assert (df_compact[column].memory_usage(index=False) <
+                    df[column].memory_usage(index=False))
+
+        # Codes that don't fit the compact dtype are left as they are
+        df_codes = df.copy()
+        df_codes['veteran'] = [0, 1, 2, 1]
+        df_codes['gender'] = [0, 1, 1000, 1]
+        df_codes = pp.compact_dtypes(df_codes, meta_files=metadata_files)
+        assert df_codes['veteran'].dtype == 'Int8'
+        assert df_codes['gender'].dtype == np.int64
+
+
+def test_merge_report():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, metadata_files = _write_merge_files(temp_dir)
+        run_dir = op.join(temp_dir, 'run')
+        events = []
+        report = puget.metrics.RunReport(progress=events.append)
+        df = pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                             paths=paths, groups=False, run_dir=run_dir,
+                             report=report)
+        stages = {stage.name: stage for stage in report.stages}
+        assert stages['enrollment'].n_rows_out == 4
+        assert stages['client'].counts == {'n_bad_dob': 2}
+        assert stages['merge_project'].n_rows_in == df.shape[0]
+        assert stages['merge_project'].n_rows_out == df.shape[0]
+        assert 'Found 2 entries with bad DOBs' in [
+            event.get('message') for event in events]
+
+        # The report is written to the run directory, and a resumed run
+        # records which stages were skipped or loaded
+        with open(op.join(run_dir, 'report.json')) as f:
+            written = json.load(f)
+        assert [stage['name'] for stage in written['stages']] == \
+            [stage.name for stage in report.stages]
+        report = puget.metrics.RunReport()
+        pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                        paths=paths, groups=False, run_dir=run_dir,
+                        report=report)
+        statuses = {stage.name: stage.status for stage in report.stages}
+        assert statuses['enrollment'] == 'skipped'
+        assert statuses['merge_project'] == 'checkpoint'
+
+        # Shards report their progress
+        events = []
+        pp.merge_tables(meta_files=metadata_files, data_dir=temp_dir,
+                        paths=paths, groups=False, n_shards=2, n_jobs=1,
+                        report=puget.metrics.RunReport(
+                            progress=events.append))
+        assert [event['fraction'] for event in events
+                if event['event'] == 'progress'] == [0.5, 1.0]
@@ -1,7 +1,17 @@
+import os.path as op
+import tempfile
 import numpy as np
 import pandas as pd
 import pandas.util.testing as pdt
-from puget.recordlinkage import link_records
+import numpy.testing as npt
+import pytest
+import recordlinkage as rl
+from puget.metrics import RunReport
+from puget.recordlinkage import (link_records, link_sources, near_match_index,
+                                write_block_pairs, read_pairs,
+                                write_pairs, dedupe_pair_file,
+                                block_and_match, LSHIndex, LinkageState, FeatureCache,
+                                pairwise_precision_recall)
 
 def test_linkage():
     link_list = [{'block_variable': 'lname',
@@ -166,3 +176,405 @@ def test_linkage():
     test_df = prelink_ids.copy()
     test_df["linkage_PID"] = [1, 1, 1]
     pdt.assert_frame_equal(test_df, linked)
+
+
+def test_linkage_no_passes():
+    # Without any passes, each record is a person of its own:
+    prelink_ids = pd.DataFrame({'fname': ["QWERT", "QWERT", "ASDF"]})
+    linked = link_records(prelink_ids, [])
+    npt.assert_equal(linked["linkage_PID"].values, [1, 2, 3])
+
+
+def test_near_match_index():
+    df = pd.DataFrame({'ssn_as_str': ['123456789',  # original
+                                      '123456780',  # substitution
+                                      '213456789',  # transposition
+                                      '12345678',   # deletion
+                                      '1234567890',  # insertion
+                                      '987654321',  # unrelated
+                                      np.nan,
+                                      '123456789']},  # exact duplicate
+                      index=[10, 11, 12, 13, 14, 15, 16, 17])
+    pairs = near_match_index(df, 'ssn_as_str')
+    # The first label is always the later record:
+    npt.assert_equal(set(pairs.tolist()),
+                     {(11, 10), (12, 10), (13, 10), (14, 10), (17, 10),
+                      (13, 11), (14, 11), (17, 11), (17, 12),
+                      (17, 13), (17, 14)})
+
+    # Nothing to match:
+    df = pd.DataFrame({'ssn_as_str': [np.nan, np.nan]})
+    assert len(near_match_index(df, 'ssn_as_str')) == 0
+
+
+def test_linkage_near_match():
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}}]
+
+    # Different last names, so blocking alone never compares these two:
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1"],
+                                     'ssn_as_str': ['123456789', '123456798'],
+                                     'lname': ["QWERT", "ASDF"],
+                                     'fname': ["QWERT", "QWERT"],
+                                     'dob': ["1990-02-01", "1990-02-01"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    linked = link_records(prelink_ids.copy(), link_list)
+    npt.assert_equal(linked["linkage_PID"].values, [1, 2])
+
+    link_list[0]['near_match_variable'] = 'ssn_as_str'
+    linked = link_records(prelink_ids.copy(), link_list)
+    npt.assert_equal(linked["linkage_PID"].values, [1, 1])
+
+
+def test_lsh_index():
+    df = pd.DataFrame({'fname': ["JONATHAN", "JONATHON", "MARIA", "MARIA",
+                                 "XAVIER", np.nan],
+                       'lname': ["SMITHSON", "SMITHSON", "GARCIA", "GARCIA",
+                                 "QUINTERO", np.nan]},
+                      index=[10, 11, 12, 13, 14, 15])
+    indexer = LSHIndex(on=['fname', 'lname'], num_perm=64, bands=32)
+    pairs = indexer.index(df)
+    assert (11, 10) in pairs
+    assert (13, 12) in pairs
+    for label in [14, 15]:
+        assert label not in pairs.get_level_values(0)
+        assert label not in pairs.get_level_values(1)
+
+    # Chunking doesn't change the result:
+    chunked = LSHIndex(on=['fname', 'lname'], num_perm=64, bands=32,
+                       chunk_size=2)
+    npt.assert_equal(chunked.index(df).tolist(), pairs.tolist())
+
+    # Buckets that are too large are skipped:
+    capped = LSHIndex(on=['fname', 'lname'], num_perm=64, bands=32,
+                      max_bucket_size=1)
+    assert len(capped.index(df)) == 0
+
+    with pytest.raises(ValueError):
+        LSHIndex(on='fname', num_perm=10, bands=3)
+
+    # As a link_list option:
+    link_list = [{'indexer': LSHIndex(on=['fname', 'lname'], num_perm=64,
+                                      bands=32),
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1"],
+                                     'lname': ["SMITHSON", "SMITHSON"],
+                                     'fname': ["JONATHAN", "JONATHON"],
+                                     'dob': ["1990-02-01", "1990-02-01"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    linked = link_records(prelink_ids, link_list)
+    npt.assert_equal(linked["linkage_PID"].values, [1, 1])
+
+
+def test_linkage_state():
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'fname',
+                  'match_variables': {"lname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'ssn_as_str',
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1", "HMIS0_2"],
+                                     'ssn_as_str': ['123456789', '123456789',
+                                                    '246801357'],
+                                     'lname': ["QWERT", "QWERT", "ZXCV"],
+                                     'fname': ["QWERT", "QWERT", "QWERT"],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1990-02-01"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    linked = link_records(prelink_ids, link_list)
+    npt.assert_equal(linked["linkage_PID"].values, [1, 1, 2])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'state.pkl')
+        LinkageState(linked, link_list).save(fname)
+        state = LinkageState.load(fname)
+    assert state.next_pid == 3
+
+    new_ids = pd.DataFrame(data={'pid0': ["HMIS0_3", "HMIS0_4", "HMIS0_5",
+                                          "HMIS0_6", "HMIS0_7"],
+                                 # Same person as PID 1:
+                                 'ssn_as_str': ['123456789',
+                                                # Someone new:
+                                                '555555555',
+                                                # Links PID 1 and PID 2:
+                                                '123456789',
+                                                # Two records of someone new:
+                                                '999887777', '999887777'],
+                                 'lname': ["QWERT", "LKJH", "ZXCV", "POIU",
+                                           "POIU"],
+                                 'fname': ["QWERT", "LKJH", "QWERT", "POIU",
+                                           "POIU"],
+                                 'dob': ["1990-02-01", "1970-01-01",
+                                         "1990-02-01", "1985-05-05",
+                                         "1985-05-05"]},
+                           index=[100, 101, 102, 103, 104])
+    new_ids["dob"] = pd.to_datetime(new_ids["dob"])
+    new_linked, merges = state.link(new_ids)
+    npt.assert_equal(new_linked.index.values, new_ids.index.values)
+    npt.assert_equal(new_linked["linkage_PID"].values, [1, 3, 1, 4, 4])
+    npt.assert_equal(merges.values, [[2, 1]])
+    npt.assert_equal(state.population["linkage_PID"].values,
+                     [1, 1, 1, 1, 3, 1, 4, 4])
+    assert state.next_pid == 5
+
+    # Linking the same people again doesn't make new PIDs:
+    new_linked, merges = state.link(new_ids.iloc[[1, 3]])
+    npt.assert_equal(new_linked["linkage_PID"].values, [3, 4])
+    assert merges.shape[0] == 0
+
+    with pytest.raises(ValueError):
+        LinkageState(prelink_ids.drop("linkage_PID", axis=1), link_list)
+
+
+def test_linkage_state_indexes():
+    # The population's indexes, updated for each batch of new records, find
+    # the same pairs as indexing the whole population again
+    rng = np.random.RandomState(0)
+    names = ["SMITHSON", "SMITHSEN", "GARCIA", "GARCIAS", "LEE", None]
+    ssns = ['123456789', '123456780', '213456789', '987654321', None]
+
+    def records(n):
+        return pd.DataFrame({'lname': rng.choice(names, n),
+                             'fname': rng.choice(names, n),
+                             'ssn_as_str': rng.choice(ssns, n)})
+
+    lsh = LSHIndex(on='lname', num_perm=16, bands=8, max_bucket_size=30)
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string"},
+                  'near_match_variable': 'ssn_as_str'},
+                 {'indexer': lsh,
+                  'match_variables': {"fname": "string"}}]
+    population = records(20)
+    population["linkage_PID"] = np.arange(1, 21)
+    state = LinkageState(population, link_list)
+    # More batches than the indexes keep segments of:
+    for _ in range(12):
+        new = records(5)
+        new.index = new.index + 1000
+        expected = rl.BlockIndex(on='lname').index(new, state.population)
+        expected = expected.union(near_match_index(new, 'ssn_as_str',
+                                                   df_b=state.population))
+        assert set(state._existing_pairs(0, new).tolist()) == \
+            set(expected.tolist())
+        assert set(state._existing_pairs(1, new).tolist()) == \
+            set(lsh.index(new, state.population).tolist())
+        state.link(new)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'state.pkl')
+        state.save(fname)
+        loaded = LinkageState.load(fname)
+    new = records(5)
+    for i in range(2):
+        assert loaded._existing_pairs(i, new).equals(
+            state._existing_pairs(i, new))
+
+
+def test_link_sources():
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'ssn_as_str',
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+
+    pha = pd.DataFrame(data={'pid0': ["PHA0_1", "PHA0_2", "PHA0_3"],
+                             'ssn_as_str': ['123456789', '123456789',
+                                            '246801357'],
+                             'lname': ["QWERT", "QWERT", "ASDF"],
+                             'fname': ["QWERT", "QWERT", "ASDF"],
+                             'dob': ["1990-02-01", "1990-02-01",
+                                     "1977-03-04"]},
+                       index=[5, 6, 7])
+    hmis = pd.DataFrame(data={'pid0': ["HMIS0_1", "HMIS0_2"],
+                              'ssn_as_str': ['999999999', '123456789'],
+                              'lname': ["ZXCV", "QWERT"],
+                              'fname': ["ZXCV", "QEWRT"],
+                              'dob': ["1980-01-01", "1990-02-01"]})
+    for df in [pha, hmis]:
+        df["dob"] = pd.to_datetime(df["dob"])
+
+    linked_pha, linked_hmis = link_sources(pha, hmis, link_list)
+    npt.assert_equal(linked_pha.index.values, pha.index.values)
+    # The two identical PHA records are only linked through the HMIS record:
+    npt.assert_equal(linked_pha["linkage_PID"].values, [1, 1, 2])
+    npt.assert_equal(linked_hmis["linkage_PID"].values, [3, 1])
+
+    # Without the HMIS record, they stay separate:
+    linked_pha, linked_hmis = link_sources(pha, hmis.iloc[:1], link_list)
+    npt.assert_equal(linked_pha["linkage_PID"].values, [1, 2, 3])
+    npt.assert_equal(linked_hmis["linkage_PID"].values, [4])
+
+
+def test_feature_cache():
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'ssn_as_str',
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1", "HMIS0_2",
+                                              "HMIS0_3"],
+                                     'ssn_as_str': ['123456789', '123456789',
+                                                    '123456789', '246801357'],
+                                     'lname': ["QWERT", "QWERT", "ASDF",
+                                               "QWERT"],
+                                     'fname': ["QWERT", "QWERTY", "QWERT",
+                                               "ZXCVB"],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1990-02-01", "1977-03-04"]},
+                               index=[3, 2, 1, 0])
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+
+    cache = FeatureCache(prelink_ids, link_list)
+    # Scores are not thresholded:
+    fname_scores = cache.features[0]["fname"]
+    assert ((fname_scores > 0) & (fname_scores < 1)).any()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'features.pkl')
+        cache.save(fname)
+        cache = FeatureCache.load(fname)
+
+    match_thresholds = [0.1, 0.5, 0.9]
+    string_thresholds = [0.8, 0.99]
+    sweep = cache.sweep(match_thresholds, string_thresholds)
+    assert sweep.shape[0] == 6
+    for _, row in sweep.iterrows():
+        linked = link_records(prelink_ids.copy(), link_list,
+                              match_threshold=row['match_threshold'],
+                              string_threshold=row['string_threshold'])
+        assert row['n_clusters'] == linked["linkage_PID"].nunique()
+    npt.assert_equal(sweep['n_clusters'].values, [2, 2, 3, 2, 2, 4])
+    npt.assert_equal(sweep['n_links'].values, [3, 3, 1, 3, 2, 0])
+
+
+def test_pair_file():
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'lname': rng.choice(['A', 'B', 'C', None], 200)},
+                      index=rng.permutation(200) + 1000)
+    expected = rl.BlockIndex(on='lname').index(df.dropna())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'pairs.bin')
+        # A small chunk size, so the pairs are written in several chunks:
+        n_pairs = write_block_pairs(df, 'lname', fname, chunk_size=37)
+        pairs = read_pairs(fname)
+        assert pairs.dtype == np.int32
+        assert pairs.shape == (n_pairs, 2)
+        assert np.all(pairs[:, 0] > pairs[:, 1])
+        found = set(zip(df.index[pairs[:, 0]], df.index[pairs[:, 1]]))
+        del pairs
+    assert n_pairs == len(expected)
+    assert found == set(expected.tolist())
+
+
+def test_dedupe_pair_file():
+    rng = np.random.RandomState(0)
+    pairs = rng.randint(0, 20, size=(300, 2)).astype(np.int32)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'pairs.bin')
+        with open(fname, 'wb') as f:
+            f.write(pairs.tobytes())
+        # A small window, so the pairs are spread over several buckets:
+        n_pairs = dedupe_pair_file(fname, window_size=16)
+        deduped = read_pairs(fname)
+        assert deduped.shape == (n_pairs, 2)
+        found = [tuple(pair) for pair in deduped]
+        del deduped
+    assert len(found) == len(set(found))
+    assert set(found) == set(map(tuple, pairs))
+
+
+def test_linkage_pair_file():
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'ssn_as_str',
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1", "HMIS0_2",
+                                              "HMIS0_3", "HMIS0_4"],
+                                     'ssn_as_str': ['123456789', '123456789',
+                                                    '123456789', '246801357',
+                                                    '999999999'],
+                                     'lname': ["QWERT", "QWERT", "ASDF",
+                                               "QWERT", "ZXCVB"],
+                                     'fname': ["QWERT", "QWERTY", "QWERT",
+                                               "ZXCVB", "QWERT"],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1990-02-01", "1977-03-04",
+                                             "1981-05-06"]},
+                               index=[4, 3, 2, 1, 0])
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+
+    report = RunReport()
+    expected = link_records(prelink_ids.copy(), link_list, report=report)
+    stream_report = RunReport()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        linked = link_records(prelink_ids.copy(), link_list,
+                              pair_dir=temp_dir, window_size=1,
+                              report=stream_report)
+    pdt.assert_frame_equal(expected, linked)
+    # The compared pairs are counted, not only the matches:
+    n_pairs = {stage.name: stage.counts.get('n_pairs')
+               for stage in stream_report.stages}
+    assert n_pairs['pass_0'] == 3
+    assert n_pairs['pass_1'] == 3
+
+
+def test_pairwise_precision_recall():
+    # Linked: {0, 1, 2}, {3}; true: {0, 1}, {2, 3}
+    precision, recall = pairwise_precision_recall([1, 1, 1, 2],
+                                                  [5, 5, 6, 6])
+    npt.assert_almost_equal(precision, 1 / 3)
+    npt.assert_almost_equal(recall, 1 / 2)
+    assert pairwise_precision_recall([1, 2], [1, 2]) == (1.0, 1.0)
+
+
+def test_pair_file_near_match_and_indexer():
+    rng = np.random.RandomState(0)
+    names = np.array(["SMITHSON", "SMITHSEN", "GARCIA", "GARCIAS", "LEE"])
+    df = pd.DataFrame({'lname': rng.choice(names, 60),
+                       'fname': rng.choice(names, 60),
+                       'ssn_as_str': rng.choice(['123456789', '123456780',
+                                                 '987654321'], 60)},
+                      index=rng.permutation(60) + 100)
+    comparison = {'fname': 'string', 'ssn_as_str': 'string'}
+    for kwargs in [{'block_variable': 'lname',
+                    'near_match_variable': 'ssn_as_str'},
+                   {'block_variable': None,
+                    'indexer': LSHIndex(on='lname', num_perm=16, bands=8),
+                    'near_match_variable': 'ssn_as_str'}]:
+        expected = block_and_match(df, comparison_dict=comparison,
+                                   match_threshold=0.4, **kwargs)
+        expected = expected[expected['match']]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            streamed = block_and_match(df, comparison_dict=comparison,
+                                       match_threshold=0.4,
+                                       pair_file=op.join(temp_dir, 'p.bin'),
+                                       window_size=50, **kwargs)
+        # Each pair is compared once, as in memory
+        assert streamed.index.is_unique
+        assert set(streamed.index.tolist()) == set(expected.index.tolist())
+
+    with pytest.raises(ValueError):
+        block_and_match(df, 'lname', comparison, df_b=df,
+                        pair_file='pairs.bin')
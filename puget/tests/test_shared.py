@@ -0,0 +1,62 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from puget.shared import publish, attach
+
+
+def make_frame():
+    return pd.DataFrame({'PersonalID': np.arange(5),
+                         'income_entry': [1., np.nan, 3., 4., 5.],
+                         'EntryDate': pd.to_datetime(['2011-01-13', None,
+                                                      '2012-12-05',
+                                                      '2013-09-10',
+                                                      '2014-01-01']),
+                         'Veteran': pd.array([1, None, 0, 1, 0],
+                                             dtype='Int8'),
+                         'Physical_entry': pd.array([True, None, False, True,
+                                                     True], dtype='boolean'),
+                         'ProjectType': pd.Categorical(['ES', 'TH', None,
+                                                        'ES', 'TH']),
+                         'FirstName': ['A', None, 'B', 'A', 'C'],
+                         'is_head': [True, False, True, True, False]})
+
+
+def household_income(descriptor):
+    view = attach(descriptor)
+    total = view.frame.groupby('ProjectType')['income_entry'].sum()
+    view.close()
+    return total
+
+
+def test_shared():
+    df = make_frame()
+    shared = publish(df)
+    try:
+        # The descriptor can be passed around as JSON
+        descriptor = json.loads(json.dumps(shared.descriptor))
+        view = attach(descriptor)
+        expected = df.copy()
+        expected['FirstName'] = pd.Categorical(['A', None, 'B', 'A', 'C'],
+                                               categories=['A', 'B', 'C'])
+        pdt.assert_frame_equal(view.frame, expected)
+
+        buf = np.frombuffer(view.shm.buf, dtype=np.uint8)
+        assert np.shares_memory(view.frame['PersonalID'].values, buf)
+        assert np.shares_memory(view.frame['ProjectType'].cat.codes.values,
+                                buf)
+        with pytest.raises(ValueError):
+            view.frame['income_entry'].values[0] = 2.
+        del buf
+        view.close()
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            totals = list(executor.map(household_income, [descriptor] * 2))
+        for total in totals:
+            pdt.assert_series_equal(
+                total, df.groupby('ProjectType')['income_entry'].sum())
+    finally:
+        shared.close()
@@ -0,0 +1,92 @@
+import tempfile
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+pytest.importorskip('pyarrow')
+import puget.storage as ps  # noqa: E402
+
+
+def make_merged(n=6):
+    return pd.DataFrame({'PersonalID': np.arange(n),
+                         'FirstName': ['A%d' % i for i in range(n)],
+                         'ProjectType': ['Emergency Shelter',
+                                         'Transitional Housing'] * (n // 2),
+                         'EntryDate': pd.to_datetime(['2011-01-13',
+                                                      '2012-06-10',
+                                                      '2011-12-05', None,
+                                                      '2013-09-10',
+                                                      '2012-01-01']),
+                         'income_entry': [1., np.nan, 3., 4., 5., 6.]})
+
+
+def test_parquet():
+    df = make_merged()
+    assert ps.categorical_columns(df) == ['ProjectType']
+    with tempfile.TemporaryDirectory() as root:
+        ps.write_parquet(df, root, 'king')
+        ps.write_parquet(df.iloc[:2], root, 'pierce')
+
+        king = ps.read_parquet(root, counties=['king'])
+        assert king.shape[0] == df.shape[0]
+        assert king['ProjectType'].dtype == 'category'
+        assert king['EntryDate'].dtype == 'datetime64[ns]'
+        king = king.sort_values('PersonalID').reset_index(drop=True)
+        king['ProjectType'] = king['ProjectType'].astype(object)
+        expected = df.copy()
+        expected['county'] = 'king'
+        expected['entry_year'] = pd.array([2011, 2012, 2011, None, 2013,
+                                           2012], dtype='Int32')
+        pdt.assert_frame_equal(king, expected)
+
+        # Rewriting a county replaces its partitions
+        ps.write_parquet(df.iloc[:1], root, 'king')
+        assert ps.read_parquet(root).shape[0] == 3
+
+        subset = ps.read_parquet(root, entry_years=[2012],
+                                 columns=['PersonalID', 'county'])
+        assert list(subset.columns) == ['PersonalID', 'county']
+        assert subset['PersonalID'].tolist() == [1]
+        assert subset['county'].tolist() == ['pierce']
+
+
+def test_feather():
+    df = make_merged()
+    df['ProjectType'] = df['ProjectType'].astype('category')
+    df['Veteran'] = [True, False] * 3
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = temp_dir + '/merged.feather'
+        schema = ps.write_feather(df, fname)
+        assert ps.read_schema(fname).equals(schema)
+        assert str(schema.field('EntryDate').type) == 'date32[day]'
+        assert str(schema.field('PersonalID').type) == 'int32'
+
+        df_read = ps.read_feather(fname)
+        expected = df.copy()
+        expected['PersonalID'] = expected['PersonalID'].astype(np.int32)
+        pdt.assert_frame_equal(df_read, expected)
+        pdt.assert_frame_equal(ps.read_feather(fname, columns=['FirstName']),
+                               expected[['FirstName']])
+
+        # A later run is written with the same schema
+        ps.write_feather(df.iloc[:0], fname, schema=schema)
+        assert ps.read_schema(fname).equals(schema)
+        with pytest.raises(ValueError):
+            ps.write_feather(df[['FirstName']], fname, schema=schema)
+        with pytest.raises(OverflowError):
+            ps.write_feather(pd.DataFrame({'id': [2 ** 40]}), fname)
+
+        # The linked records read the same from csv and Feather files
+        linked = pd.DataFrame({'pid0': ['HMIS0_1', 'PHA0_2'],
+                               'pid1': ['HMIS1_000001', 'PHA1_000001'],
+                               'pid2': ['0012', '0013'],
+                               'linkage_PID': [1, 1],
+                               'dob': ['1990-02-01', '1990-02-01']})
+        linked.to_csv(temp_dir + '/PHA_HMIS_linked.csv', index=False)
+        linked['dob'] = pd.to_datetime(linked['dob'])
+        ps.write_feather(linked, temp_dir + '/PHA_HMIS_linked.feather')
+        from_csv = ps.read_linked(temp_dir + '/PHA_HMIS_linked.csv')
+        pdt.assert_frame_equal(
+            from_csv, ps.read_linked(temp_dir + '/PHA_HMIS_linked.feather'))
+        assert from_csv['pid2'].tolist() == ['0012', '0013']
@@ -0,0 +1,78 @@
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+from recordlinkage.algorithms.string import (jarowinkler_similarity as
+                                             rl_jarowinkler,
+                                             levenshtein_similarity as
+                                             rl_levenshtein)
+
+import puget.string_similarity as pss
+from puget.recordlinkage import link_records
+
+
+def _random_strings(n, seed):
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('ABCDE'))
+    return np.array([''.join(rng.choice(letters, rng.randint(1, 12)))
+                     for _ in range(n)], dtype=object)
+
+
+def test_jarowinkler_similarity():
+    s1 = _random_strings(2000, 0)
+    s2 = _random_strings(2000, 1)
+    # Include identical strings and missing values:
+    s2[:100] = s1[:100]
+    s1[100:110] = np.nan
+    s2[105:115] = None
+
+    expected = rl_jarowinkler(pd.Series(s1), pd.Series(s2)).values
+    npt.assert_allclose(pss.jarowinkler_similarity(s1, s2), expected)
+    # Chunking doesn't change the result:
+    npt.assert_allclose(pss.jarowinkler_similarity(s1, s2, chunk_size=7),
+                        expected)
+
+    npt.assert_allclose(pss.jarowinkler_similarity(["MARTHA", "DIXON", ""],
+                                                   ["MARHTA", "DICKSONX",
+                                                    "A"]),
+                        [0.961111, 0.813333, 0.], atol=1e-6)
+
+
+def test_levenshtein_similarity():
+    s1 = _random_strings(2000, 2)
+    s2 = _random_strings(2000, 3)
+    s2[:100] = s1[:100]
+    s1[100:110] = np.nan
+
+    expected = rl_levenshtein(pd.Series(s1), pd.Series(s2)).values
+    npt.assert_allclose(pss.levenshtein_similarity(s1, s2), expected)
+    npt.assert_allclose(pss.levenshtein_similarity(s1, s2, chunk_size=7),
+                        expected)
+
+    npt.assert_allclose(pss.levenshtein_similarity(["KITTEN", "", "A"],
+                                                   ["SITTING", "", ""]),
+                        [1 - 3 / 7., 1., 0.])
+
+
+def test_batch_string_method():
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}}]
+    prelink_ids = pd.DataFrame(data={'pid0': ["PHA0_1", "HMIS0_1", "HMIS0_2",
+                                              "HMIS0_3"],
+                                     'ssn_as_str': ['123456789', '123456789',
+                                                    np.nan, '246801357'],
+                                     'lname': ["QWERT", "QWERT", "QWERT",
+                                               "QWERT"],
+                                     'fname': ["QWERT", "QEWRT", "QWERT",
+                                               "ASDF"],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1977-03-04", "1990-02-01"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    for method in ['jarowinkler', 'levenshtein']:
+        expected = link_records(prelink_ids.copy(), link_list,
+                                string_method=method)
+        linked = link_records(prelink_ids.copy(), link_list,
+                              string_method='batch_' + method)
+        npt.assert_equal(linked["linkage_PID"].values,
+                         expected["linkage_PID"].values)
@@ -0,0 +1,47 @@
+"""Tests for functions in synth.py."""
+import os.path as op
+import tempfile
+import pandas as pd
+import pandas.util.testing as pdt
+
+import puget.preprocess as pp
+from puget.synth import generate, TRUTH_FILE
+
+
+def test_generate():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        truth = generate(temp_dir, n_people=300, duplicate_rate=0.2,
+                         split_rate=0.2, chunk_size=100, seed=0)
+        pdt.assert_frame_equal(pd.read_csv(op.join(temp_dir, TRUTH_FILE)),
+                               truth)
+        assert truth.PersonID.nunique() == 300
+        assert truth.PersonalID.is_unique
+        assert len(truth) > 300
+
+        # Tables are written to the county's folders, by entry year
+        for path in pp.COUNTY_FOLDERS['king']:
+            enrollment = pd.read_csv(op.join(temp_dir, path,
+                                             pp.TABLE_FILES['enrollment']),
+                                     parse_dates=['EntryDate'])
+            assert (enrollment.EntryDate.dt.year == int(path)).all()
+
+        client = pp.read_table(pp.TABLE_FILES['client'], data_dir=temp_dir,
+                               paths=pp.COUNTY_FOLDERS['king'])
+        enrollment = pp.read_table(pp.TABLE_FILES['enrollment'],
+                                   data_dir=temp_dir,
+                                   paths=pp.COUNTY_FOLDERS['king'])
+        disabilities = pp.read_table(pp.TABLE_FILES['disabilities'],
+                                     data_dir=temp_dir,
+                                     paths=pp.COUNTY_FOLDERS['king'])
+        assert set(client.PersonalID) == set(truth.PersonalID)
+        assert set(enrollment.PersonalID) <= set(client.PersonalID)
+        # Some people are enrolled with their household, and some client
+        # rows conflict on DOB
+        assert (enrollment.groupby('HouseholdID').size() > 1).any()
+        assert (client.groupby('PersonalID').DOB.nunique() > 1).any()
+        assert set(disabilities.DataCollectionStage) == {1, 2, 3, 5}
+
+        # The extract goes through the pipeline
+        df = pp.merge_tables(county='king', data_dir=temp_dir, groups=False)
+        assert set(df.PersonalID) == set(client.PersonalID)
+        assert df.ProjectEntryID.dropna().is_unique
@@ -44,3 +44,15 @@ def test_merge_destination():
     pdt.assert_frame_equal(df_merge, df_test)
 
     TF.close()
+
+
+def test_memory_report():
+    before = pd.DataFrame({'flag': [0., 1., 1., 0.], 'name': ['a'] * 4})
+    after = before.astype({'flag': 'boolean', 'name': 'category'})
+    report = pu.memory_report(before, after)
+    assert list(report.index) == ['flag', 'name', 'total']
+    assert report.loc['flag', 'dtype_after'] == 'boolean'
+    assert report.loc['flag', 'bytes_before'] == 32
+    assert report.loc['flag', 'bytes_after'] == 8
+    assert (report.loc['total', 'bytes_after'] ==
+            report.loc[['flag', 'name'], 'bytes_after'].sum())
@@ -1,6 +1,7 @@
 import pandas as pd
 import os.path as op
 import numpy as np
+import warnings
 from puget.data import DATA_PATH
 
 METADATA = op.join(DATA_PATH, 'metadata')
@@ -64,14 +65,47 @@ def update_progress(progress):
     """Progress bar in the console.
     Inspired by
     http://stackoverflow.com/questions/3173320/text-progress-bar-in-the-console
+
+    Deprecated: pass puget.metrics.console_progress (or another callback)
+    as the progress callback of a puget.metrics.RunReport instead.
+
     Parameters
     -----------
     progress : a value (float or int) between 0 and 100 indicating
                percentage progress
     """
+    warnings.warn('update_progress is deprecated, use the progress callback '
+                  'of puget.metrics.RunReport', DeprecationWarning)
     print('\r[%-10s] %0.2f%%' % ('#' * int(progress / 10), progress))
 
 
+def memory_report(before, after):
+    """
+    Memory used by the columns of a DataFrame before and after a conversion
+    (e.g. preprocess.compact_dtypes).
+
+    Parameters
+    ----------
+    before, after : dataframe
+        The DataFrame before and after the conversion, with the same
+        columns.
+
+    Returns
+    ----------
+    dataframe indexed by column, with a last 'total' row, of the dtypes
+    and bytes (counting the strings of object columns) before and after
+    """
+    report = pd.DataFrame({'dtype_before': before.dtypes.astype(str),
+                           'dtype_after': after.dtypes.astype(str),
+                           'bytes_before': before.memory_usage(index=False,
+                                                               deep=True),
+                           'bytes_after': after.memory_usage(index=False,
+                                                             deep=True)})
+    report.loc['total'] = ['', '', report['bytes_before'].sum(),
+                           report['bytes_after'].sum()]
+    return report
+
+
 def clean_ssn(ssn):
     """
     Clean up corner cases for SSN values